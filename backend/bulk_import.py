@@ -0,0 +1,613 @@
+import codecs
+import csv
+import os
+import secrets
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, Optional
+
+# 絶対インポート
+import config
+from bulk_create import insert_urls
+from db_pool import get_pool
+from short_codes import get_allocator
+
+# 見出し行で認識する列名 -> 取り込み時のキー
+COLUMN_ALIASES = {
+    "original_url": "original_url",
+    "url": "original_url",
+    "custom_slug": "custom_slug",
+    "slug": "custom_slug",
+    "custom_name": "custom_name",
+    "name": "custom_name",
+    "campaign_name": "campaign_name",
+    "campaign": "campaign_name"
+}
+# 見出し行が無いファイルの列の並び（submit_recordsが書き出す見出しもこの順）
+POSITIONAL_COLUMNS = ("original_url", "custom_name", "campaign_name", "custom_slug")
+# 失敗行の再試行で読み直せるよう、入力の列も結果CSVに残す（失敗行のshort_codeは指定されたスラッグ）
+RESULT_COLUMNS = ("row", "original_url", "custom_name", "campaign_name", "short_code", "short_url", "status", "error")
+DELIMITERS = {",": ",", "\t": "\t", "comma": ",", "tab": "\t"}
+STATUSES = ("queued", "running", "completed", "failed", "cancelled")
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+# 終了したジョブを記録し続ける件数（古いものからファイルごと削除）
+MAX_FINISHED_JOBS = 50
+
+JOB_COLUMNS = (
+    "id", "kind", "status", "filename", "delimiter", "encoding", "upload_path", "result_path", "parent_id",
+    "total_rows", "processed", "created", "failed", "checkpoint_row", "run_start_processed", "attempts",
+    "cancel_requested", "error", "owner", "submitted_at", "started_at", "heartbeat_at", "finished_at"
+)
+
+
+def create_tables(cursor: sqlite3.Cursor) -> None:
+    """バックグラウンドジョブのテーブルを作成
+
+    checkpoint_rowはコミット済みの最後の入力行番号。チャンクの挿入と同じトランザクションで
+    進めるため、再起動後はその次の行から再開すれば重複も欠落も起きない。
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL DEFAULT 'bulk_import',
+            status TEXT NOT NULL DEFAULT 'queued',
+            filename TEXT,
+            delimiter TEXT NOT NULL DEFAULT ',',
+            encoding TEXT NOT NULL DEFAULT 'utf-8-sig',
+            upload_path TEXT NOT NULL,
+            result_path TEXT NOT NULL,
+            parent_id TEXT,
+            total_rows INTEGER,
+            processed INTEGER NOT NULL DEFAULT 0,
+            created INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            checkpoint_row INTEGER NOT NULL DEFAULT 0,
+            run_start_processed INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            owner TEXT,
+            submitted_at REAL NOT NULL,
+            started_at REAL,
+            heartbeat_at REAL,
+            finished_at REAL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, submitted_at)")
+
+
+def job_to_dict(job: Dict[str, Any], now: float = None) -> Dict[str, Any]:
+    """jobsの行をステータスAPI用の辞書に変換（今回の実行分から処理速度と残り時間を見積もる）"""
+    now = now or time.time()
+    processed = job["processed"] - job["run_start_processed"]
+    elapsed = ((job["finished_at"] or now) - job["started_at"]) if job["started_at"] else 0.0
+    rows_per_sec = processed / elapsed if elapsed > 0 else 0.0
+    eta_seconds = None
+    if job["status"] == "running" and job["total_rows"] is not None and rows_per_sec > 0:
+        eta_seconds = round(max(0, job["total_rows"] - job["processed"]) / rows_per_sec, 1)
+    return {
+        "job_id": job["id"],
+        "parent_id": job["parent_id"],
+        "filename": job["filename"],
+        "status": job["status"],
+        "total_rows": job["total_rows"],
+        "processed": job["processed"],
+        "created": job["created"],
+        "failed": job["failed"],
+        "percent": round(job["processed"] * 100 / job["total_rows"], 1) if job["total_rows"] else None,
+        "rows_per_sec": round(rows_per_sec, 1),
+        "elapsed_seconds": round(elapsed, 1),
+        "eta_seconds": eta_seconds,
+        "attempts": job["attempts"],
+        "cancel_requested": bool(job["cancel_requested"]),
+        "error": job["error"],
+        "submitted_at": job["submitted_at"],
+        "finished_at": job["finished_at"]
+    }
+
+
+class _JobReleased(Exception):
+    """キャンセル・停止・リース喪失でジョブの処理を途中でやめる"""
+
+
+class BulkImporter:
+    """CSV/TSVからのリンク一括生成を行うバックグラウンドジョブ
+
+    ジョブの状態はDBのjobsテーブルに持ち、受け付けたファイルは作業ディレクトリに置く。
+    workers本のワーカースレッドがqueuedのジョブを取り出し、1行ずつ読みながらchunk_size行ごとに
+    1トランザクションで挿入する（書き込みロックもチャンクごとに手放す）。行ごとの結果は結果CSVに追記する。
+
+    実行中のジョブはチャンクごとにheartbeat_atを更新し、lease_seconds以上更新の無いジョブは
+    プロセスが落ちたとみなしてqueuedに戻す。再開時はcheckpoint_rowの次の行から続ける。
+    キャンセルはチャンクの区切りで反映し、コミット済みのリンクは残す。
+
+    build_row(record) -> urlsの行の辞書 で取り込み内容をアプリごとのurls行に変換する
+    （recordはoriginal_url/custom_name/campaign_name/custom_slugのキーを持つ辞書、
+    不正な行はValueErrorのメッセージがその行のエラーになる）。
+    on_created(短縮コードのリスト)はチャンクのコミット後に呼ばれる。
+    """
+
+    def __init__(self, db_path: str, base_url: str, build_row: Callable[[Dict[str, Optional[str]]], Dict[str, Any]],
+                 on_created: Callable[[List[str]], None] = None, chunk_size: int = None,
+                 workers: int = None, work_dir: str = None, lease_seconds: float = None,
+                 poll_seconds: float = None):
+        self.db_path = db_path
+        self.base_url = base_url
+        self.build_row = build_row
+        self.on_created = on_created
+        self.chunk_size = max(1, chunk_size or config.BULK_IMPORT_CHUNK_SIZE)
+        self.workers = max(1, workers or config.BULK_IMPORT_WORKERS)
+        # 再起動後もジョブを再開できるよう、既定ではOSに消される一時ディレクトリではなくDBファイルの隣に置く
+        self.work_dir = work_dir or config.BULK_IMPORT_DIR or f"{db_path}.imports"
+        self.lease_seconds = lease_seconds or config.BULK_JOB_LEASE_SECONDS
+        self.poll_seconds = poll_seconds or config.BULK_JOB_POLL_SECONDS
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+
+        self.submitted = 0
+        self.rows_imported = 0
+        self.resumed = 0
+        self.worker_errors = 0
+
+    def start(self) -> None:
+        """ワーカースレッドを起動（中断されたジョブがあれば続きから処理する）
+
+        jobsテーブルを作成した後（init_dbの後）にアプリのlifespanから呼び、終了時にstop()する。
+        """
+        with self._lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"bulk-import-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """ワーカーを停止（処理中のジョブは今のチャンクのコミット後にqueuedへ戻し、次回の起動で再開）"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        self._stop.set()
+        self._wakeup.set()
+        for thread in threads:
+            thread.join(timeout)
+
+    def submit(self, source: BinaryIO, filename: str = "", delimiter: Optional[str] = None,
+               parent_id: Optional[str] = None) -> Dict[str, Any]:
+        """アップロードされたファイルをジョブとして登録し、すぐに返す（不正な区切り文字はValueError）"""
+        if delimiter and delimiter not in DELIMITERS:
+            raise ValueError("delimiterはcomma（,）かtab（\\t）を指定してください")
+
+        def write_upload(path):
+            # リクエスト終了後も（再起動後も）ワーカーが読めるよう作業ディレクトリにコピーする
+            with open(path, "wb") as f:
+                shutil.copyfileobj(source, f, 1024 * 1024)
+
+        return self._create_job(write_upload, filename or "upload.csv", delimiter, parent_id)
+
+    def submit_records(self, records: Iterable[Dict[str, Optional[str]]], filename: str = "bulk.csv",
+                       parent_id: Optional[str] = None) -> Dict[str, Any]:
+        """JSONなどで受け取った行（POSITIONAL_COLUMNSのキーを持つ辞書）をジョブとして登録"""
+        def write_upload(path):
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(POSITIONAL_COLUMNS)
+                writer.writerows([record.get(column) or "" for column in POSITIONAL_COLUMNS] for record in records)
+
+        return self._create_job(write_upload, filename, ",", parent_id)
+
+    def _create_job(self, write_upload: Callable[[str], None], filename: str, delimiter: Optional[str],
+                    parent_id: Optional[str]) -> Dict[str, Any]:
+        os.makedirs(self.work_dir, exist_ok=True)
+        job_id = secrets.token_hex(8)
+        upload_path = os.path.join(self.work_dir, f"{job_id}.upload")
+        result_path = os.path.join(self.work_dir, f"{job_id}.result.csv")
+        write_upload(upload_path)
+        encoding = _detect_encoding(upload_path)
+        delimiter = DELIMITERS[delimiter] if delimiter else _detect_delimiter(upload_path, encoding, filename)
+
+        with get_pool(self.db_path).writer() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, filename, delimiter, encoding, upload_path, result_path, parent_id, submitted_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, filename, delimiter, encoding, upload_path, result_path, parent_id, time.time())
+            )
+        with self._lock:
+            self.submitted += 1
+        self.start()
+        self._wakeup.set()
+        return self.get(job_id)
+
+    def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        conn = get_pool(self.db_path).reader()
+        try:
+            row = conn.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return dict(zip(JOB_COLUMNS, row)) if row else None
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """ジョブの進捗（存在しない場合はNone）"""
+        job = self._load(job_id)
+        return job_to_dict(job) if job else None
+
+    def list_jobs(self, status: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """新しい順のジョブ一覧（不正なstatusはValueError）"""
+        if status and status not in STATUSES:
+            raise ValueError(f"statusは{', '.join(STATUSES)}のいずれかを指定してください")
+        conn = get_pool(self.db_path).reader()
+        try:
+            rows = conn.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs {'WHERE status = ?' if status else ''} "
+                "ORDER BY submitted_at DESC LIMIT ?",
+                ([status] if status else []) + [max(1, min(limit, 200))]
+            ).fetchall()
+        finally:
+            conn.close()
+        now = time.time()
+        return [job_to_dict(dict(zip(JOB_COLUMNS, row)), now) for row in rows]
+
+    def result_path(self, job_id: str) -> Optional[str]:
+        """終了したジョブの結果CSVのパス（存在しない・未終了の場合はNone）"""
+        job = self._load(job_id)
+        if job is None or job["status"] not in FINISHED_STATUSES or not os.path.exists(job["result_path"]):
+            return None
+        return job["result_path"]
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """ジョブをキャンセル（待機中はその場で、実行中は次のチャンクの前に止まる）。存在しない場合はNone"""
+        with get_pool(self.db_path).writer() as conn:
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row[0] == "queued":
+                conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ?", (time.time(), job_id))
+            elif row[0] == "running":
+                conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+        return self.get(job_id)
+
+    def retry(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """ジョブを再試行し、処理するジョブを返す（存在しない場合はNone、再試行できない状態はValueError）
+
+        失敗・キャンセルしたジョブは同じジョブをqueuedに戻してチェックポイントの続きから再開する。
+        完了したジョブは失敗した行だけを結果CSVから抜き出して新しいジョブ（parent_idが元のジョブ）にする。
+        """
+        job = self._load(job_id)
+        if job is None:
+            return None
+        if job["status"] in ("failed", "cancelled"):
+            if not os.path.exists(job["upload_path"]):
+                raise ValueError("アップロードされたファイルが残っていないため再開できません")
+            with get_pool(self.db_path).writer() as conn:
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', cancel_requested = 0, error = NULL, finished_at = NULL "
+                    "WHERE id = ? AND status = ?",
+                    (job_id, job["status"])
+                )
+            self.start()
+            self._wakeup.set()
+            return self.get(job_id)
+        if job["status"] != "completed":
+            raise ValueError("待機中・実行中のジョブは再試行できません")
+        if not job["failed"]:
+            raise ValueError("再試行する失敗行がありません")
+        if not os.path.exists(job["result_path"]):
+            raise ValueError("結果ファイルが残っていないため再試行できません")
+
+        def failed_records():
+            with open(job["result_path"], encoding="utf-8-sig", newline="") as f:
+                for row in csv.DictReader(f):
+                    if row["status"] == "failed":
+                        yield {
+                            "original_url": row["original_url"],
+                            "custom_name": row["custom_name"],
+                            "campaign_name": row["campaign_name"],
+                            "custom_slug": row["short_code"]
+                        }
+
+        return self.submit_records(failed_records(), f"retry_{job['filename']}", parent_id=job_id)
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                # テーブル作成前（init_db前）などはしばらく待って取り直す
+                print(f"⚠️ 一括取り込みジョブの取得エラー: {e}")
+                self.worker_errors += 1
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_seconds)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """queuedのジョブを1件取り出してrunningにする（リース切れのジョブは先にqueuedへ戻す）"""
+        now = time.time()
+        owner = f"{os.getpid()}:{threading.current_thread().name}"
+        with get_pool(self.db_path).writer() as conn:
+            expired = conn.execute(
+                "UPDATE jobs SET status = 'queued', owner = NULL WHERE status = 'running' AND heartbeat_at < ?",
+                (now - self.lease_seconds,)
+            ).rowcount
+            if expired:
+                print(f"🔁 中断された一括取り込みジョブを再開待ちに戻しました: {expired}件")
+                self.resumed += expired
+            row = conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY submitted_at LIMIT 1").fetchone()
+            if row is None:
+                return None
+            # 別プロセスと取り合った場合に備え、queuedのままのときだけ取る
+            claimed = conn.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, attempts = attempts + 1, started_at = ?, "
+                "heartbeat_at = ?, run_start_processed = processed WHERE id = ? AND status = 'queued'",
+                (owner, now, now, row[0])
+            ).rowcount
+        return self._load(row[0]) if claimed else None
+
+    def _run(self, job: Dict[str, Any]) -> None:
+        try:
+            if job["checkpoint_row"]:
+                print(f"🔁 一括取り込みジョブを{job['checkpoint_row']}行目の次から再開 ({job['id']})")
+            if not os.path.exists(job["upload_path"]):
+                # 置き場所ごと消された等。続きを読めないため再開せず失敗にする
+                raise FileNotFoundError(
+                    f"アップロードされたファイルが見つからないため再開できません: {job['upload_path']}"
+                    "（BULK_IMPORT_DIRを永続的な場所に設定してください）"
+                )
+            # ファイル全体を読む前処理の間もリースが切れないよう、一定間隔でheartbeat_atを更新する
+            self._heartbeat(job, force=True)
+            # 前回の実行でコミットされなかった行の結果を捨ててから追記する
+            _truncate_results(job["result_path"], job["checkpoint_row"], lambda: self._heartbeat(job))
+            if job["total_rows"] is None:
+                total_rows = self._count_rows(job)
+                with get_pool(self.db_path).writer() as conn:
+                    conn.execute("UPDATE jobs SET total_rows = ?, heartbeat_at = ? WHERE id = ?",
+                                 (total_rows, time.time(), job["id"]))
+            with open(job["result_path"], "a", encoding="utf-8-sig", newline="") as result_file:
+                writer = csv.writer(result_file)
+                for chunk in self._read_chunks(job):
+                    if self._stop.is_set():
+                        raise _JobReleased("stopped")
+                    self._import_chunk(job, chunk, writer, result_file)
+            self._finish(job, "completed")
+            try:
+                os.remove(job["upload_path"])
+            except OSError:
+                pass
+            finished = self._load(job["id"]) or job
+            print(f"✅ 一括取り込み完了 ({job['id']}): 作成{finished['created']}件 / 失敗{finished['failed']}件")
+        except _JobReleased as e:
+            if str(e) == "cancelled":
+                print(f"🛑 一括取り込みをキャンセルしました ({job['id']})")
+            elif str(e) == "stopped":
+                # シャットダウン: 次回の起動ですぐ再開できるようリースを返す
+                with get_pool(self.db_path).writer() as conn:
+                    conn.execute("UPDATE jobs SET status = 'queued', owner = NULL WHERE id = ? AND owner = ?",
+                                 (job["id"], job["owner"]))
+        except Exception as e:
+            # コミット済みのチャンクは残し、アップロードも残して再試行（再開）できるようにする
+            print(f"⚠️ 一括取り込みエラー ({job['id']}): {e}")
+            try:
+                checkpoint = (self._load(job["id"]) or job)["checkpoint_row"]
+                _truncate_results(job["result_path"], checkpoint)
+            except Exception:
+                pass
+            self._finish(job, "failed", str(e))
+        self._prune()
+
+    def _finish(self, job: Dict[str, Any], status: str, error: Optional[str] = None) -> None:
+        with get_pool(self.db_path).writer() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ?, owner = NULL WHERE id = ? AND owner = ?",
+                (status, error, time.time(), job["id"], job["owner"])
+            )
+
+    def _open(self, job: Dict[str, Any]):
+        return open(job["upload_path"], encoding=job["encoding"], errors="replace", newline="")
+
+    def _heartbeat(self, job: Dict[str, Any], force: bool = False) -> None:
+        """heartbeat_atを更新（前回からlease_secondsの1/4以上経った時だけ）。リースを失っていれば_JobReleased"""
+        now = time.time()
+        if not force and now - (job["heartbeat_at"] or 0) < self.lease_seconds / 4:
+            return
+        with get_pool(self.db_path).writer() as conn:
+            updated = conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND owner = ?",
+                                   (now, job["id"], job["owner"])).rowcount
+        if not updated:
+            raise _JobReleased("lost")
+        job["heartbeat_at"] = now
+
+    def _count_rows(self, job: Dict[str, Any]) -> int:
+        """ETA用に総行数を数える（引用符内の改行も1行として数えるためcsvで読む）"""
+        count = 0
+        with self._open(job) as f:
+            rows = csv.reader(f, delimiter=job["delimiter"])
+            first = next(rows, None)
+            for index, row in enumerate(rows):
+                if any(cell.strip() for cell in row):
+                    count += 1
+                if index % 10000 == 0:
+                    self._heartbeat(job)
+        if first is None:
+            return 0
+        return count + (0 if _header_columns(first) else 1)
+
+    def _read_chunks(self, job: Dict[str, Any]):
+        """checkpoint_rowより後の(行番号, record)をchunk_size件ずつ返す"""
+        checkpoint = job["checkpoint_row"]
+        with self._open(job) as f:
+            rows = csv.reader(f, delimiter=job["delimiter"])
+            first = next(rows, None)
+            if first is None:
+                return
+            columns = _header_columns(first)
+            row_number = 1
+            chunk = []
+            if columns is None:
+                columns = POSITIONAL_COLUMNS
+                if row_number > checkpoint:
+                    chunk.append((row_number, _record(columns, first)))
+            for row in rows:
+                row_number += 1
+                if row_number <= checkpoint or not any(cell.strip() for cell in row):
+                    continue
+                chunk.append((row_number, _record(columns, row)))
+                if len(chunk) >= self.chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+    def _import_chunk(self, job: Dict[str, Any], chunk: list, writer, result_file) -> None:
+        """1チャンクを挿入し、進捗・チェックポイントと同じトランザクションでコミットする"""
+        results = {}
+        rows = []
+        row_numbers = []
+        for row_number, record in chunk:
+            try:
+                rows.append(self.build_row(record))
+                row_numbers.append(row_number)
+            except ValueError as e:
+                results[row_number] = (record.get("custom_slug"), str(e))
+
+        with get_pool(self.db_path).writer() as conn:
+            owner, cancel_requested = conn.execute(
+                "SELECT owner, cancel_requested FROM jobs WHERE id = ?", (job["id"],)
+            ).fetchone()
+            if owner != job["owner"]:
+                # リースが切れて他のワーカーが引き継いだ
+                raise _JobReleased("lost")
+            if cancel_requested:
+                conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ?, owner = NULL WHERE id = ?",
+                             (time.time(), job["id"]))
+            else:
+                inserted = insert_urls(conn, rows, get_allocator(self.db_path)) if rows else []
+                for row_number, (short_code, error) in zip(row_numbers, inserted):
+                    results[row_number] = (short_code, error)
+                created = sum(1 for short_code, error in results.values() if error is None)
+                conn.execute(
+                    "UPDATE jobs SET processed = processed + ?, created = created + ?, failed = failed + ?, "
+                    "checkpoint_row = ?, heartbeat_at = ? WHERE id = ?",
+                    (len(chunk), created, len(chunk) - created, chunk[-1][0], time.time(), job["id"])
+                )
+                # コミット前に書き、コミットされなかった分は再開時に_truncate_resultsで捨てる
+                writer.writerows(
+                    (
+                        row_number,
+                        record.get("original_url") or "",
+                        record.get("custom_name") or "",
+                        record.get("campaign_name") or "",
+                        results[row_number][0] or "",
+                        f"{self.base_url}/{results[row_number][0]}" if results[row_number][1] is None else "",
+                        "created" if results[row_number][1] is None else "failed",
+                        results[row_number][1] or ""
+                    )
+                    for row_number, record in chunk
+                )
+                result_file.flush()
+        if cancel_requested:
+            # withの中で例外にするとキャンセルの更新まで取り消されるため、コミットしてから抜ける
+            raise _JobReleased("cancelled")
+
+        with self._lock:
+            self.rows_imported += len(chunk)
+        codes = [short_code for short_code, error in inserted if error is None]
+        if codes and self.on_created:
+            self.on_created(codes)
+
+    def _prune(self) -> None:
+        """終了したジョブが多すぎる場合は古いものからファイルごと削除"""
+        with get_pool(self.db_path).writer() as conn:
+            expired = conn.execute(
+                f"SELECT id, upload_path, result_path FROM jobs WHERE status IN ({', '.join('?' for _ in FINISHED_STATUSES)}) "
+                "ORDER BY finished_at DESC LIMIT -1 OFFSET ?",
+                FINISHED_STATUSES + (MAX_FINISHED_JOBS,)
+            ).fetchall()
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id, _, _ in expired])
+        for _, upload_path, result_path in expired:
+            for path in (upload_path, result_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        """一括取り込みの統計を取得（ジョブ数はDB全体、それ以外はこのプロセスの値）"""
+        conn = get_pool(self.db_path).reader()
+        try:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        except sqlite3.Error:
+            counts = {}
+        finally:
+            conn.close()
+        return {
+            "jobs": {status: counts.get(status, 0) for status in STATUSES},
+            "submitted": self.submitted,
+            "rows_imported": self.rows_imported,
+            "resumed": self.resumed,
+            "worker_errors": self.worker_errors,
+            "chunk_size": self.chunk_size,
+            "workers": self.workers,
+            "running_workers": len(self._threads)
+        }
+
+
+def _truncate_results(path: str, checkpoint_row: int, heartbeat: Callable[[], None] = None) -> None:
+    """結果CSVをcheckpoint_row行目までの結果に切り詰める（ファイルが無ければ見出しだけで作る）
+
+    heartbeatは読み進める間に一定行数ごとに呼ばれる。
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8-sig", newline="") as out:
+        writer = csv.writer(out)
+        writer.writerow(RESULT_COLUMNS)
+        if checkpoint_row and os.path.exists(path):
+            with open(path, encoding="utf-8-sig", newline="") as f:
+                rows = csv.reader(f)
+                next(rows, None)
+                for index, row in enumerate(rows):
+                    if row and row[0].isdigit() and int(row[0]) <= checkpoint_row:
+                        writer.writerow(row)
+                    if heartbeat and index % 10000 == 0:
+                        heartbeat()
+    os.replace(temp_path, path)
+
+
+def _detect_encoding(path: str) -> str:
+    """先頭部分がUTF-8として読めなければExcelのCSVに多いcp932とみなす"""
+    with open(path, "rb") as f:
+        head = f.read(64 * 1024)
+    try:
+        # 末尾で文字が途切れていても失敗しないよう、final=Falseで確認する
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "cp932"
+
+
+def _detect_delimiter(path: str, encoding: str, filename: str) -> str:
+    """拡張子（.tsv/.tab）か1行目のタブの有無で区切り文字を決める"""
+    if filename.lower().endswith((".tsv", ".tab")):
+        return "\t"
+    with open(path, encoding=encoding, errors="replace", newline="") as f:
+        first_line = f.readline()
+    return "\t" if "\t" in first_line else ","
+
+
+def _header_columns(row: List[str]) -> Optional[tuple]:
+    """1行目が見出し行なら列ごとの取り込みキー（認識しない列はNone）を返す"""
+    columns = tuple(COLUMN_ALIASES.get(cell.strip().lower()) for cell in row)
+    return columns if "original_url" in columns else None
+
+
+def _record(columns: tuple, row: List[str]) -> Dict[str, Optional[str]]:
+    record = dict.fromkeys(POSITIONAL_COLUMNS)
+    for column, cell in zip(columns, row):
+        if column:
+            record[column] = cell.strip() or None
+    return record
@@ -1,5 +1,18 @@
 import sqlite3
-from config import DB_PATH
+from config import DB_PATH, COLUMNAR_BATCH_SIZE
+from db_pool import get_pool, apply_storage_profile, read_storage_profile, verify_storage_profile
+from rollup import ClickRollup
+import url_listing
+import short_codes
+import bulk_import
+from columnar import ClickColumns
+
+# クリック集計（分析・管理画面は生のclicksではなく集計テーブルを読む）
+click_rollup = ClickRollup(DB_PATH, time_column="created_at", device_column="device_type")
+
+# 列指向の分析エンジン（NumPyがある場合のみ有効）
+click_columns = ClickColumns(DB_PATH, time_column="created_at", device_column="device_type",
+                             browser_column="browser", batch_size=COLUMNAR_BATCH_SIZE)
 
 def init_db() -> bool:
     """データベース初期化"""
@@ -9,6 +22,9 @@ def init_db() -> bool:
         conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
         
+        # ストレージプロファイル適用（WAL・synchronous・mmap等）
+        apply_storage_profile(conn)
+        
         # URLsテーブル（強化版）
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS urls (
@@ -19,7 +35,11 @@ def init_db() -> bool:
                 campaign_name TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 is_active BOOLEAN DEFAULT TRUE,
-                created_by TEXT DEFAULT 'system'
+                created_by TEXT DEFAULT 'system',
+                total_clicks INTEGER NOT NULL DEFAULT 0,
+                qr_clicks INTEGER NOT NULL DEFAULT 0,
+                mobile_clicks INTEGER NOT NULL DEFAULT 0,
+                last_clicked_at TEXT
             )
         ''')
         
@@ -55,7 +75,29 @@ def init_db() -> bool:
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_clicks_url_id ON clicks(url_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_clicks_created_at ON clicks(created_at)')
         
+        # クリック集計テーブル（urlsのカウンタ列・インデックスを含む）
+        ClickRollup.create_tables(cursor)
+        
+        # URL一覧のキーセットページネーション用インデックス
+        url_listing.create_indexes(cursor)
+        short_codes.create_tables(cursor)
+        bulk_import.create_tables(cursor)
+        
         conn.commit()
+        
+        # 未集計のクリックを取り込む（既存DBの初回起動時は全件）
+        applied = click_rollup.apply(conn)
+        conn.commit()
+        if applied:
+            print(f"✅ Click rollup caught up: {applied} clicks")
+        
+        # ストレージプロファイルの確認
+        mismatches = verify_storage_profile(conn)
+        if mismatches:
+            print(f"⚠️ Storage profile not applied: {mismatches}")
+        else:
+            print(f"✅ Storage profile: {read_storage_profile(conn)}")
+        
         conn.close()
         return True
         
@@ -66,5 +108,9 @@ def init_db() -> bool:
         return False
 
 def get_db_connection() -> sqlite3.Connection:
-    """データベース接続を取得"""
-    return sqlite3.connect(DB_PATH)
\ No newline at end of file
+    """データベース接続を取得（プール済みの読み取り専用接続）"""
+    return get_pool(DB_PATH).reader()
+
+def get_write_connection():
+    """書き込み用接続を取得（with文で使用、終了時にcommit）"""
+    return get_pool(DB_PATH).writer()
\ No newline at end of file
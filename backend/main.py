@@ -5,7 +5,15 @@ from datetime import datetime
 from contextlib import asynccontextmanager
 import config
 from routes import redirect_router, shorten_router, analytics_router, bulk_router, export_router, admin_router
-from database import init_db
+from database import init_db, click_rollup, click_columns
+from cache import short_code_cache, dashboard_cache
+from db_pool import get_pool, close_all_pools
+from db_executor import shutdown_executors, executor_stats
+from bloom import short_code_filter
+from short_codes import get_allocator
+from utils import ua_cache
+from routes.redirect import click_queue, click_stream, trending
+from routes.bulk import bulk_importer
 
 # ライフスパンハンドラーを使用
 @asynccontextmanager
@@ -24,10 +32,32 @@ async def lifespan(app: FastAPI):
     else:
         print("❌ Database initialization failed!")
     
+    # 起動時に構築し、以降の取り込みは更新スレッドに任せる（リダイレクトはメモリ上の判定のみ）
+    short_code_filter.rebuild()
+    short_code_filter.start()
+    ua_cache.warm_from_db(config.DB_PATH)
+    click_columns.warm_in_background()
+    # SHORT_CODE_ALLOCATOR=poolならここでプールの補充が始まる
+    get_allocator(config.DB_PATH)
+    click_queue.start()
+    # 再起動前に中断された一括取り込みジョブもここから再開する
+    bulk_importer.start()
+    
     yield  # アプリケーション実行中
     
     # シャットダウン時処理
     print("🛑 Shutting down...")
+    
+    # 実行中の一括取り込みは今のチャンクをコミットしてから待機中に戻す
+    bulk_importer.stop()
+    
+    # 未書き込みのクリックを書き出してから終了
+    click_queue.stop()
+    trending.checkpoint()
+    dashboard_cache.stop()
+    print(f"✅ Click queue drained (written: {click_queue.written}, dropped: {click_queue.dropped})")
+    shutdown_executors()
+    close_all_pools()
 
 app = FastAPI(
     title="Enhanced Link Tracker API", 
@@ -50,7 +80,6 @@ app.include_router(analytics_router)  # /analytics/{short_code}
 app.include_router(bulk_router)       # /bulk と /api/bulk-generate
 app.include_router(shorten_router, prefix="/api")
 app.include_router(export_router, prefix="/api")
-app.include_router(redirect_router)   # 最後に動的なルート {short_code}
 
 # ルートページ
 @app.get("/")
@@ -72,9 +101,25 @@ async def health_check():
         "status": "healthy", 
         "version": "2.0.0",
         "timestamp": datetime.now().isoformat(),
-        "base_url": config.BASE_URL
+        "base_url": config.BASE_URL,
+        "cache": short_code_cache.stats(),
+        "click_queue": click_queue.stats(),
+        "db_pool": get_pool(config.DB_PATH).stats(),
+        "storage": get_pool(config.DB_PATH).storage_stats(),
+        "short_code_filter": short_code_filter.stats(),
+        "ua_cache": ua_cache.stats(),
+        "db_executors": executor_stats(),
+        "click_rollup": click_rollup.stats(),
+        "dashboard_cache": dashboard_cache.stats(),
+        "columnar": click_columns.stats(),
+        "click_stream": click_stream.stats(),
+        "trending": trending.stats(),
+        "short_codes": get_allocator(config.DB_PATH).stats(),
+        "bulk_import": bulk_importer.stats()
     }
 
+app.include_router(redirect_router)   # 最後に動的なルート {short_code}（/health等の後に登録）
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -24,4 +24,5 @@ class BulkGenerationItem(BaseModel):
     campaign_name: Optional[str] = None
 
 class BulkGenerationRequest(BaseModel):
-    items: List[BulkGenerationItem]
\ No newline at end of file
+    items: List[BulkGenerationItem]
+    background: bool = False  # Trueならジョブとして受け付けて即座に返す
\ No newline at end of file
@@ -1,8 +1,15 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import HTMLResponse, StreamingResponse
 import sqlite3
+from typing import Optional
 from config import DB_PATH, BASE_URL
+from database import get_db_connection, click_rollup
+from db_executor import heavy_query
+from cache import dashboard_cache
 from utils import generate_qr_code_base64
+from bloom import short_code_filter
+from url_listing import list_urls, listing_controls_html
+from routes.redirect import click_stream
 
 router = APIRouter()
 
@@ -62,6 +69,7 @@ ADMIN_HTML = """
         </div>
 
         <h2>📋 URL一覧</h2>
+        {{ listing_controls }}
         <table>
             <thead>
                 <tr>
@@ -85,48 +93,63 @@ ADMIN_HTML = """
 </html>
 """
 
-@router.get("/admin")
-async def admin_dashboard():
-    """統計管理画面"""
+@heavy_query
+def load_admin_dashboard():
+    """管理画面の総合統計を集計"""
+    conn = get_db_connection()
     try:
-        conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
         
-        # 総合統計
+        # 総合統計（urlsのカウンタ列から、ユニーク訪問者は集計テーブルの全URL合計の行）
         cursor.execute('''
             SELECT 
-                COUNT(DISTINCT u.id) as total_urls,
-                COUNT(c.id) as total_clicks,
-                COUNT(DISTINCT c.ip_address) as unique_clicks,
-                COUNT(CASE WHEN c.source = 'qr' THEN 1 END) as qr_clicks
+                COUNT(u.id) as total_urls,
+                COALESCE(SUM(u.total_clicks), 0) as total_clicks,
+                COALESCE((SELECT unique_visitors FROM click_rollup_totals
+                          WHERE url_id = 0 AND source = ''), 0) as unique_clicks,
+                COALESCE(SUM(u.qr_clicks), 0) as qr_clicks
             FROM urls u
-            LEFT JOIN clicks c ON u.id = c.url_id
             WHERE u.is_active = TRUE
         ''')
         
-        stats = cursor.fetchone()
+        stats = tuple(cursor.fetchone())
+    finally:
+        conn.close()
+    
+    return stats
+
+@heavy_query
+def load_url_page(**filters):
+    """URL一覧の1ページを取得（キーセットページネーション）"""
+    conn = get_db_connection()
+    try:
+        return list_urls(conn, **filters)
+    finally:
+        conn.close()
+
+@router.get("/admin")
+async def admin_dashboard(sort: str = "created", cursor: Optional[str] = None, limit: int = 50,
+                          campaign: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+                          status: str = "active"):
+    """統計管理画面"""
+    try:
+        # 集計はキャッシュから取得（ANALYTICS_UPDATE_INTERVALごとに裏で更新）
+        stats = await dashboard_cache.get("admin", load_admin_dashboard)
         total_urls, total_clicks, unique_clicks, qr_clicks = stats
         
-        # URL一覧
-        cursor.execute('''
-            SELECT u.short_code, u.original_url, u.created_at, u.custom_name, u.campaign_name,
-                   COUNT(c.id) as click_count,
-                   COUNT(DISTINCT c.ip_address) as unique_clicks,
-                   COUNT(CASE WHEN c.source = 'qr' THEN 1 END) as qr_clicks
-            FROM urls u
-            LEFT JOIN clicks c ON u.id = c.url_id
-            WHERE u.is_active = TRUE
-            GROUP BY u.id
-            ORDER BY u.created_at DESC
-        ''')
-        
-        results = cursor.fetchall()
-        conn.close()
+        # URL一覧は表示するページだけをSQLのLIMITで取得
+        try:
+            page = await load_url_page(sort=sort, cursor=cursor, limit=limit, campaign=campaign,
+                                       start=start, end=end, status=status)
+        except ValueError as e:
+            return HTMLResponse(content=f"<h1>Error</h1><p>{e}</p><p><a href='/admin'>Back</a></p>", status_code=400)
         
         # テーブル行を生成
         table_rows = ""
-        for row in results:
-            short_code, original_url, created_at, custom_name, campaign_name, click_count, unique_count, qr_count = row
+        for url in page["urls"]:
+            short_code, original_url, created_at = url["short_code"], url["original_url"], url["created_at"]
+            custom_name, campaign_name = url["custom_name"], url["campaign_name"]
+            click_count, unique_count, qr_count = url["total_clicks"], url["unique_visitors"], url["qr_clicks"]
             
             table_rows += f"""
                 <tr>
@@ -152,6 +175,7 @@ async def admin_dashboard():
             .replace("{{ total_clicks }}", str(total_clicks)) \
             .replace("{{ unique_clicks }}", str(unique_clicks)) \
             .replace("{{ qr_clicks }}", str(qr_clicks)) \
+            .replace("{{ listing_controls }}", listing_controls_html("/admin", page)) \
             .replace("{{ table_rows }}", table_rows)
         
         return HTMLResponse(content=html_content)
@@ -160,3 +184,90 @@ async def admin_dashboard():
         error_html = f"<h1>Error</h1><p>{str(e)}</p>"
         return HTMLResponse(content=error_html, status_code=500)
 
+@router.get("/admin/urls")
+async def get_admin_urls(sort: str = "created", cursor: Optional[str] = None, limit: int = 50,
+                         campaign: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+                         status: str = "active"):
+    """URL一覧（sort=created/clicks、next_cursorを次のリクエストのcursorに指定してページ送り）"""
+    try:
+        return await load_url_page(sort=sort, cursor=cursor, limit=limit, campaign=campaign,
+                                   start=start, end=end, status=status)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid sort, status, cursor or date (use YYYY-MM-DD)")
+
+@router.get("/admin/clicks/stream")
+async def stream_clicks(request: Request, short_code: Optional[str] = None, campaign: Optional[str] = None,
+                        backlog: int = 0, last_event_id: Optional[str] = None):
+    """クリックのライブ配信（Server-Sent Events、再接続時はLast-Event-IDの次から再開）"""
+    last_event_id = request.headers.get("last-event-id") or last_event_id
+
+    events = click_stream.subscribe(short_code=short_code, campaign=campaign,
+                                    last_event_id=last_event_id, backlog=backlog)
+    try:
+        # 接続数の上限はここで判定する（retry行を先に取り出す）
+        first = await events.__anext__()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    except OverflowError:
+        raise HTTPException(status_code=503, detail="Too many live stream subscribers")
+
+    async def body():
+        try:
+            yield first
+            async for chunk in events:
+                yield chunk
+        finally:
+            # 切断時に購読を解除
+            await events.aclose()
+
+    return StreamingResponse(body(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+@router.get("/admin/click-stream")
+async def get_click_stream_stats():
+    """クリックのライブ配信の統計（接続数・取りこぼし件数など）"""
+    return click_stream.stats()
+
+@router.get("/admin/short-code-filter")
+async def get_short_code_filter_stats():
+    """短縮コードフィルタの統計（偽陽性率など）"""
+    return short_code_filter.stats()
+
+@router.post("/admin/short-code-filter/rebuild")
+@heavy_query
+def rebuild_short_code_filter():
+    """短縮コードフィルタをurlsテーブルから再構築"""
+    try:
+        return short_code_filter.rebuild()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Filter rebuild failed: {str(e)}")
+
+@router.get("/admin/dashboard-cache")
+async def get_dashboard_cache_stats():
+    """管理画面の集計キャッシュの統計"""
+    return dashboard_cache.stats()
+
+@router.get("/admin/click-rollup")
+async def get_click_rollup_stats():
+    """クリック集計の統計（未集計のクリック数など）"""
+    return click_rollup.stats()
+
+@router.post("/admin/click-rollup/rebuild")
+@heavy_query
+def rebuild_click_rollup():
+    """クリック集計をclicksテーブルから再構築"""
+    try:
+        return click_rollup.rebuild()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Rollup rebuild failed: {str(e)}")
+
+@router.post("/admin/url-counters/reconcile")
+@heavy_query
+def reconcile_url_counters():
+    """urlsのクリック数カウンタをclicksテーブルから数え直して修正"""
+    try:
+        return click_rollup.reconcile_url_counters()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Counter reconcile failed: {str(e)}")
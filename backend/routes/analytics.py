@@ -1,9 +1,13 @@
 from fastapi import APIRouter, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse
 import sqlite3
 from datetime import datetime, timedelta
 from typing import Dict, Any
 from config import DB_PATH, BASE_URL
+from database import get_db_connection, click_rollup, click_columns
+from rollup import ALL_URLS
+from db_executor import heavy_query
+from routes.redirect import trending
 
 router = APIRouter()
 
@@ -111,10 +115,11 @@ ANALYTICS_HTML = """<!DOCTYPE html>
 </html>"""
 
 @router.get("/analytics/{short_code}")
-async def analytics_page(short_code: str):
+@heavy_query
+def analytics_page(short_code: str):
     """分析画面"""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         # URL情報取得
@@ -129,14 +134,15 @@ async def analytics_page(short_code: str):
         
         original_url, created_at, custom_name, campaign_name = result
         
-        # 統計情報取得
+        # 統計情報取得（集計テーブルから）
         cursor.execute('''
             SELECT 
-                COUNT(*) as total_clicks,
-                COUNT(DISTINCT ip_address) as unique_clicks,
-                COUNT(CASE WHEN source = 'qr' THEN 1 END) as qr_clicks
-            FROM clicks 
-            WHERE url_id = (SELECT id FROM urls WHERE short_code = ?)
+                u.total_clicks as total_clicks,
+                COALESCE(t.unique_visitors, 0) as unique_clicks,
+                u.qr_clicks as qr_clicks
+            FROM urls u
+            LEFT JOIN click_rollup_totals t ON t.url_id = u.id AND t.source = ''
+            WHERE u.short_code = ?
         ''', (short_code,))
         
         stats = cursor.fetchone()
@@ -161,6 +167,111 @@ async def analytics_page(short_code: str):
         error_html = f"<h1>Error</h1><p>{str(e)}</p>"
         return HTMLResponse(content=error_html, status_code=500)
 
+def _filter_values(value):
+    # カンマ区切りで複数指定できる条件
+    return [item for item in value.split(",") if item] if value else None
+
+@router.get("/api/clicks/query")
+@heavy_query
+def query_clicks(group_by: str = None, short_code: str = None, campaign: str = None, source: str = None,
+                 device: str = None, browser: str = None, start: str = None, end: str = None, limit: int = 100):
+    """クリックの絞り込み・集計API（列指向エンジン。条件はカンマ区切りで複数指定可、start/endはUTCの日付）"""
+    if not click_columns.enabled:
+        raise HTTPException(status_code=503, detail="Columnar analytics requires NumPy")
+    
+    url_id = None
+    if short_code:
+        conn = get_db_connection()
+        try:
+            row = conn.execute("SELECT id FROM urls WHERE short_code = ?", (short_code,)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            raise HTTPException(status_code=404, detail="Short URL not found")
+        url_id = row[0]
+    
+    try:
+        result = click_columns.query(
+            group_by=group_by, url_id=url_id, campaign=_filter_values(campaign), source=_filter_values(source),
+            device=_filter_values(device), browser=_filter_values(browser), start=start, end=end,
+            limit=max(1, min(limit, 1000))
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail="Invalid group_by or date (use YYYY-MM-DD)")
+    
+    return JSONResponse({"short_code": short_code, **result})
+
+@router.get("/api/heatmap")
+@heavy_query
+def get_heatmap(short_code: str = None, tz: str = "UTC"):
+    """曜日×時間帯のヒートマップAPI（tz=UTC/JST、short_code省略時は全リンク）"""
+    conn = get_db_connection()
+    try:
+        url_id = ALL_URLS
+        if short_code:
+            row = conn.execute("SELECT id FROM urls WHERE short_code = ?", (short_code,)).fetchone()
+            if not row:
+                raise HTTPException(status_code=404, detail="Short URL not found")
+            url_id = row[0]
+        
+        result = click_rollup.heatmap(conn, url_id=url_id, timezone=tz)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="tz must be UTC or JST")
+    finally:
+        conn.close()
+    
+    return JSONResponse({"short_code": short_code, **result})
+
+@router.get("/api/trending")
+async def get_trending(window: str = "1h", by: str = "url", limit: int = 10):
+    """直近のクリック数上位API（window=5m/1h/24h、by=url/campaign。SQLiteを使わない近似値）"""
+    try:
+        result = trending.top(window=window, dimension=by, limit=max(1, min(limit, 100)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="window must be 5m, 1h or 24h and by must be url or campaign")
+    return JSONResponse(result)
+
+@router.get("/api/unique-visitors")
+@heavy_query
+def get_unique_visitors(short_code: str = None, campaign: str = None, start: str = None, end: str = None):
+    """ユニーク訪問者数API（期間・キャンペーン指定時はHyperLogLogの近似値、exactで区別）"""
+    if short_code and campaign:
+        raise HTTPException(status_code=400, detail="Specify either short_code or campaign, not both")
+    
+    conn = get_db_connection()
+    try:
+        url_id = ALL_URLS
+        if short_code:
+            row = conn.execute("SELECT id FROM urls WHERE short_code = ?", (short_code,)).fetchone()
+            if not row:
+                raise HTTPException(status_code=404, detail="Short URL not found")
+            url_id = row[0]
+        
+        result = click_rollup.unique_visitors(conn, url_id=url_id, campaign_name=campaign, start=start, end=end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    finally:
+        conn.close()
+    
+    return JSONResponse({"short_code": short_code, "campaign": campaign, "start": start, "end": end, **result})
+
+@router.get("/api/analytics/campaign/{campaign_name}")
+@heavy_query
+def get_campaign_analytics(campaign_name: str, days: int = 30):
+    """キャンペーン分析API（キャンペーン集計から作成するためリンク数が多くてもclicksを走査しない）"""
+    conn = get_db_connection()
+    try:
+        report = click_rollup.campaign_report(conn, campaign_name, days=max(1, min(days, 365)))
+    finally:
+        conn.close()
+    
+    if report is None:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    
+    for url in report["urls"]:
+        url["analytics_url"] = f"{BASE_URL}/analytics/{url['short_code']}"
+    return JSONResponse(report)
+
 # 既存のAPIエンドポイントはそのまま保持
 async def get_detailed_analytics(short_code: str) -> Dict[str, Any]:
     """詳細な分析データを取得（API用）"""
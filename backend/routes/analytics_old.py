@@ -3,25 +3,27 @@ import sqlite3
 from datetime import datetime, timedelta
 from typing import Dict, Any
 from config import DB_PATH, BASE_URL
+from database import get_db_connection, click_rollup
+from db_executor import heavy_query
 
 router = APIRouter()
 
-async def get_detailed_analytics(short_code: str) -> Dict[str, Any]:
+@heavy_query
+def get_detailed_analytics(short_code: str) -> Dict[str, Any]:
     """詳細な分析データを取得"""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db_connection()
         cursor = conn.cursor()
         
-        # 基本情報取得
+        # 基本情報取得（クリック統計は集計テーブルから）
         cursor.execute('''
             SELECT u.id, u.original_url, u.created_at, u.custom_name, u.campaign_name,
-                   COUNT(c.id) as total_clicks,
-                   COUNT(DISTINCT c.ip_address) as unique_clicks,
-                   COUNT(CASE WHEN c.source = 'qr' THEN 1 END) as qr_clicks
+                   u.total_clicks as total_clicks,
+                   COALESCE(t.unique_visitors, 0) as unique_clicks,
+                   u.qr_clicks as qr_clicks
             FROM urls u
-            LEFT JOIN clicks c ON u.id = c.url_id
+            LEFT JOIN click_rollup_totals t ON t.url_id = u.id AND t.source = ''
             WHERE u.short_code = ? AND u.is_active = TRUE
-            GROUP BY u.id
         ''', (short_code,))
         
         result = cursor.fetchone()
@@ -30,22 +32,22 @@ async def get_detailed_analytics(short_code: str) -> Dict[str, Any]:
         
         url_id, original_url, created_at, custom_name, campaign_name, total_clicks, unique_clicks, qr_clicks = result
         
-        # 時系列データ
+        # 時系列データ（直近30日、日単位）
         cursor.execute('''
-            SELECT date(created_at) as date, COUNT(*) as clicks,
-                   COUNT(CASE WHEN source = 'qr' THEN 1 END) as qr_clicks
-            FROM clicks
-            WHERE url_id = ? AND created_at >= datetime('now', '-30 days')
-            GROUP BY date
-            ORDER BY date
+            SELECT day as date, SUM(clicks) as clicks,
+                   SUM(CASE WHEN source = 'qr' THEN clicks ELSE 0 END) as qr_clicks
+            FROM click_rollup_hourly
+            WHERE url_id = ? AND day >= date('now', '-30 days')
+            GROUP BY day
+            ORDER BY day
         ''', (url_id,))
         
         daily_data = cursor.fetchall()
         
         # デバイス別統計
         cursor.execute('''
-            SELECT device_type, COUNT(*) as count
-            FROM clicks
+            SELECT device_type, SUM(clicks) as count
+            FROM click_rollup_hourly
             WHERE url_id = ?
             GROUP BY device_type
             ORDER BY count DESC
@@ -55,16 +57,15 @@ async def get_detailed_analytics(short_code: str) -> Dict[str, Any]:
         
         # 参照元別統計
         cursor.execute('''
-            SELECT source, COUNT(*) as count
-            FROM clicks
-            WHERE url_id = ?
-            GROUP BY source
+            SELECT source, clicks as count
+            FROM click_rollup_totals
+            WHERE url_id = ? AND source != ''
             ORDER BY count DESC
         ''', (url_id,))
         
         source_data = cursor.fetchall()
         
-        # 地域別統計
+        # 地域別統計（国は集計の軸に含めないため生データから）
         cursor.execute('''
             SELECT country, COUNT(*) as count
             FROM clicks
@@ -76,33 +77,10 @@ async def get_detailed_analytics(short_code: str) -> Dict[str, Any]:
         
         geo_data = cursor.fetchall()
         
-        # 時間帯別統計
-        cursor.execute('''
-            SELECT hour_of_day, COUNT(*) as count
-            FROM clicks
-            WHERE url_id = ? AND hour_of_day IS NOT NULL
-            GROUP BY hour_of_day
-            ORDER BY hour_of_day
-        ''', (url_id,))
-        
-        hourly_data = [0] * 24
-        for hour, count in cursor.fetchall():
-            if 0 <= hour < 24:
-                hourly_data[hour] = count
-        
-        # 曜日別統計
-        cursor.execute('''
-            SELECT day_of_week, COUNT(*) as count
-            FROM clicks
-            WHERE url_id = ? AND day_of_week IS NOT NULL
-            GROUP BY day_of_week
-            ORDER BY day_of_week
-        ''', (url_id,))
-        
-        weekly_data = [0] * 7
-        for day, count in cursor.fetchall():
-            if 0 <= day < 7:
-                weekly_data[day] = count
+        # 時間帯別・曜日別統計（取り込み時に更新しているヒートマップから、UTC・月曜=0）
+        heatmap = click_rollup.heatmap(conn, url_id, "UTC")
+        hourly_data = heatmap["by_hour"]
+        weekly_data = heatmap["by_weekday"]
         
         conn.close()
         
@@ -124,11 +102,11 @@ async def get_detailed_analytics(short_code: str) -> Dict[str, Any]:
         daily_details = []
         for date, clicks, qr_clicks in daily_data:
             cursor.execute('''
-                SELECT device_type, source, COUNT(*) 
-                FROM clicks 
-                WHERE url_id = ? AND date(created_at) = ?
+                SELECT device_type, source, SUM(clicks) as count
+                FROM click_rollup_hourly 
+                WHERE url_id = ? AND day = ?
                 GROUP BY device_type, source 
-                ORDER BY COUNT(*) DESC 
+                ORDER BY count DESC 
                 LIMIT 1
             ''', (url_id, date))
             
@@ -152,6 +130,7 @@ async def get_detailed_analytics(short_code: str) -> Dict[str, Any]:
             'campaign_name': campaign_name,
             'total_clicks': total_clicks,
             'unique_clicks': unique_clicks,
+            'unique_clicks_exact': True,
             'qr_clicks': qr_clicks,
             'click_rate': (qr_clicks / total_clicks * 100) if total_clicks > 0 else 0,
             'short_url': f"{BASE_URL}/{short_code}",
@@ -178,83 +157,22 @@ async def get_stats(short_code: str):
     return await get_detailed_analytics(short_code)
 
 @router.get("/analytics/campaign/{campaign_name}")
-async def get_campaign_analytics(campaign_name: str):
-    """キャンペーン別の分析データを取得"""
+@heavy_query
+def get_campaign_analytics(campaign_name: str):
+    """キャンペーン別の分析データを取得（キャンペーン集計から作成）"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # キャンペーンのURL一覧と統計
-        cursor.execute('''
-            SELECT u.short_code, u.original_url, u.custom_name,
-                   COUNT(c.id) as clicks,
-                   COUNT(DISTINCT c.ip_address) as unique_visitors,
-                   COUNT(CASE WHEN c.source = 'qr' THEN 1 END) as qr_clicks
-            FROM urls u
-            LEFT JOIN clicks c ON u.id = c.url_id
-            WHERE u.campaign_name = ? AND u.is_active = TRUE
-            GROUP BY u.id
-            ORDER BY clicks DESC
-        ''', (campaign_name,))
+        conn = get_db_connection()
+        try:
+            report = click_rollup.campaign_report(conn, campaign_name)
+        finally:
+            conn.close()
         
-        urls_data = cursor.fetchall()
-        
-        if not urls_data:
+        if report is None:
             raise HTTPException(status_code=404, detail="Campaign not found")
         
-        # 総計算
-        total_clicks = sum(row[3] for row in urls_data)
-        total_unique = sum(row[4] for row in urls_data)
-        total_qr = sum(row[5] for row in urls_data)
-        
-        # 時系列データ
-        cursor.execute('''
-            SELECT date(c.created_at) as date, COUNT(*) as clicks
-            FROM clicks c
-            JOIN urls u ON c.url_id = u.id
-            WHERE u.campaign_name = ?
-            AND c.created_at >= datetime('now', '-30 days')
-            GROUP BY date
-            ORDER BY date
-        ''', (campaign_name,))
-        
-        daily_data = cursor.fetchall()
-        
-        # デバイス別統計
-        cursor.execute('''
-            SELECT c.device_type, COUNT(*) as count
-            FROM clicks c
-            JOIN urls u ON c.url_id = u.id
-            WHERE u.campaign_name = ?
-            GROUP BY c.device_type
-            ORDER BY count DESC
-        ''', (campaign_name,))
-        
-        device_data = cursor.fetchall()
-        
-        conn.close()
-        
-        return {
-            "campaign_name": campaign_name,
-            "summary": {
-                "total_urls": len(urls_data),
-                "total_clicks": total_clicks,
-                "unique_visitors": total_unique,
-                "qr_clicks": total_qr,
-                "conversion_rate": f"{(total_qr/max(total_clicks, 1)*100):.1f}%"
-            },
-            "urls": [{
-                "short_code": row[0],
-                "original_url": row[1],
-                "custom_name": row[2],
-                "clicks": row[3],
-                "unique_visitors": row[4],
-                "qr_clicks": row[5],
-                "analytics_url": f"{BASE_URL}/analytics/{row[0]}"
-            } for row in urls_data],
-            "daily_performance": [{"date": d[0], "clicks": d[1]} for d in daily_data],
-            "device_breakdown": [{"device": d[0], "count": d[1]} for d in device_data]
-        }
+        for url in report["urls"]:
+            url["analytics_url"] = f"{BASE_URL}/analytics/{url['short_code']}"
+        return report
         
     except HTTPException:
         raise
@@ -1,10 +1,18 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import APIRouter, HTTPException, File, UploadFile, Form
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
 import sqlite3
+from datetime import datetime, timezone
 from typing import List, Dict, Any
 from models import BulkGenerationRequest, BulkGenerationItem
 from config import DB_PATH, BASE_URL
-from utils import generate_short_code, generate_qr_code_base64
+from database import get_write_connection
+from db_executor import fast_query, heavy_query
+from utils import generate_qr_code_base64
+from cache import invalidate_url
+from bloom import short_code_filter
+from bulk_create import insert_urls, ERROR_ALREADY_EXISTS
+from bulk_import import BulkImporter
+from short_codes import get_allocator
 
 router = APIRouter()
 
@@ -366,75 +374,162 @@ async def bulk_generation_page():
     return HTMLResponse(content=BULK_HTML)
 
 @router.post("/bulk-generate")
-async def bulk_generate_urls(request: BulkGenerationRequest):
-    """複数URLを一括生成"""
+@heavy_query
+def bulk_generate_urls(request: BulkGenerationRequest):
+    """複数URLを一括生成（1トランザクション・1回のexecutemanyで挿入）
+
+    background=trueならジョブとして受け付けて即座に返す（進捗は/bulk-jobs/{job_id}）。
+    """
+    if request.background:
+        job = bulk_importer.submit_records(
+            {
+                "original_url": item.original_url,
+                "custom_name": item.custom_name,
+                "campaign_name": item.campaign_name,
+                "custom_slug": item.custom_slug
+            }
+            for item in request.items
+        )
+        return JSONResponse(job, status_code=202)
+    
     results = []
     errors = []
     
+    # created_atのDEFAULT CURRENT_TIMESTAMPと同じ形式で先に決め、挿入後の読み直しを省く
+    created_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    rows = [{
+        "short_code": item.custom_slug,
+        "original_url": item.original_url,
+        "custom_name": item.custom_name,
+        "campaign_name": item.campaign_name,
+        "created_by": "bulk_api",
+        "created_at": created_at
+    } for item in request.items]
+    
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        for item in request.items:
-            try:
-                # カスタムスラッグのチェック
-                short_code = item.custom_slug
-                if short_code:
-                    cursor.execute("SELECT id FROM urls WHERE short_code = ?", (short_code,))
-                    if cursor.fetchone():
-                        raise HTTPException(status_code=400, detail=f"Custom slug '{short_code}' already exists")
-                else:
-                    short_code = generate_short_code(conn=conn)
-                
-                # URLを保存
-                cursor.execute('''
-                    INSERT INTO urls (short_code, original_url, custom_name, campaign_name, created_by) 
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (short_code, item.original_url, item.custom_name, item.campaign_name, 'bulk_api'))
-                
-                # 作成時刻取得
-                cursor.execute("SELECT created_at FROM urls WHERE short_code = ?", (short_code,))
-                created_at = cursor.fetchone()[0]
-                
-                # URL生成
-                short_url = f"{BASE_URL}/{short_code}"
-                qr_url = f"{BASE_URL}/{short_code}?source=qr"
-                qr_code_base64 = generate_qr_code_base64(qr_url)
-                
-                results.append({
-                    "original_url": item.original_url,
-                    "custom_slug": item.custom_slug,
-                    "custom_name": item.custom_name,
-                    "campaign_name": item.campaign_name,
-                    "generated_urls": [{
-                        "short_code": short_code,
-                        "short_url": short_url,
-                        "qr_url": qr_url,
-                        "qr_code_base64": qr_code_base64,
-                        "created_at": created_at
-                    }]
-                })
-                
-            except HTTPException as he:
-                errors.append({
-                    "original_url": item.original_url,
-                    "error": he.detail
-                })
-            except Exception as e:
-                errors.append({
-                    "original_url": item.original_url,
-                    "error": str(e)
-                })
+        with get_write_connection() as conn:
+            inserted = insert_urls(conn, rows, get_allocator(DB_PATH))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Bulk generation failed: {str(e)}")
+    
+    for item, (short_code, error) in zip(request.items, inserted):
+        if error:
+            errors.append({
+                "original_url": item.original_url,
+                "error": f"Custom slug '{short_code}' already exists" if error == ERROR_ALREADY_EXISTS
+                         else f"Custom slug '{short_code}' is duplicated in this request"
+            })
+            continue
         
-        conn.commit()
-        conn.close()
+        invalidate_url(short_code)
+        short_code_filter.add(short_code)
         
-        return {
-            "success_count": len(results),
-            "error_count": len(errors),
-            "results": results,
-            "errors": errors
-        }
+        # URL生成
+        short_url = f"{BASE_URL}/{short_code}"
+        qr_url = f"{BASE_URL}/{short_code}?source=qr"
+        qr_code_base64 = generate_qr_code_base64(qr_url)
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Bulk generation failed: {str(e)}")
\ No newline at end of file
+        results.append({
+            "original_url": item.original_url,
+            "custom_slug": item.custom_slug,
+            "custom_name": item.custom_name,
+            "campaign_name": item.campaign_name,
+            "generated_urls": [{
+                "short_code": short_code,
+                "short_url": short_url,
+                "qr_url": qr_url,
+                "qr_code_base64": qr_code_base64,
+                "created_at": created_at
+            }]
+        })
+    
+    return {
+        "success_count": len(results),
+        "error_count": len(errors),
+        "results": results,
+        "errors": errors
+    }
+
+def _build_import_row(record: Dict[str, Any]) -> Dict[str, Any]:
+    """取り込みファイルの1行をurlsの行に変換（URLが空の行はValueError）"""
+    if not record["original_url"]:
+        raise ValueError("original_url is required")
+    return {
+        "short_code": record["custom_slug"],
+        "original_url": record["original_url"],
+        "custom_name": record["custom_name"],
+        "campaign_name": record["campaign_name"],
+        "created_by": "bulk_upload",
+        "created_at": datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+def _on_imported(short_codes: List[str]) -> None:
+    for short_code in short_codes:
+        invalidate_url(short_code)
+        short_code_filter.add(short_code)
+
+bulk_importer = BulkImporter(DB_PATH, BASE_URL, _build_import_row, _on_imported)
+
+@router.post("/bulk-upload", status_code=202)
+@heavy_query
+def bulk_upload(file: UploadFile = File(...), delimiter: str = Form(None)):
+    """CSV/TSVファイルから一括生成（ジョブを受け付けて即座に返し、取り込みはバックグラウンドで行う）
+
+    列はoriginal_url, custom_name, campaign_name, custom_slugの順（見出し行があれば列名で判定）。
+    進捗は/bulk-jobs/{job_id}、行ごとの結果は/bulk-jobs/{job_id}/resultで取得する。
+    """
+    try:
+        job = bulk_importer.submit(file.file, file.filename, delimiter)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="delimiter must be comma or tab")
+    return JSONResponse(job, status_code=202)
+
+@router.get("/bulk-jobs")
+@fast_query
+def list_bulk_jobs(status: str = None, limit: int = 20):
+    """一括生成ジョブの一覧（新しい順）"""
+    try:
+        return {"jobs": bulk_importer.list_jobs(status, limit)}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid status")
+
+@router.get("/bulk-jobs/{job_id}")
+@fast_query
+def get_bulk_job(job_id: str):
+    """一括生成ジョブの進捗（処理済み・失敗件数、残り時間の見込み）"""
+    job = bulk_importer.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.post("/bulk-jobs/{job_id}/cancel")
+@fast_query
+def cancel_bulk_job(job_id: str):
+    """一括生成ジョブをキャンセル（作成済みのリンクは残る）"""
+    job = bulk_importer.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.post("/bulk-jobs/{job_id}/retry", status_code=202)
+@heavy_query
+def retry_bulk_job(job_id: str):
+    """失敗・キャンセルしたジョブは続きから再開し、完了したジョブは失敗行だけを新しいジョブにする"""
+    try:
+        job = bulk_importer.retry(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=f"Job cannot be retried: {e}")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JSONResponse(job, status_code=202)
+
+@router.get("/bulk-jobs/{job_id}/result")
+@fast_query
+def get_bulk_job_result(job_id: str):
+    """一括生成ジョブの結果CSV（行番号・短縮URL・エラー）"""
+    if bulk_importer.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    path = bulk_importer.result_path(job_id)
+    if path is None:
+        raise HTTPException(status_code=409, detail="Job has not finished yet")
+    return FileResponse(path, media_type="text/csv; charset=utf-8", filename=f"bulk_result_{job_id}.csv")
@@ -5,14 +5,17 @@ import csv
 import io
 from datetime import datetime
 from config import DB_PATH
+from database import get_db_connection
+from db_executor import heavy_query
 
 router = APIRouter()
 
 @router.get("/export/csv/{short_code}")
-async def export_clicks_csv(short_code: str):
+@heavy_query
+def export_clicks_csv(short_code: str):
     """クリックデータをCSVでエクスポート"""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         # URL存在確認
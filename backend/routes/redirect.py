@@ -1,16 +1,55 @@
 from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import RedirectResponse
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional
 from config import DB_PATH
+from database import get_db_connection, click_rollup
+from db_executor import run_fast
 from utils import get_location_info, parse_user_agent, parse_utm_parameters
+from cache import get_cached_url, cache_url
+from bloom import short_code_filter
+from click_queue import ClickIngestQueue
+from click_stream import ClickStream
+from trending import TrendingTracker
+from referrer_classifier import simple_classifier
 
 router = APIRouter()
 
+# クリック記録キュー（リダイレクト応答とは切り離してまとめて書き込む）
+click_queue = ClickIngestQueue(DB_PATH, columns=(
+    "url_id", "ip_address", "country", "region", "city", "timezone",
+    "user_agent", "referrer", "device_type", "browser", "os", "source",
+    "utm_source", "utm_medium", "utm_campaign",
+    "hour_of_day", "day_of_week", "created_at"
+))
+
+# クリックの書き込みと同じトランザクションで集計テーブルを更新
+click_queue.add_listener(click_rollup.apply)
+
+# コミット済みのクリックをライブ配信（管理画面のSSE）へ流す
+click_stream = ClickStream(DB_PATH)
+click_queue.add_commit_listener(click_stream.publish)
+
+# トレンド（直近5分・1時間・24時間のクリック上位）をSQLiteを介さずに集計
+trending = TrendingTracker(DB_PATH, resolve_urls=click_stream.lookup_urls)
+click_queue.add_commit_listener(trending.record)
+
 # 除外するパスのリスト
 EXCLUDED_PATHS = {'admin', 'bulk', 'docs', 'health', 'analytics', 'api', 'favicon.ico'}
 
+def lookup_short_code(short_code: str):
+    """短縮コードから(id, original_url, is_active)を取得"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT id, original_url, is_active FROM urls WHERE short_code = ?",
+        (short_code,)
+    )
+    result = cursor.fetchone()
+    conn.close()
+    return result
+
 @router.get("/{short_code}")
 async def redirect_url(short_code: str, request: Request, source: Optional[str] = None):
     """リダイレクト処理"""
@@ -19,25 +58,27 @@ async def redirect_url(short_code: str, request: Request, source: Optional[str]
     if short_code in EXCLUDED_PATHS:
         raise HTTPException(status_code=404, detail="Not Found")
     
-    print(f"🔍 Looking for short_code: '{short_code}'")
+    # URL取得（キャッシュ優先）
+    cached = get_cached_url(short_code)
+    
+    # 存在しないコードはログ出力・DB問い合わせなしで404
+    if cached is None and not short_code_filter.might_exist(short_code):
+        raise HTTPException(status_code=404, detail=f"Short URL '{short_code}' not found")
     
+    # 正常系はリクエストごとにログを出さない（エラー時のみ出力）
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        if cached is None:
+            # イベントループを止めないようfastプールで検索
+            result = await run_fast(lookup_short_code, short_code)
+            if result:
+                cached = cache_url(short_code, *result)
+            else:
+                short_code_filter.record_false_positive()
         
-        # URL取得
-        cursor.execute(
-            "SELECT id, original_url FROM urls WHERE short_code = ? AND is_active = TRUE",
-            (short_code,)
-        )
-        result = cursor.fetchone()
-        
-        if not result:
-            print(f"❌ URL not found for short_code: '{short_code}'")
+        if not cached or not cached[2]:
             raise HTTPException(status_code=404, detail=f"Short URL '{short_code}' not found")
         
-        url_id, original_url = result
-        print(f"✅ Found URL: {short_code} -> {original_url}")
+        url_id, original_url, _ = cached
         
         # クリック情報記録
         try:
@@ -54,53 +95,39 @@ async def redirect_url(short_code: str, request: Request, source: Optional[str]
             if source == "qr":
                 click_source = "qr"
             elif referrer:
-                referrer_lower = referrer.lower()
-                if any(domain in referrer_lower for domain in ["twitter.com", "t.co", "x.com"]):
-                    click_source = "twitter"
-                elif "facebook.com" in referrer_lower or "fb.me" in referrer_lower:
-                    click_source = "facebook"
-                elif "google.com" in referrer_lower:
-                    click_source = "google"
-                elif "youtube.com" in referrer_lower or "youtu.be" in referrer_lower:
-                    click_source = "youtube"
-                elif "instagram.com" in referrer_lower:
-                    click_source = "instagram"
-                elif "linkedin.com" in referrer_lower:
-                    click_source = "linkedin"
-                elif "tiktok.com" in referrer_lower:
-                    click_source = "tiktok"
-                else:
-                    click_source = "referrer"
+                click_source = simple_classifier.classify(referrer)
             
             location_info = get_location_info(client_ip)
             ua_info = parse_user_agent(user_agent)
             utm_info = parse_utm_parameters(referrer)
             
-            # クリック情報をデータベースに保存
-            cursor.execute('''
-                INSERT INTO clicks (
-                    url_id, ip_address, country, region, city, timezone,
-                    user_agent, referrer, device_type, browser, os, source,
-                    utm_source, utm_medium, utm_campaign,
-                    hour_of_day, day_of_week
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                url_id, client_ip, location_info['country'], 
-                location_info['region'], location_info['city'], location_info['timezone'],
-                user_agent, referrer, ua_info['device_type'],
-                ua_info['browser'], ua_info['os'], click_source,
-                utm_info.get('utm_source'), utm_info.get('utm_medium'), utm_info.get('utm_campaign'),
-                hour_of_day, day_of_week
-            ))
-            conn.commit()
-            
-            print(f"✅ Click recorded: {short_code} (source: {click_source})")
+            # クリック情報をキューに追加（書き込みはバックグラウンドでまとめて実行）
+            click_queue.enqueue({
+                'url_id': url_id,
+                'ip_address': client_ip,
+                'country': location_info['country'],
+                'region': location_info['region'],
+                'city': location_info['city'],
+                'timezone': location_info['timezone'],
+                'user_agent': user_agent,
+                'referrer': referrer,
+                'device_type': ua_info['device_type'],
+                'browser': ua_info['browser'],
+                'os': ua_info['os'],
+                'source': click_source,
+                'utm_source': utm_info.get('utm_source'),
+                'utm_medium': utm_info.get('utm_medium'),
+                'utm_campaign': utm_info.get('utm_campaign'),
+                'hour_of_day': hour_of_day,
+                'day_of_week': day_of_week,
+                # DEFAULT CURRENT_TIMESTAMPと同じ形式（UTC）でクリック時刻を保持
+                'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+            })
             
         except Exception as e:
             print(f"⚠️  Failed to record click: {e}")
             # クリック記録に失敗してもリダイレクトは続行
         
-        conn.close()
         return RedirectResponse(url=original_url, status_code=302)
         
     except HTTPException:
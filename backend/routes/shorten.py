@@ -2,36 +2,50 @@ from fastapi import APIRouter, HTTPException
 import sqlite3
 from models import URLCreate, URLResponse
 from config import DB_PATH, BASE_URL
-from utils import generate_short_code, generate_qr_code_base64
+from database import get_write_connection
+from db_executor import fast_query
+from utils import generate_qr_code_base64
+from cache import invalidate_url
+from bloom import short_code_filter
+from short_codes import get_allocator, insert_url
 
 router = APIRouter()
 
 @router.post("/api/shorten", response_model=URLResponse)
-async def shorten_url(url_data: URLCreate):
+@fast_query
+def shorten_url(url_data: URLCreate):
     """URL短縮エンドポイント"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with get_write_connection() as conn:
+            cursor = conn.cursor()
+            
+            row = {
+                "original_url": url_data.original_url,
+                "custom_name": url_data.custom_name,
+                "campaign_name": url_data.campaign_name,
+                "created_by": "api"
+            }
+            
+            # カスタムスラッグの処理
+            if url_data.custom_slug:
+                cursor.execute("SELECT id FROM urls WHERE short_code = ?", (url_data.custom_slug,))
+                if cursor.fetchone():
+                    raise HTTPException(status_code=400, detail="Custom slug already exists")
+                short_code = url_data.custom_slug
+                cursor.execute('''
+                    INSERT INTO urls (short_code, original_url, custom_name, campaign_name, created_by) 
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (short_code, *row.values()))
+            else:
+                # 割り当てたコードで保存（事前の重複チェックなし）
+                short_code = insert_url(conn, get_allocator(DB_PATH), row)
+            
+            # 作成時刻取得
+            cursor.execute("SELECT created_at FROM urls WHERE short_code = ?", (short_code,))
+            created_at = cursor.fetchone()[0]
         
-        # カスタムスラッグの処理
-        if url_data.custom_slug:
-            cursor.execute("SELECT id FROM urls WHERE short_code = ?", (url_data.custom_slug,))
-            if cursor.fetchone():
-                raise HTTPException(status_code=400, detail="Custom slug already exists")
-            short_code = url_data.custom_slug
-        else:
-            short_code = generate_short_code(conn=conn)
-        
-        # URLを保存
-        cursor.execute('''
-            INSERT INTO urls (short_code, original_url, custom_name, campaign_name, created_by) 
-            VALUES (?, ?, ?, ?, ?)
-        ''', (short_code, url_data.original_url, url_data.custom_name, url_data.campaign_name, 'api'))
-        conn.commit()
-        
-        # 作成時刻取得
-        cursor.execute("SELECT created_at FROM urls WHERE short_code = ?", (short_code,))
-        created_at = cursor.fetchone()[0]
+        invalidate_url(short_code)
+        short_code_filter.add(short_code)
         
         # URL生成
         short_url = f"{BASE_URL}/{short_code}"
@@ -49,7 +63,6 @@ async def shorten_url(url_data: URLCreate):
             campaign_name=url_data.campaign_name
         )
         
-        conn.close()
         return response
         
     except HTTPException:
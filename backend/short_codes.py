@@ -0,0 +1,415 @@
+import hashlib
+import json
+import random
+import sqlite3
+import string
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, List, Set
+
+# 絶対インポート
+import config
+from db_pool import get_pool
+
+CODE_CHARS = string.ascii_letters + string.digits
+ALLOCATORS = ("sequence", "random", "pool")
+# カスタムスラッグとの衝突時に別のコードで挿入し直す回数の上限
+MAX_INSERT_ATTEMPTS = 5
+# ランダム割り当ての候補の再生成回数の上限（6文字なら既存が数千万件あっても1〜2回で揃う）
+MAX_RANDOM_ROUNDS = 10
+
+
+def encode_base62(value: int, length: int) -> str:
+    """整数をlength文字のbase62に変換（足りない桁は先頭をCODE_CHARS[0]で埋める）"""
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, 62)
+        chars.append(CODE_CHARS[digit])
+    if value:
+        raise ValueError(f"{length}文字のbase62に収まりません")
+    return "".join(reversed(chars))
+
+
+def decode_base62(code: str) -> int:
+    """encode_base62の逆変換"""
+    value = 0
+    for char in code:
+        value = value * 62 + CODE_CHARS.index(char)
+    return value
+
+
+class FeistelPermutation:
+    """0〜domain-1の整数を同じ範囲に並べ替える可逆な置換（鍵付きFeistel構造）
+
+    domain以上のbit幅でFeistelを回し、範囲外に出た値はもう一度通す（cycle walking）ことで
+    任意の大きさの範囲で1対1になる。連番を通すと規則性のない値になるが、鍵があれば元に戻せる。
+    """
+
+    def __init__(self, domain: int, key: str, rounds: int = 4):
+        self.domain = domain
+        self.rounds = rounds
+        self._half = (max(domain - 1, 1).bit_length() + 1) // 2
+        self._mask = (1 << self._half) - 1
+        self._key = hashlib.blake2b(key.encode("utf-8"), digest_size=32).digest()
+
+    def _round(self, value: int, index: int) -> int:
+        digest = hashlib.blake2b(value.to_bytes(8, "big"), key=self._key, digest_size=8,
+                                 person=index.to_bytes(16, "big")).digest()
+        return int.from_bytes(digest, "big") & self._mask
+
+    def permute(self, value: int) -> int:
+        """valueの置換先"""
+        while True:
+            left, right = value >> self._half, value & self._mask
+            for index in range(self.rounds):
+                left, right = right, left ^ self._round(right, index)
+            value = (left << self._half) | right
+            if value < self.domain:
+                return value
+
+    def invert(self, value: int) -> int:
+        """permute()の逆変換"""
+        while True:
+            left, right = value >> self._half, value & self._mask
+            for index in reversed(range(self.rounds)):
+                left, right = right ^ self._round(left, index), left
+            value = (left << self._half) | right
+            if value < self.domain:
+                return value
+
+
+def create_tables(cursor: sqlite3.Cursor) -> None:
+    """連番割り当て用のテーブルを作成"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS short_code_sequence (
+            name TEXT PRIMARY KEY,
+            next_value INTEGER NOT NULL
+        )
+    """)
+
+
+def existing_short_codes(conn: sqlite3.Connection, codes: Iterable[str]) -> Set[str]:
+    """codesのうちurlsに既にある短縮コードを1クエリで取得
+
+    候補をJSON配列1つで渡してjson_eachで展開するため、件数が多くてもパラメータ数の上限に当たらず、
+    short_codeのUNIQUEインデックスを候補ごとに引くだけで済む。
+    """
+    codes = list(codes)
+    if not codes:
+        return set()
+    rows = conn.execute(
+        "SELECT short_code FROM urls WHERE short_code IN (SELECT value FROM json_each(?))",
+        (json.dumps(codes),)
+    ).fetchall()
+    return {row[0] for row in rows}
+
+
+def is_short_code_conflict(error: sqlite3.IntegrityError) -> bool:
+    """short_codeのUNIQUE制約違反か"""
+    return "short_code" in str(error)
+
+
+class SequenceCodeAllocator:
+    """連番から短縮コードを割り当てる（既存コードの読み取りも再試行も不要）
+
+    連番はDBのshort_code_sequenceからblock_size個ずつまとめて借り、プロセス内で順に使う。
+    各値はFeistelPermutationで並べ替えてからbase62にするため、コードは連番に見えず推測しにくい。
+    置換は1対1なので、同じ連番を二度使わない限り重複しない（再起動で使い残したブロックは捨てる）。
+    長さは既定でSHORT_CODE_LENGTH+1のため、ランダム割り当てのコードとは衝突しない。カスタムスラッグとの衝突は
+    insert_url・bulk_create.insert_urlsが次のコードで挿入し直す。
+    """
+
+    def __init__(self, db_path: str, length: int = None, key: str = None, block_size: int = None):
+        self.db_path = db_path
+        self.length = length or config.SEQUENCE_CODE_LENGTH
+        self.block_size = max(1, block_size or config.SEQUENCE_BLOCK_SIZE)
+        self.domain = 62 ** self.length
+        self._permutation = FeistelPermutation(self.domain, key or config.SHORT_CODE_KEY)
+        self._name = f"short_code:{self.length}"
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+        self.allocated = 0
+        self.leases = 0
+        self.collisions = 0
+
+    def allocate(self, count: int, conn: sqlite3.Connection = None, reserved: Iterable[str] = ()) -> List[str]:
+        """短縮コードをcount個割り当て（reservedに含まれるコードは飛ばす）
+
+        書き込みトランザクションの途中で呼ぶ場合はその接続をconnに渡す（連番はセーブポイントで
+        同じトランザクション内に借りる。db_poolのwriter()はブロックの先頭でBEGINするため常にこちら）。
+        connを省略した場合やconnがトランザクション外の場合は、ブロック単位で借りてすぐコミットする。
+        """
+        reserved = set(reserved)
+        codes = []
+        with self._lock:
+            while len(codes) < count:
+                if self._next >= self._end:
+                    self._lease(count - len(codes), conn)
+                code = encode_base62(self._permutation.permute(self._next), self.length)
+                self._next += 1
+                if code not in reserved:
+                    codes.append(code)
+            self.allocated += len(codes)
+        return codes
+
+    def _lease(self, count: int, conn: sqlite3.Connection = None) -> None:
+        if conn is not None and conn.in_transaction:
+            # 呼び出し元のトランザクションに相乗りする（途中でコミットもロールバックもしない）。
+            # 呼び出し元がロールバックすると連番も戻るため、余りをブロックとして持ち越さず必要な分だけ借りる
+            size = count
+            conn.execute("SAVEPOINT short_code_lease")
+            try:
+                end = self._advance(conn, size)
+            except BaseException:
+                conn.execute("ROLLBACK TO short_code_lease")
+                conn.execute("RELEASE short_code_lease")
+                raise
+            conn.execute("RELEASE short_code_lease")
+        elif conn is None:
+            size = max(self.block_size, count)
+            with get_pool(self.db_path).writer() as conn:
+                end = self._advance(conn, size)
+        else:
+            # トランザクション外の接続では、借りたブロックだけを独立したトランザクションでコミットする
+            size = max(self.block_size, count)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                end = self._advance(conn, size)
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+        if end > self.domain:
+            raise RuntimeError(f"{self.length}文字の短縮コードを使い切りました（SEQUENCE_CODE_LENGTHを増やしてください）")
+        self._next, self._end = end - size, end
+        self.leases += 1
+
+    def _advance(self, conn: sqlite3.Connection, size: int) -> int:
+        """連番をsize個進めて新しい末尾を返す"""
+        conn.execute("INSERT OR IGNORE INTO short_code_sequence (name, next_value) VALUES (?, 0)", (self._name,))
+        conn.execute("UPDATE short_code_sequence SET next_value = next_value + ? WHERE name = ?", (size, self._name))
+        # 書き込みロックを持ったまま読むため、他のプロセスと同じブロックを借りることはない
+        return conn.execute("SELECT next_value FROM short_code_sequence WHERE name = ?", (self._name,)).fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """割り当ての統計を取得"""
+        return {
+            "allocator": "sequence",
+            "length": self.length,
+            "block_size": self.block_size,
+            "allocated": self.allocated,
+            "leases": self.leases,
+            "collisions": self.collisions,
+            "block_remaining": self._end - self._next,
+            "capacity_used": round(self._end / self.domain, 9)
+        }
+
+
+class RandomCodeAllocator:
+    """ランダムな短縮コードを割り当てる（従来方式。候補をまとめて作り、既存との重複を1クエリで確認）"""
+
+    def __init__(self, db_path: str, length: int = None):
+        self.db_path = db_path
+        self.length = length or config.SHORT_CODE_LENGTH
+        self.allocated = 0
+        self.retries = 0
+        self.collisions = 0
+
+    def allocate(self, count: int, conn: sqlite3.Connection = None, reserved: Iterable[str] = ()) -> List[str]:
+        """未使用の短縮コードをcount個割り当て（reservedに含まれるコードも避ける）"""
+        own_conn = conn is None
+        if own_conn:
+            conn = get_pool(self.db_path).reader()
+        try:
+            taken = set(reserved)
+            codes: List[str] = []
+            for _ in range(MAX_RANDOM_ROUNDS):
+                need = count - len(codes)
+                if need <= 0:
+                    break
+                candidates = set()
+                # コード空間がほぼ埋まっていても止まらないよう、1回の生成の試行回数にも上限を設ける
+                for _ in range(need * 4):
+                    code = "".join(random.choices(CODE_CHARS, k=self.length))
+                    if code not in taken:
+                        candidates.add(code)
+                        if len(candidates) == need:
+                            break
+                taken |= candidates
+                fresh = candidates - existing_short_codes(conn, candidates)
+                self.retries += len(candidates) - len(fresh)
+                codes.extend(fresh)
+        finally:
+            if own_conn:
+                conn.close()
+        if len(codes) < count:
+            raise RuntimeError("短縮コードの生成に失敗しました")
+        self.allocated += len(codes)
+        return codes
+
+    def stats(self) -> Dict[str, Any]:
+        """割り当ての統計を取得"""
+        return {
+            "allocator": "random",
+            "length": self.length,
+            "allocated": self.allocated,
+            "retries": self.retries,
+            "collisions": self.collisions
+        }
+
+
+class PooledCodeAllocator:
+    """確認済みの未使用ランダムコードを溜めておき、割り当て時は取り出すだけにする
+
+    プールの残りがlow_waterを下回るとバックグラウンドのスレッドがsize個までまとめて補充する
+    （候補の生成と既存との重複確認はRandomCodeAllocatorで1クエリ）。作成リクエストは
+    dequeから取り出すだけなので、重複確認の再試行が応答時間に乗らない。プールが空の時だけ
+    その場でRandomCodeAllocatorから割り当てる（stats()のmisses）。
+    確認後に他のプロセスやカスタムスラッグに使われたコードは、insert_url・bulk_create.insert_urlsの
+    UNIQUE制約違反時の再割り当てで救う。
+    """
+
+    def __init__(self, db_path: str, size: int = None, low_water: int = None, length: int = None):
+        self.db_path = db_path
+        self.size = max(1, size or config.SHORT_CODE_POOL_SIZE)
+        self.low_water = min(self.size, low_water or config.SHORT_CODE_POOL_LOW_WATER)
+        self._source = RandomCodeAllocator(db_path, length=length)
+        self._codes: deque = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+
+        self.allocated = 0
+        self.misses = 0
+        self.collisions = 0
+        self.refills = 0
+        self.refilled = 0
+        self.refill_errors = 0
+        self.last_refill_ms = 0.0
+        self.last_refill_rate = 0.0
+
+    def start(self) -> None:
+        """補充スレッドを起動（起動直後にsize個まで補充する）"""
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="short-code-pool", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def allocate(self, count: int, conn: sqlite3.Connection = None, reserved: Iterable[str] = ()) -> List[str]:
+        """プールから短縮コードをcount個取り出す（足りない分はその場で生成）"""
+        if self._thread is None:
+            self.start()
+        reserved = set(reserved)
+        codes = []
+        with self._cond:
+            while len(codes) < count and self._codes:
+                code = self._codes.popleft()
+                if code not in reserved:
+                    codes.append(code)
+            if len(self._codes) < self.low_water:
+                self._cond.notify()
+
+        if len(codes) < count:
+            self.misses += count - len(codes)
+            codes.extend(self._source.allocate(count - len(codes), conn=conn, reserved=reserved | set(codes)))
+        self.allocated += len(codes)
+        return codes
+
+    def refill(self) -> int:
+        """プールをsize個まで補充し、補充した件数を返す"""
+        with self._cond:
+            need = self.size - len(self._codes)
+            pooled = set(self._codes)
+        if need <= 0:
+            return 0
+
+        started = time.perf_counter()
+        codes = self._source.allocate(need, reserved=pooled)
+        elapsed = time.perf_counter() - started
+        with self._cond:
+            self._codes.extend(codes)
+        self.refills += 1
+        self.refilled += len(codes)
+        self.last_refill_ms = round(elapsed * 1000, 3)
+        self.last_refill_rate = round(len(codes) / elapsed) if elapsed > 0 else 0.0
+        return len(codes)
+
+    def depth(self) -> int:
+        """プールに残っているコード数"""
+        return len(self._codes)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while len(self._codes) >= self.low_water:
+                    self._cond.wait()
+            try:
+                self.refill()
+            except Exception as e:
+                print(f"⚠️ 短縮コードプールの補充エラー: {e}")
+                self.refill_errors += 1
+                time.sleep(1)
+
+    def stats(self) -> Dict[str, Any]:
+        """プールの統計を取得"""
+        return {
+            "allocator": "pool",
+            "length": self._source.length,
+            "depth": len(self._codes),
+            "size": self.size,
+            "low_water": self.low_water,
+            "allocated": self.allocated,
+            "misses": self.misses,
+            "collisions": self.collisions,
+            "refills": self.refills,
+            "refilled": self.refilled,
+            "refill_errors": self.refill_errors,
+            "last_refill_ms": self.last_refill_ms,
+            "last_refill_codes_per_sec": self.last_refill_rate,
+            "probe_retries": self._source.retries
+        }
+
+
+_allocators: Dict[str, Any] = {}
+_allocators_lock = threading.Lock()
+
+
+def get_allocator(db_path: str):
+    """DBファイルごとの短縮コードアロケータを取得（SHORT_CODE_ALLOCATORで方式を選択）"""
+    with _allocators_lock:
+        allocator = _allocators.get(db_path)
+        if allocator is None:
+            if config.SHORT_CODE_ALLOCATOR not in ALLOCATORS:
+                raise ValueError(f"不明なSHORT_CODE_ALLOCATORです: {config.SHORT_CODE_ALLOCATOR}")
+            if config.SHORT_CODE_ALLOCATOR == "sequence":
+                allocator = SequenceCodeAllocator(db_path)
+            elif config.SHORT_CODE_ALLOCATOR == "pool":
+                allocator = PooledCodeAllocator(db_path)
+                allocator.start()
+            else:
+                allocator = RandomCodeAllocator(db_path)
+            _allocators[db_path] = allocator
+        return allocator
+
+
+def insert_url(conn: sqlite3.Connection, allocator, row: Dict[str, Any]) -> str:
+    """短縮コードを割り当ててurlsに1行挿入し、コードを返す
+
+    rowはshort_code以外の列名->値。挿入前に重複を確認せず、UNIQUE制約違反
+    （カスタムスラッグ等と重なった場合）の時だけ次のコードで挿入し直す。
+    """
+    columns = ["short_code"] + list(row)
+    sql = f"INSERT INTO urls ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    for _ in range(MAX_INSERT_ATTEMPTS):
+        short_code = allocator.allocate(1, conn=conn)[0]
+        try:
+            conn.execute(sql, (short_code, *row.values()))
+            return short_code
+        except sqlite3.IntegrityError as e:
+            if not is_short_code_conflict(e):
+                raise
+            allocator.collisions += 1
+    raise RuntimeError("短縮コードの生成に失敗しました")
@@ -0,0 +1,74 @@
+from typing import Any, Callable, Dict, Iterable
+
+# 絶対インポート
+import config
+from cache import LRUCache
+from db_pool import get_pool
+
+
+class UserAgentCache:
+    """User-Agent解析結果のメモ化キャッシュ
+
+    user_agents.parseは正規表現を多用して遅いが、実際のトラフィックの
+    UA文字列の種類は少ないため、UA文字列をキーに解析結果
+    （device_type/browser/os）をLRUCacheで保持する。
+    """
+
+    def __init__(self, parse_func: Callable[[str], Dict[str, str]], max_size: int = None):
+        self.parse_func = parse_func
+        self._cache = LRUCache(max_size=max_size or config.UA_CACHE_SIZE, ttl=0)
+        self.warmed = 0
+
+    def parse(self, user_agent: str) -> Dict[str, str]:
+        """UA文字列を解析（キャッシュ済みなら再解析しない）"""
+        key = user_agent or ""
+        result = self._cache.get(key)
+        if result is None:
+            result = self.parse_func(user_agent)
+            self._cache.set(key, result)
+        # 呼び出し側で変更されてもキャッシュが汚れないようコピーを返す
+        return dict(result)
+
+    def warm(self, user_agents: Iterable[str]) -> int:
+        """UA文字列を事前に解析してキャッシュに登録"""
+        count = 0
+        for user_agent in user_agents:
+            if user_agent:
+                self._cache.set(user_agent, self.parse_func(user_agent))
+                count += 1
+        self.warmed += count
+        return count
+
+    def warm_from_db(self, db_path: str, top: int = None, sample: int = None) -> int:
+        """clicksテーブルの直近sample件から出現数の多いUA上位top件でキャッシュを温める"""
+        top = top or config.UA_CACHE_WARM_TOP
+        sample = sample or config.UA_CACHE_WARM_SAMPLE
+        try:
+            conn = get_pool(db_path).reader()
+            rows = conn.execute("""
+                SELECT user_agent, COUNT(*) AS hits
+                FROM clicks
+                WHERE id > (SELECT COALESCE(MAX(id), 0) FROM clicks) - ?
+                AND user_agent IS NOT NULL AND user_agent != ''
+                GROUP BY user_agent
+                ORDER BY hits DESC
+                LIMIT ?
+            """, (sample, top)).fetchall()
+            conn.close()
+        except Exception as e:
+            print(f"⚠️ User-Agentキャッシュのウォームアップエラー: {e}")
+            return 0
+
+        count = self.warm(row[0] for row in rows)
+        print(f"✅ User-Agentキャッシュをウォームアップ: {count}件")
+        return count
+
+    def clear(self) -> None:
+        """キャッシュを破棄"""
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット率などの統計を取得"""
+        stats = self._cache.stats()
+        stats["warmed"] = self.warmed
+        return stats
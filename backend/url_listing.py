@@ -0,0 +1,158 @@
+import base64
+import html
+import json
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlencode
+
+# 並び順 -> キーセットの列（いずれも降順、同値はidの降順）
+SORT_COLUMNS = {"created": "created_at", "clicks": "total_clicks"}
+STATUSES = ("active", "inactive", "all")
+MAX_PAGE_SIZE = 200
+
+
+def create_indexes(cursor: sqlite3.Cursor) -> None:
+    """一覧のキーセット用インデックスを作成（urls(total_clicks)系はClickRollup.create_tablesで作成）
+
+    SQLiteのインデックスは末尾に暗黙にrowid(=id)を持つため、(created_at)は(created_at, id)として使える。
+    """
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_urls_created_at ON urls(created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_urls_campaign_created ON urls(campaign_name, created_at)")
+
+
+def encode_cursor(sort: str, value: Any, url_id: int) -> str:
+    """ページの最後の行からカーソル文字列を作成"""
+    payload = json.dumps([sort, value, url_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[Any, int]:
+    """カーソル文字列を(値, id)に戻す（壊れている・並び順が違う場合はValueError）"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, value, url_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise ValueError("カーソルが不正です")
+    if cursor_sort != sort or not isinstance(url_id, int):
+        raise ValueError("カーソルが不正です")
+    return value, url_id
+
+
+def list_urls(conn: sqlite3.Connection, sort: str = "created", cursor: Optional[str] = None, limit: int = 20,
+              campaign: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+              status: str = "active") -> Dict[str, Any]:
+    """URL一覧の1ページを取得（キーセットページネーション）
+
+    OFFSETを使わず、前のページの最後の(並び順の値, id)より後ろだけをLIMIT付きで読むため、
+    ページの深さやリンク数に関係なく1ページのコストはページサイズ分になる。
+    start/endは作成日（YYYY-MM-DD、両端を含む）。不正な値はValueError。
+    """
+    column = SORT_COLUMNS.get(sort)
+    if column is None:
+        raise ValueError(f"sortは{', '.join(SORT_COLUMNS)}のいずれかを指定してください")
+    if status not in STATUSES:
+        raise ValueError(f"statusは{', '.join(STATUSES)}のいずれかを指定してください")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    conditions = []
+    params = []
+    if status != "all":
+        conditions.append("u.is_active = ?")
+        params.append(1 if status == "active" else 0)
+    if campaign:
+        conditions.append("u.campaign_name = ?")
+        params.append(campaign)
+    try:
+        if start:
+            conditions.append("u.created_at >= ?")
+            params.append(datetime.strptime(start, "%Y-%m-%d").date().isoformat())
+        if end:
+            conditions.append("u.created_at < ?")
+            params.append((datetime.strptime(end, "%Y-%m-%d").date() + timedelta(days=1)).isoformat())
+    except ValueError:
+        raise ValueError("日付はYYYY-MM-DD形式で指定してください")
+    if cursor:
+        value, url_id = decode_cursor(cursor, sort)
+        conditions.append(f"(u.{column}, u.id) < (?, ?)")
+        params.extend([value, url_id])
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    result = conn.execute(f"""
+        SELECT
+            u.id,
+            u.short_code,
+            u.original_url,
+            u.custom_name,
+            u.campaign_name,
+            u.created_at,
+            u.is_active,
+            u.total_clicks,
+            COALESCE(t.unique_visitors, 0) AS unique_visitors,
+            u.qr_clicks,
+            u.mobile_clicks,
+            u.last_clicked_at
+        FROM urls u
+        LEFT JOIN click_rollup_totals t ON t.url_id = u.id AND t.source = ''
+        {where}
+        ORDER BY u.{column} DESC, u.id DESC
+        LIMIT ?
+    """, params + [limit + 1])
+    names = [description[0] for description in result.description]
+    rows = result.fetchall()
+
+    urls = [dict(zip(names, row)) for row in rows[:limit]]
+    has_more = len(rows) > limit
+    next_cursor = None
+    if has_more:
+        last = urls[-1]
+        next_cursor = encode_cursor(sort, last[column], last["id"])
+
+    return {
+        "urls": urls,
+        "sort": sort,
+        "limit": limit,
+        "cursor": cursor,
+        "has_more": has_more,
+        "next_cursor": next_cursor,
+        "filters": {"campaign": campaign, "start": start, "end": end, "status": status}
+    }
+
+
+def page_url(path: str, page: Dict[str, Any], cursor: Optional[str] = None) -> str:
+    """同じ並び順・条件でcursorのページを開くURL"""
+    params = {"sort": page["sort"], "limit": page["limit"], **page["filters"], "cursor": cursor}
+    return f"{path}?{urlencode({key: value for key, value in params.items() if value})}"
+
+
+def listing_controls_html(path: str, page: Dict[str, Any]) -> str:
+    """管理画面のURL一覧用の絞り込みフォームとページ送りリンク"""
+    filters = page["filters"]
+
+    def options(choices, selected):
+        return "".join(
+            f'<option value="{value}"{" selected" if value == selected else ""}>{label}</option>'
+            for value, label in choices
+        )
+
+    def text(value):
+        return html.escape(value or "", quote=True)
+
+    links = []
+    if page["cursor"]:
+        links.append(f'<a href="{html.escape(page_url(path, page))}">⏮ 最初のページ</a>')
+    if page["has_more"]:
+        links.append(f'<a href="{html.escape(page_url(path, page, page["next_cursor"]))}">次のページ ▶</a>')
+
+    return f"""
+        <form method="get" action="{path}" style="display: flex; gap: 10px; flex-wrap: wrap; align-items: center; margin: 15px 0;">
+            <select name="sort">{options((("created", "作成日の新しい順"), ("clicks", "クリック数の多い順")), page["sort"])}</select>
+            <input type="text" name="campaign" placeholder="キャンペーン" value="{text(filters["campaign"])}">
+            <label>作成日 <input type="date" name="start" value="{text(filters["start"])}"></label>
+            <label>〜 <input type="date" name="end" value="{text(filters["end"])}"></label>
+            <select name="status">{options((("active", "有効"), ("inactive", "無効"), ("all", "すべて")), filters["status"])}</select>
+            <input type="hidden" name="limit" value="{page["limit"]}">
+            <button type="submit">🔍 絞り込み</button>
+        </form>
+        <div style="display: flex; gap: 20px; margin: 10px 0;">{"".join(links)}</div>
+    """
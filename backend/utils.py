@@ -1,24 +1,9 @@
-import string
-import random
 import base64
 from io import BytesIO
 from datetime import datetime
 from typing import Dict, Any, Optional  # Optionalを追加
 from config import QR_AVAILABLE, UA_AVAILABLE
-
-def generate_short_code(length: int = 6, conn=None) -> str:
-
-    """短縮コードを生成"""
-    characters = string.ascii_letters + string.digits
-    while True:
-        code = ''.join(random.choice(characters) for _ in range(length))
-        if conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id FROM urls WHERE short_code = ?", (code,))
-            if not cursor.fetchone():
-                return code
-        else:
-            return code
+from ua_cache import UserAgentCache
 
 def generate_qr_code_base64(url: str, size: int = 200) -> Optional[str]:
     """QRコードをBase64で生成"""
@@ -48,7 +33,11 @@ def generate_qr_code_base64(url: str, size: int = 200) -> Optional[str]:
         return None
 
 def parse_user_agent(user_agent: str) -> Dict[str, str]:
-    """User Agentを解析"""
+    """User Agentを解析（同じUA文字列の解析結果はキャッシュから返す）"""
+    return ua_cache.parse(user_agent)
+
+def _parse_user_agent(user_agent: str) -> Dict[str, str]:
+    """User Agentを解析（キャッシュなし）"""
     if not UA_AVAILABLE:
         return {'device_type': 'unknown', 'browser': 'unknown', 'os': 'unknown'}
     
@@ -63,6 +52,8 @@ def parse_user_agent(user_agent: str) -> Dict[str, str]:
     except Exception:
         return {'device_type': 'unknown', 'browser': 'unknown', 'os': 'unknown'}
 
+ua_cache = UserAgentCache(_parse_user_agent)
+
 def get_location_info(ip_address: str) -> Dict[str, str]:
     """IPアドレスから位置情報を取得"""
     # 簡易的な実装（実際にはIP情報サービスを使用）
@@ -0,0 +1,498 @@
+"""リダイレクト経路のレイテンシ・スループットベンチマーク
+
+main.py / backend/main.py のASGIアプリをhttpxのASGITransportでプロセス内から
+直接呼び出し（lifespanも実行）、合成データ（10k/1M/10Mクリックなど）を入れた
+DBに対してリダイレクト中心のリクエストの組み合わせを流す。
+操作ごとのp50/p95/p99レイテンシと秒間リクエスト数をJSONに保存し、
+--compareで別コミットの結果と比較できる。
+
+使い方:
+    python benchmarks/bench_app.py --app main backend --clicks 10k 1m
+    python benchmarks/bench_app.py --app main --clicks 10m --requests 50000 --concurrency 64
+    python benchmarks/bench_app.py --clicks 1m --compare benchmarks/results/<前回>.json
+
+合成DBは--db-dirにテンプレートとして保存し、同じ条件の2回目以降はコピーして使う。
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIRS = {
+    "main": ROOT,
+    "backend": os.path.join(ROOT, "backend")
+}
+
+# 操作ごとの重み（合計に対する比率で実行回数が決まる）
+MIXES = {
+    "mixed": {
+        "redirect_hot": 55, "redirect_cold": 15, "redirect_404": 10, "redirect_qr": 8,
+        "shorten": 6, "analytics": 4, "admin": 2
+    },
+    "redirect": {
+        "redirect_hot": 70, "redirect_cold": 15, "redirect_404": 10, "redirect_qr": 5
+    },
+    "read": {
+        "redirect_hot": 40, "redirect_cold": 20, "analytics": 30, "admin": 10
+    }
+}
+
+# 期待するステータスコード（それ以外はエラーとして数える）
+EXPECTED_STATUS = {
+    "redirect_hot": 302, "redirect_cold": 302, "redirect_404": 404, "redirect_qr": 302,
+    "shorten": 200, "analytics": 200, "admin": 200
+}
+
+# (User-Agent, main.pyの端末種別, backendの端末種別, ブラウザ, OS)
+USER_AGENTS = [
+    ("Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 "
+     "(KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1",
+     "Mobile", "mobile", "Mobile Safari", "iOS"),
+    ("Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) "
+     "Chrome/120.0.0.0 Mobile Safari/537.36",
+     "Mobile", "mobile", "Chrome Mobile", "Android"),
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+     "Chrome/120.0.0.0 Safari/537.36",
+     "Desktop", "desktop", "Chrome", "Windows"),
+    ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) "
+     "Version/17.0 Safari/605.1.15",
+     "Desktop", "desktop", "Safari", "Mac OS X"),
+    ("Mozilla/5.0 (iPad; CPU OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) "
+     "Version/17.0 Mobile/15E148 Safari/604.1",
+     "Tablet", "tablet", "Mobile Safari", "iOS"),
+]
+
+# (リファラー, main.pyのsource, backendのsource)
+REFERRERS = [
+    ("", "direct", "direct"),
+    ("", "qr", "qr"),
+    ("https://t.co/AbCdEf123", "twitter", "twitter"),
+    ("https://www.google.com/", "search_google", "google"),
+    ("https://www.facebook.com/", "facebook", "facebook"),
+    ("https://mail.google.com/mail/u/0/", "email", "google"),
+    ("https://blog.example.com/post/1", "referral_blog.example.com", "referrer"),
+]
+
+BASE62 = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def parse_size(value):
+    """'10k' / '1m' / '10m' / '25000' をクリック数に変換"""
+    text = value.strip().lower().replace("_", "")
+    multiplier = 1
+    if text.endswith("k"):
+        multiplier, text = 1000, text[:-1]
+    elif text.endswith("m"):
+        multiplier, text = 1000000, text[:-1]
+    return int(float(text) * multiplier)
+
+
+def format_size(clicks):
+    if clicks >= 1000000 and clicks % 1000000 == 0:
+        return f"{clicks // 1000000}m"
+    if clicks >= 1000 and clicks % 1000 == 0:
+        return f"{clicks // 1000}k"
+    return str(clicks)
+
+
+def make_short_code(index):
+    """シード行用の短縮コード（生成コードと衝突しないよう先頭を'b'に固定）"""
+    code = ""
+    value = index
+    while True:
+        value, remainder = divmod(value, 62)
+        code = BASE62[remainder] + code
+        if value == 0:
+            break
+    return "b" + code.rjust(5, "0")
+
+
+def git_revision():
+    """現在のコミット（未コミットの変更があれば-dirtyを付ける）"""
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True).stdout.strip()
+        return f"{revision}-dirty" if dirty else revision
+    except Exception:
+        return "unknown"
+
+
+def percentile(sorted_values, pct):
+    """最近傍順位法によるパーセンタイル"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, errors, elapsed):
+    """レイテンシ（秒）のリストを集計（ms単位）"""
+    values = sorted(latency * 1000 for latency in latencies)
+    count = len(values)
+    return {
+        "count": count,
+        "errors": errors,
+        "rps": round(count / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(values) / count, 3) if count else 0.0,
+        "p50_ms": round(percentile(values, 50), 3),
+        "p95_ms": round(percentile(values, 95), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+        "max_ms": round(values[-1], 3) if values else 0.0
+    }
+
+
+def seed_database(app_name, db_path, clicks, urls, seed):
+    """合成データを投入（URLはランク順のZipf分布でクリックされる）"""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA synchronous=OFF")
+
+    conn.executemany(
+        "INSERT INTO urls (id, short_code, original_url, campaign_name, created_at) VALUES (?, ?, ?, ?, ?)",
+        ((i, make_short_code(i), f"https://example.com/landing/{i}",
+          f"campaign_{i % 50}" if i % 3 == 0 else None,
+          (now - timedelta(days=90 + i % 30)).strftime("%Y-%m-%d %H:%M:%S"))
+         for i in range(1, urls + 1))
+    )
+
+    if app_name == "main":
+        sql = """INSERT INTO clicks (url_id, ip_address, user_agent, referrer, source,
+                 device_type, browser, os, country, city, clicked_at)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+    else:
+        sql = """INSERT INTO clicks (url_id, ip_address, user_agent, referrer, source,
+                 device_type, browser, os, country, region, city, timezone,
+                 hour_of_day, day_of_week, created_at)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+    url_ids = list(range(1, urls + 1))
+    cum_weights = []
+    total = 0.0
+    for rank in range(urls):
+        total += 1 / (rank + 1) ** 1.1
+        cum_weights.append(total)
+
+    span = 90 * 86400
+    batch = 100000
+    written = 0
+    while written < clicks:
+        size = min(batch, clicks - written)
+        ids = rng.choices(url_ids, cum_weights=cum_weights, k=size)
+        rows = []
+        for url_id in ids:
+            ua, main_device, backend_device, browser, os_name = USER_AGENTS[rng.randrange(len(USER_AGENTS))]
+            referrer, main_source, backend_source = REFERRERS[rng.randrange(len(REFERRERS))]
+            clicked = now - timedelta(seconds=rng.randrange(span))
+            ip = f"203.0.{rng.randrange(256)}.{rng.randrange(256)}"
+            if app_name == "main":
+                rows.append((url_id, ip, ua, referrer, main_source, main_device, browser, os_name,
+                             "Japan", "Tokyo", clicked.replace(tzinfo=None).isoformat()))
+            else:
+                rows.append((url_id, ip, ua, referrer, backend_source, backend_device, browser, os_name,
+                             "Unknown", "Unknown", "Unknown", "Unknown",
+                             clicked.hour, clicked.weekday(), clicked.strftime("%Y-%m-%d %H:%M:%S")))
+        conn.executemany(sql, rows)
+        conn.commit()
+        written += size
+
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+
+def build_operations(mix, count, urls, shorten_path, rng):
+    """重みに従って(操作名, メソッド, パス, 追加引数)のリストを作る"""
+    names = list(MIXES[mix])
+    weights = [MIXES[mix][name] for name in names]
+    hot = [make_short_code(i) for i in range(1, min(urls, 20) + 1)]
+    cold_start = min(urls, max(21, urls // 2))
+    operations = []
+    for i, name in enumerate(rng.choices(names, weights=weights, k=count)):
+        ua = USER_AGENTS[rng.randrange(len(USER_AGENTS))][0]
+        referrer = REFERRERS[rng.randrange(len(REFERRERS))][0]
+        headers = {"user-agent": ua}
+        if referrer:
+            headers["referer"] = referrer
+        kwargs = {"headers": headers}
+
+        if name == "redirect_hot":
+            operations.append((name, "GET", f"/{rng.choice(hot)}", kwargs))
+        elif name == "redirect_cold":
+            code = make_short_code(rng.randint(cold_start, urls))
+            operations.append((name, "GET", f"/{code}", kwargs))
+        elif name == "redirect_404":
+            code = "x" + "".join(rng.choice(BASE62) for _ in range(7))
+            operations.append((name, "GET", f"/{code}", kwargs))
+        elif name == "redirect_qr":
+            operations.append((name, "GET", f"/{rng.choice(hot)}?source=qr", kwargs))
+        elif name == "shorten":
+            target = f"https://example.com/bench/{i}"
+            if shorten_path == "/api/shorten-form":
+                kwargs["data"] = {"url": target}
+            else:
+                kwargs["json"] = {"original_url": target}
+            operations.append((name, "POST", shorten_path, kwargs))
+        elif name == "analytics":
+            operations.append((name, "GET", f"/analytics/{rng.choice(hot)}", kwargs))
+        elif name == "admin":
+            operations.append((name, "GET", "/admin", kwargs))
+    return operations
+
+
+def find_route(app, endpoint_name, default):
+    """エンドポイント関数名からパスを探す（routerのprefix込み）"""
+    try:
+        return str(app.url_path_for(endpoint_name))
+    except Exception:
+        return default
+
+
+async def drive(app, operations, warmup, concurrency):
+    """lifespanを実行した上で操作を並行実行し、結果を集計"""
+    import httpx
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False, client=("198.51.100.7", 40000))
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+            async def run(ops, record):
+                iterator = iter(ops)
+
+                async def worker():
+                    for name, method, path, kwargs in iterator:
+                        started = time.perf_counter()
+                        try:
+                            response = await client.request(method, path, **kwargs)
+                            status = response.status_code
+                        except Exception:
+                            status = None
+                        if record is not None:
+                            record.append((name, time.perf_counter() - started, status))
+
+                await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+            # ウォームアップ（キャッシュ・UA解析・接続の準備、計測しない）
+            await run(operations[:warmup], None)
+
+            results = []
+            started = time.perf_counter()
+            await run(operations[warmup:], results)
+            elapsed = time.perf_counter() - started
+
+            health = (await client.get("/health")).json()
+
+    return results, elapsed, health
+
+
+def run_single(args):
+    """1つのアプリ・データ量の組み合わせを計測（子プロセスで実行）"""
+    app_name = args.app[0]
+    clicks = parse_size(args.clicks[0])
+    urls = args.urls or max(100, min(100000, clicks // 100))
+    os.makedirs(args.db_dir, exist_ok=True)
+    template = os.path.join(args.db_dir, f"{app_name}-{format_size(clicks)}-u{urls}-s{args.seed}.db")
+    work_dir = tempfile.mkdtemp(prefix="bench_app_")
+    db_path = os.path.join(work_dir, "bench.db")
+
+    # テンプレートがあればコピーして使う（計測中の書き込みでテンプレートを汚さない）
+    seed_seconds = None
+    if os.path.exists(template):
+        shutil.copyfile(template, db_path)
+
+    os.environ["DB_PATH"] = db_path
+    sys.path.insert(0, APP_DIRS[app_name])
+    quiet = open(os.devnull, "w") if not args.verbose else None
+    try:
+        with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+            module = importlib.import_module("main")
+            if app_name == "backend":
+                importlib.import_module("database").init_db()
+
+        if not os.path.exists(template):
+            print(f"🔧 合成DBを作成中: {format_size(clicks)}クリック / {urls}URL", file=sys.stderr)
+            started = time.perf_counter()
+            seed_database(app_name, db_path, clicks, urls, args.seed)
+            seed_seconds = round(time.perf_counter() - started, 1)
+            shutil.copyfile(db_path, template)
+
+        shorten_path = find_route(module.app, "shorten_form" if app_name == "main" else "shorten_url",
+                                  "/api/shorten")
+        rng = random.Random(args.seed)
+        operations = build_operations(args.mix, args.warmup + args.requests, urls, shorten_path, rng)
+
+        with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+            results, elapsed, health = asyncio.run(
+                drive(module.app, operations, args.warmup, args.concurrency)
+            )
+    finally:
+        if quiet:
+            quiet.close()
+        if not args.keep_db:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    by_operation = {}
+    for name, latency, status in results:
+        entry = by_operation.setdefault(name, {"latencies": [], "errors": 0, "status": {}})
+        entry["latencies"].append(latency)
+        entry["status"][str(status)] = entry["status"].get(str(status), 0) + 1
+        if status != EXPECTED_STATUS[name]:
+            entry["errors"] += 1
+
+    operations_summary = {}
+    for name in MIXES[args.mix]:
+        if name in by_operation:
+            entry = by_operation[name]
+            summary = summarize(entry["latencies"], entry["errors"], elapsed)
+            summary["status"] = entry["status"]
+            operations_summary[name] = summary
+
+    return {
+        "app": app_name,
+        "clicks": clicks,
+        "urls": urls,
+        "mix": args.mix,
+        "requests": args.requests,
+        "warmup": args.warmup,
+        "concurrency": args.concurrency,
+        "seed": args.seed,
+        "seed_seconds": seed_seconds,
+        "elapsed_seconds": round(elapsed, 3),
+        "overall": summarize([latency for _, latency, _ in results],
+                             sum(entry["errors"] for entry in by_operation.values()), elapsed),
+        "operations": operations_summary,
+        "health": health
+    }
+
+
+def print_run(run):
+    overall = run["overall"]
+    print(f"\n📊 {run['app']} / {format_size(run['clicks'])}クリック / mix={run['mix']} "
+          f"/ 並列{run['concurrency']}: {overall['rps']:,.0f} req/s")
+    print(f"  {'operation':<15}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+    for name, summary in list(run["operations"].items()) + [("overall", overall)]:
+        print(f"  {name:<15}{summary['count']:>8}{summary['errors']:>8}{summary['p50_ms']:>10.2f}"
+              f"{summary['p95_ms']:>10.2f}{summary['p99_ms']:>10.2f}{summary['rps']:>10.0f}")
+
+
+def compare(results, baseline_path):
+    """前回の結果と比較（同じapp・クリック数・mixの組み合わせのみ）"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {(run["app"], run["clicks"], run["mix"]): run for run in baseline["runs"]}
+
+    print(f"\n🔁 比較: {baseline['meta']['commit']} -> {results['meta']['commit']}")
+    for run in results["runs"]:
+        before = previous.get((run["app"], run["clicks"], run["mix"]))
+        if before is None:
+            continue
+        print(f"  {run['app']} / {format_size(run['clicks'])}:")
+        pairs = [("overall", before["overall"], run["overall"])]
+        pairs += [(name, before["operations"][name], summary)
+                  for name, summary in run["operations"].items() if name in before["operations"]]
+        for name, old, new in pairs:
+            changes = []
+            for key in ("p50_ms", "p95_ms", "p99_ms", "rps"):
+                ratio = new[key] / old[key] if old[key] else 0.0
+                changes.append(f"{key.replace('_ms', '')} {old[key]:.2f}->{new[key]:.2f} (x{ratio:.2f})")
+            print(f"    {name:<15}" + "  ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="リダイレクト経路のレイテンシ・スループットベンチマーク")
+    parser.add_argument("--app", nargs="+", choices=sorted(APP_DIRS), default=["main"])
+    parser.add_argument("--clicks", nargs="+", default=["10k"], help="合成クリック数（例: 10k 1m 10m）")
+    parser.add_argument("--urls", type=int, default=None, help="合成URL数（既定: クリック数/100、最大10万）")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="mixed")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--warmup", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db-dir", default=os.path.join(ROOT, "benchmarks", "data"))
+    parser.add_argument("--output", default=None, help="結果JSONの保存先（既定: benchmarks/results/）")
+    parser.add_argument("--compare", default=None, help="比較する前回の結果JSON")
+    parser.add_argument("--keep-db", action="store_true", help="計測に使ったDBを削除しない")
+    parser.add_argument("--verbose", action="store_true", help="アプリのログを表示")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        # 子プロセス: 結果を--outputに書き出す
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(run_single(args), f)
+        return
+
+    commit = git_revision()
+    results = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "runs": []
+    }
+
+    # アプリ・データ量ごとに別プロセスで実行（モジュールの状態とDB_PATHを分離）
+    for app_name in args.app:
+        for size in args.clicks:
+            with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
+                worker_output = tmp.name
+            command = [
+                sys.executable, os.path.abspath(__file__), "--worker",
+                "--app", app_name, "--clicks", size, "--mix", args.mix,
+                "--requests", str(args.requests), "--warmup", str(args.warmup),
+                "--concurrency", str(args.concurrency), "--seed", str(args.seed),
+                "--db-dir", args.db_dir, "--output", worker_output
+            ]
+            if args.urls:
+                command += ["--urls", str(args.urls)]
+            if args.keep_db:
+                command.append("--keep-db")
+            if args.verbose:
+                command.append("--verbose")
+
+            try:
+                subprocess.run(command, check=True)
+                with open(worker_output, encoding="utf-8") as f:
+                    run = json.load(f)
+            except subprocess.CalledProcessError as e:
+                print(f"❌ {app_name} / {size} の計測に失敗しました (exit {e.returncode})")
+                continue
+            finally:
+                os.unlink(worker_output)
+
+            results["runs"].append(run)
+            print_run(run)
+
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results",
+        f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit}-{args.mix}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 結果を保存しました: {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""リファラー分類のマイクロベンチマーク（1クリックあたりの判定コスト）
+
+使い方:
+    python benchmarks/bench_referrer.py [--iterations 200000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from referrer_classifier import ReferrerClassifier, DETAILED_RULES, SIMPLE_RULES
+
+# 実際のトラフィックに近い分布（上位ホストに偏る）
+SAMPLE_REFERRERS = [
+    "https://t.co/AbCdEf123",
+    "https://x.com/someone/status/1234567890",
+    "https://twitter.com/home",
+    "https://www.google.com/",
+    "https://www.google.co.jp/search?q=link",
+    "https://www.facebook.com/",
+    "https://l.facebook.com/l.php?u=https%3A%2F%2Fexample.com",
+    "https://m.youtube.com/watch?v=abc",
+    "https://youtu.be/abc",
+    "https://www.instagram.com/",
+    "https://www.linkedin.com/feed/",
+    "https://www.tiktok.com/@user",
+    "https://line.me/R/msg/text/",
+    "https://mail.google.com/mail/u/0/",
+    "https://www.bing.com/search?q=link",
+    "https://www.reddit.com/r/python/",
+    "https://news.ycombinator.com/",
+    "https://blog.example.com/post/1",
+]
+
+
+def legacy_detailed(referrer):
+    """変更前のdetermine_traffic_source（urlparse + 部分一致ループ）"""
+    if not referrer:
+        return "direct"
+    domain = urlparse(referrer).netloc.lower()
+    social_platforms = {
+        "twitter.com": "twitter", "t.co": "twitter", "facebook.com": "facebook",
+        "instagram.com": "instagram", "linkedin.com": "linkedin", "youtube.com": "youtube",
+        "tiktok.com": "tiktok", "line.me": "line"
+    }
+    for platform_domain, platform_name in social_platforms.items():
+        if platform_domain in domain:
+            return platform_name
+    search_engines = {"google": "google", "yahoo": "yahoo", "bing": "bing", "duckduckgo": "duckduckgo"}
+    for engine_name, engine_source in search_engines.items():
+        if engine_name in domain:
+            return f"search_{engine_source}"
+    if "mail" in domain or "outlook" in domain or "gmail" in domain:
+        return "email"
+    return f"referral_{domain}"
+
+
+def legacy_simple(referrer):
+    """変更前のbackendの判定（if/elifの部分一致チェーン）"""
+    referrer_lower = referrer.lower()
+    if any(domain in referrer_lower for domain in ["twitter.com", "t.co", "x.com"]):
+        return "twitter"
+    elif "facebook.com" in referrer_lower or "fb.me" in referrer_lower:
+        return "facebook"
+    elif "google.com" in referrer_lower:
+        return "google"
+    elif "youtube.com" in referrer_lower or "youtu.be" in referrer_lower:
+        return "youtube"
+    elif "instagram.com" in referrer_lower:
+        return "instagram"
+    elif "linkedin.com" in referrer_lower:
+        return "linkedin"
+    elif "tiktok.com" in referrer_lower:
+        return "tiktok"
+    return "referrer"
+
+
+def measure(func, referrers):
+    """1件あたりの平均処理時間（ナノ秒）"""
+    started = time.perf_counter_ns()
+    for referrer in referrers:
+        func(referrer)
+    return (time.perf_counter_ns() - started) / len(referrers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="リファラー分類のマイクロベンチマーク")
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    weights = [1 / (rank + 1) for rank in range(len(SAMPLE_REFERRERS))]
+    hot = rng.choices(SAMPLE_REFERRERS, weights=weights, k=args.iterations)
+    # メモ化が効かない場合（毎回異なるホスト）
+    cold = [f"https://site{i}.example.org/page" for i in range(args.iterations)]
+
+    detailed = ReferrerClassifier(DETAILED_RULES["domains"], DETAILED_RULES["paths"],
+                                  DETAILED_RULES["labels"], default="referral_{host}")
+    simple = ReferrerClassifier(SIMPLE_RULES["domains"], labels=SIMPLE_RULES["labels"])
+
+    cases = [
+        ("legacy determine_traffic_source", legacy_detailed, hot),
+        ("compiled detailed (memo hit)", detailed.classify, hot),
+        ("compiled detailed (unique hosts)", detailed.classify, cold),
+        ("legacy backend if/elif chain", legacy_simple, hot),
+        ("compiled simple (memo hit)", simple.classify, hot),
+    ]
+
+    print(f"📊 リファラー分類ベンチマーク（{args.iterations:,}件）")
+    for name, func, referrers in cases:
+        measure(func, referrers[:1000])  # ウォームアップ
+        print(f"  {name:<36} {measure(func, referrers):>8.0f} ns/click")
+
+    # 判定結果の違い（部分一致による誤判定の修正分）
+    changed = {r: (legacy_simple(r), simple.classify(r)) for r in SAMPLE_REFERRERS
+               if legacy_simple(r) != simple.classify(r)}
+    for referrer, (before, after) in changed.items():
+        print(f"  🔁 {referrer}: {before} -> {after}")
+
+
+if __name__ == "__main__":
+    main()
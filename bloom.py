@@ -0,0 +1,244 @@
+import hashlib
+import math
+import threading
+import time
+from typing import Any, Dict, Iterable
+
+# 絶対インポート
+import config
+from db_pool import get_pool
+
+
+class BloomFilter:
+    """文字列キー用のBloomフィルタ（偽陰性なし、偽陽性はerror_rate程度）"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = max(1, int(capacity))
+        self.error_rate = error_rate
+
+        # 容量と目標偽陽性率から最適なビット数・ハッシュ数を決める
+        self.num_bits = max(64, int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / self.capacity * math.log(2))))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def add(self, key: str) -> None:
+        """キーを追加"""
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def update(self, keys: Iterable[str]) -> None:
+        """複数のキーを追加"""
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+    def expected_error_rate(self) -> float:
+        """現在の登録件数での理論上の偽陽性率"""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    def _positions(self, key: str):
+        # 128bitハッシュを2つに分けたダブルハッシングでk個の位置を求める
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+
+class ShortCodeFilter:
+    """既存の短縮コードを保持するBloomフィルタ
+
+    フィルタに含まれないコードは存在しないことが確定するため、
+    DBに問い合わせずに404を返せる。起動時にurlsテーブルから構築し、
+    短縮・一括生成時にadd()で追加する。別ワーカーで作成されたコードは
+    バックグラウンドのスレッドがrefresh_interval_msごとに新規行
+    （id > 前回取り込んだid）を取り込む。構築・取り込み・容量超過時の作り直しは
+    すべてそのスレッドで行い、might_exist()はメモリ上の判定だけでDBに触れない。
+    """
+
+    def __init__(self, db_path: str, capacity: int = None, error_rate: float = None,
+                 refresh_interval_ms: int = None, enabled: bool = None):
+        self.db_path = db_path
+        self.capacity = capacity or config.SHORT_CODE_FILTER_CAPACITY
+        self.error_rate = error_rate or config.SHORT_CODE_FILTER_ERROR_RATE
+        self.refresh_interval = (refresh_interval_ms if refresh_interval_ms is not None
+                                 else config.SHORT_CODE_FILTER_REFRESH_MS) / 1000
+        self.enabled = config.SHORT_CODE_FILTER_ENABLED if enabled is None else enabled
+
+        self._filter = None
+        self._last_id = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._rebuild_requested = False
+        # 構築中にadd()されたコード（新しいフィルタに入れ直してから差し替える）
+        self._pending = None
+        self._rebuild_lock = threading.Lock()
+
+        self.checks = 0
+        self.passed = 0
+        self.rejected = 0
+        self.false_positives = 0
+        self.refreshes = 0
+        self.rebuilds = 0
+        self.last_rebuild_ms = 0.0
+        self.refresh_errors = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self._filter is not None
+
+    def start(self) -> None:
+        """バックグラウンドの更新スレッドを起動（未構築ならスレッド内で構築する）"""
+        with self._lock:
+            if self._thread is None and self.enabled:
+                self._thread = threading.Thread(target=self._run, name="short-code-filter", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                if self._filter is None or self._rebuild_requested:
+                    self._rebuild_requested = False
+                    self.rebuild()
+                else:
+                    self._refresh()
+            except Exception as e:
+                print(f"⚠️ 短縮コードフィルタの更新エラー: {e}")
+                self.refresh_errors += 1
+            self._wakeup.wait(max(self.refresh_interval, 0.1))
+            self._wakeup.clear()
+
+    def rebuild(self) -> Dict[str, Any]:
+        """urlsテーブルの全短縮コードからフィルタを作り直す"""
+        with self._rebuild_lock:
+            started = time.perf_counter()
+            with self._lock:
+                self._pending = []
+            try:
+                conn = get_pool(self.db_path).reader()
+                rows = conn.execute("SELECT id, short_code FROM urls").fetchall()
+                conn.close()
+
+                # 追加分の余裕を持たせて容量を決める
+                bloom = BloomFilter(max(self.capacity, len(rows) * 2), self.error_rate)
+                last_id = 0
+                for url_id, short_code in rows:
+                    bloom.add(short_code)
+                    last_id = max(last_id, url_id)
+            except BaseException:
+                with self._lock:
+                    self._pending = None
+                raise
+
+            with self._lock:
+                # 読み込み後に追加されたコードはまだ入っていないため、差し替える前に入れ直す
+                for short_code in self._pending:
+                    bloom.add(short_code)
+                self._pending = None
+                self._filter = bloom
+                self._last_id = last_id
+                self.rebuilds += 1
+                self.last_rebuild_ms = round((time.perf_counter() - started) * 1000, 3)
+
+        print(f"✅ 短縮コードフィルタ構築完了: {bloom.count}件 ({self.last_rebuild_ms}ms)")
+        return self.stats()
+
+    def add(self, short_code: str) -> None:
+        """新しく作成した短縮コードを追加"""
+        with self._lock:
+            bloom = self._filter
+            if bloom is None:
+                return
+            bloom.add(short_code)
+            if self._pending is not None:
+                self._pending.append(short_code)
+        if bloom.count > bloom.capacity and not self._rebuild_requested:
+            # 想定件数を超えると偽陽性率が上がるため、更新スレッドで大きく作り直す
+            self._rebuild_requested = True
+            self.start()
+            self._wakeup.set()
+
+    def might_exist(self, short_code: str) -> bool:
+        """短縮コードが存在する可能性があればTrue（Falseなら確実に存在しない）
+
+        メモリ上の判定だけなのでイベントループから直接呼べる。構築前はDBに任せる（True）。
+        他のワーカーで作成された直後のコードは、次の取り込みまで（最大refresh_interval_ms）弾かれることがある。
+        """
+        if not self.enabled:
+            return True
+        if self._thread is None:
+            self.start()
+
+        bloom = self._filter
+        if bloom is None:
+            return True
+
+        self.checks += 1
+        if short_code in bloom:
+            self.passed += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def record_false_positive(self) -> None:
+        """フィルタを通過したがDBに存在しなかったコードを記録"""
+        self.false_positives += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """フィルタの統計を取得"""
+        bloom = self._filter
+        negatives = self.rejected + self.false_positives
+        return {
+            "enabled": self.enabled,
+            "loaded": bloom is not None,
+            "size": bloom.count if bloom else 0,
+            "capacity": bloom.capacity if bloom else self.capacity,
+            "num_bits": bloom.num_bits if bloom else 0,
+            "num_hashes": bloom.num_hashes if bloom else 0,
+            "target_fp_rate": self.error_rate,
+            "expected_fp_rate": round(bloom.expected_error_rate(), 6) if bloom else 0.0,
+            "observed_fp_rate": round(self.false_positives / negatives, 6) if negatives else 0.0,
+            "checks": self.checks,
+            "passed": self.passed,
+            "rejected": self.rejected,
+            "false_positives": self.false_positives,
+            "refreshes": self.refreshes,
+            "rebuilds": self.rebuilds,
+            "last_rebuild_ms": self.last_rebuild_ms,
+            "refresh_errors": self.refresh_errors
+        }
+
+    def _refresh(self) -> bool:
+        """前回以降に追加された短縮コードを取り込む（更新スレッドから呼ぶ）"""
+        with self._lock:
+            last_id = self._last_id
+
+        conn = get_pool(self.db_path).reader()
+        rows = conn.execute(
+            "SELECT id, short_code FROM urls WHERE id > ? ORDER BY id", (last_id,)
+        ).fetchall()
+        conn.close()
+
+        self.refreshes += 1
+        if not rows:
+            return False
+
+        for url_id, short_code in rows:
+            # このワーカーで追加済みのコードは数え直さない
+            if short_code not in self._filter:
+                self.add(short_code)
+        with self._lock:
+            self._last_id = max(self._last_id, rows[-1][0])
+        return True
+
+
+# アプリ全体で共有するフィルタ
+short_code_filter = ShortCodeFilter(config.DB_PATH)
@@ -0,0 +1,85 @@
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+# 絶対インポート
+from short_codes import existing_short_codes, is_short_code_conflict, MAX_INSERT_ATTEMPTS
+
+# insert_urlsが行ごとに返すエラー
+ERROR_DUPLICATE_IN_BATCH = "duplicate_in_batch"
+ERROR_ALREADY_EXISTS = "already_exists"
+
+
+def insert_urls(conn: sqlite3.Connection, rows: List[Dict[str, Any]],
+                allocator) -> List[Tuple[Optional[str], Optional[str]]]:
+    """複数のURLを1回のexecutemanyでurlsに挿入し、行ごとに(短縮コード, エラー)を返す
+
+    rowsはurlsの列名->値の辞書（全行で同じ列）。short_codeを指定した行はカスタムスラッグとして
+    バッチ内の重複・既存との重複をまとめて確認し、重複した行はERROR_DUPLICATE_IN_BATCHか
+    ERROR_ALREADY_EXISTSを返して挿入しない。それ以外の行にはallocator（short_codes.get_allocator）で
+    まとめてコードを割り当てる。割り当てたコードが既存と重なった場合は、その行だけ割り当て直して挿入し直す。
+
+    呼び出し元のトランザクション内ならその一部として挿入し、コミット・ロールバックは呼び出し元に任せる。
+    トランザクション外で呼ばれた場合は自分でBEGINし、全行をまとめてコミットする（失敗時は1行も残さない）。
+    """
+    if not rows:
+        return []
+    if conn.in_transaction:
+        return _insert_urls(conn, rows, allocator)
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        results = _insert_urls(conn, rows, allocator)
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    return results
+
+
+def _insert_urls(conn: sqlite3.Connection, rows: List[Dict[str, Any]],
+                 allocator) -> List[Tuple[Optional[str], Optional[str]]]:
+    results: List[Tuple[Optional[str], Optional[str]]] = [(None, None)] * len(rows)
+
+    custom = {}
+    for index, row in enumerate(rows):
+        code = row.get("short_code")
+        if not code:
+            continue
+        if code in custom:
+            results[index] = (code, ERROR_DUPLICATE_IN_BATCH)
+        else:
+            custom[code] = index
+    for code in existing_short_codes(conn, custom):
+        results[custom.pop(code)] = (code, ERROR_ALREADY_EXISTS)
+    for code, index in custom.items():
+        results[index] = (code, None)
+
+    pending = [index for index, row in enumerate(rows) if not row.get("short_code")]
+    for index, code in zip(pending, allocator.allocate(len(pending), conn=conn, reserved=custom)):
+        results[index] = (code, None)
+
+    columns = ["short_code"] + [column for column in rows[0] if column != "short_code"]
+    sql = f"INSERT INTO urls ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    for attempt in range(MAX_INSERT_ATTEMPTS):
+        # 失敗した場合にバッチ全体を取り消せるようセーブポイント内で挿入する（トランザクション内なのでRELEASEではコミットされない）
+        conn.execute("SAVEPOINT insert_urls")
+        try:
+            conn.executemany(sql, [
+                (code,) + tuple(rows[index].get(column) for column in columns[1:])
+                for index, (code, error) in enumerate(results) if error is None
+            ])
+        except sqlite3.IntegrityError as e:
+            conn.execute("ROLLBACK TO insert_urls")
+            conn.execute("RELEASE insert_urls")
+            conflicted = []
+            if is_short_code_conflict(e) and attempt < MAX_INSERT_ATTEMPTS - 1:
+                taken = existing_short_codes(conn, [results[index][0] for index in pending])
+                conflicted = [index for index in pending if results[index][0] in taken]
+            if not conflicted:
+                raise
+            allocator.collisions += len(conflicted)
+            for index, code in zip(conflicted, allocator.allocate(len(conflicted), conn=conn, reserved=custom)):
+                results[index] = (code, None)
+            continue
+        conn.execute("RELEASE insert_urls")
+        return results
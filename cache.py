@@ -0,0 +1,260 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+# 絶対インポート
+import config
+
+
+class LRUCache:
+    """TTL付きLRUキャッシュ（スレッドセーフ）"""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300):
+        self.max_size = max(1, int(max_size))
+        self.ttl = ttl  # 秒（0以下で無期限）
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """キーに対応する値を取得（期限切れ・未登録の場合はdefault）"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """値を登録（上限を超えた場合は最も古いエントリを追い出す）"""
+        expires_at = time.monotonic() + self.ttl if self.ttl and self.ttl > 0 else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> bool:
+        """指定キーを無効化"""
+        with self._lock:
+            if self._data.pop(key, None) is None:
+                return False
+            self.invalidations += 1
+            return True
+
+    def clear(self) -> None:
+        """全エントリを破棄"""
+        with self._lock:
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット率などの統計を取得"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
+
+
+class StaleWhileRevalidateCache:
+    """集計結果のキャッシュ（stale-while-revalidate）
+
+    取得からinterval秒を過ぎた値も待たせずに返し、裏で再計算する。
+    同じキーの計算は同時に1つだけ実行し（single-flight）、初回の計算中に
+    来たリクエストは同じ計算の結果を待つ。読まれているキーはinterval秒ごとに
+    バックグラウンドで更新し、idle_intervals回分読まれなかったキーは破棄する。
+    """
+
+    def __init__(self, interval: float = None, idle_intervals: int = 10):
+        self.interval = config.ANALYTICS_UPDATE_INTERVAL if interval is None else interval  # 0以下で無効
+        self.idle_intervals = idle_intervals
+        self._entries: Dict[Hashable, dict] = {}
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._refresher: Optional[asyncio.Task] = None
+        self._loop = None
+        # invalidate()のたびに進め、それより前に始まった読み込みの結果は書き戻さない
+        self._generation = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.last_refresh_ms = 0.0
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """キャッシュの値を返す（未登録ならloaderの結果を待ち、古ければ裏で更新）"""
+        if self.interval <= 0:
+            return await loader()
+
+        self._bind_loop()
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            if key in self._inflight:
+                self.coalesced += 1
+            # 待っているリクエストが切断されても計算は続け、他の待ち手に結果を渡す
+            return await asyncio.shield(self._refresh(key, loader))
+
+        entry["last_read"] = now
+        entry["loader"] = loader
+        if now - entry["loaded_at"] >= self.interval:
+            self.stale_hits += 1
+            self._refresh(key, loader)
+        else:
+            self.hits += 1
+        return entry["value"]
+
+    def invalidate(self, key: Hashable = None) -> None:
+        """キー（省略時は全件）を破棄し、次の取得で再計算させる
+
+        実行中の読み込みは破棄前のデータを読んでいる可能性があるため、
+        待っているリクエストには返すがキャッシュには書き戻さない。
+        """
+        self._generation += 1
+        if key is None:
+            self._entries.clear()
+            self._inflight = {}
+        else:
+            self._entries.pop(key, None)
+            self._inflight.pop(key, None)
+
+    def stop(self) -> None:
+        """バックグラウンド更新を停止（シャットダウン時）"""
+        if self._refresher is not None:
+            self._refresher.cancel()
+        self._refresher = None
+        self._loop = None
+        self._inflight = {}
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット率などの統計を取得"""
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "interval_seconds": self.interval,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            "coalesced": self.coalesced,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "last_refresh_ms": self.last_refresh_ms,
+            "refreshing": len(self._inflight)
+        }
+
+    def _bind_loop(self) -> None:
+        # 実行中のイベントループに更新タスクを紐付ける（ループが変わったら作り直す）
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._inflight = {}
+            self._refresher = loop.create_task(self._refresh_loop())
+
+    def _refresh(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._load(key, loader))
+            # 誰も待っていない更新の例外を未取得のまま残さない
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+        return task
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        started = time.perf_counter()
+        generation = self._generation
+        task = asyncio.current_task()
+        try:
+            value = await loader()
+        except Exception as e:
+            self.refresh_errors += 1
+            print(f"⚠️ 集計キャッシュの更新エラー ({key}): {e}")
+            raise
+        finally:
+            # 破棄後に始まった同じキーの読み込みは消さない
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+
+        if generation != self._generation:
+            return value
+
+        now = time.monotonic()
+        previous = self._entries.get(key)
+        self._entries[key] = {
+            "value": value,
+            "loaded_at": now,
+            "last_read": previous["last_read"] if previous else now,
+            "loader": loader
+        }
+        self.refreshes += 1
+        self.last_refresh_ms = round((time.perf_counter() - started) * 1000, 3)
+        return value
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            for key, entry in list(self._entries.items()):
+                if now - entry["last_read"] > self.interval * self.idle_intervals:
+                    self._entries.pop(key, None)
+                elif now - entry["loaded_at"] >= self.interval:
+                    self._refresh(key, entry["loader"])
+
+
+# 短縮コード解決キャッシュ: short_code -> (url_id, original_url, is_active)
+short_code_cache = LRUCache(
+    max_size=config.SHORT_CODE_CACHE_SIZE,
+    ttl=config.SHORT_CODE_CACHE_TTL
+)
+
+
+# 管理ダッシュボードの集計キャッシュ（ANALYTICS_UPDATE_INTERVALごとに更新）
+dashboard_cache = StaleWhileRevalidateCache()
+
+
+def get_cached_url(short_code: str) -> Optional[tuple]:
+    """キャッシュから短縮コードの解決結果を取得"""
+    return short_code_cache.get(short_code)
+
+
+def cache_url(short_code: str, url_id: int, original_url: str, is_active) -> tuple:
+    """短縮コードの解決結果をキャッシュに登録"""
+    entry = (url_id, original_url, bool(is_active))
+    short_code_cache.set(short_code, entry)
+    return entry
+
+
+def invalidate_url(short_code: str) -> None:
+    """短縮コードの作成・変更・削除時にキャッシュを無効化"""
+    short_code_cache.invalidate(short_code)
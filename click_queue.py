@@ -0,0 +1,212 @@
+import atexit
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Sequence
+
+# 絶対インポート
+import config
+from db_pool import get_pool
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest")
+
+
+class ClickIngestQueue:
+    """クリック記録用のバッファ付き非同期キュー
+
+    リダイレクト応答とは切り離してクリックを溜め込み、batch_size件ごと
+    またはflush_interval_msごとにexecutemanyで1トランザクションにまとめて書き込む。
+    バッファがmax_sizeに達した場合はoverflow_policyに従ってクリックを破棄する。
+    add_listener()で登録した関数は書き込みと同じトランザクション内で呼ばれる（集計テーブルの更新など）。
+    add_commit_listener()で登録した関数はコミット後に呼ばれる（ライブ配信など、確定したクリックだけを扱うもの）。
+    """
+
+    def __init__(self, db_path: str, columns: Sequence[str], table: str = "clicks",
+                 batch_size: int = None, flush_interval_ms: int = None,
+                 max_size: int = None, overflow_policy: str = None):
+        self.db_path = db_path
+        self.columns = tuple(columns)
+        self.table = table
+        self.batch_size = max(1, batch_size or config.CLICK_QUEUE_BATCH_SIZE)
+        self.flush_interval = (flush_interval_ms or config.CLICK_QUEUE_FLUSH_INTERVAL_MS) / 1000
+        self.max_size = max(self.batch_size, max_size or config.CLICK_QUEUE_MAX_SIZE)
+        self.overflow_policy = overflow_policy or config.CLICK_QUEUE_OVERFLOW_POLICY
+        if self.overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"不明なoverflow_policyです: {self.overflow_policy}")
+
+        self._insert_sql = (
+            f"INSERT INTO {table} ({', '.join(self.columns)}) "
+            f"VALUES ({', '.join('?' for _ in self.columns)})"
+        )
+        self._buffer: deque = deque()
+        self._listeners = []
+        self._commit_listeners = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._atexit_registered = False
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.listener_errors = 0
+        self.last_flush_ms = 0.0
+
+    def start(self) -> None:
+        """書き込みスレッドを起動"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="click-ingest", daemon=True)
+            self._thread.start()
+
+        if not self._atexit_registered:
+            atexit.register(self.stop)
+            self._atexit_registered = True
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """書き込みスレッドを停止し、残りのクリックを全て書き出す"""
+        with self._cond:
+            thread = self._thread
+            self._running = False
+            self._cond.notify_all()
+
+        if thread is not None:
+            thread.join(timeout)
+        self._thread = None
+
+        # スレッドが取りこぼした分を同期的に書き出す
+        while self._buffer:
+            if not self.flush():
+                break
+
+    def add_listener(self, listener: Callable[[Any, list], Any]) -> None:
+        """書き込みと同じトランザクション内で呼ぶ関数(conn, batch)を登録"""
+        self._listeners.append(listener)
+
+    def add_commit_listener(self, listener: Callable[[list], Any]) -> None:
+        """書き込みのコミット後に呼ぶ関数(batch)を登録"""
+        self._commit_listeners.append(listener)
+
+    def enqueue(self, click: Dict[str, Any]) -> bool:
+        """クリックをバッファに追加（DB書き込みは待たない）"""
+        if not self._running:
+            self.start()
+
+        with self._cond:
+            if len(self._buffer) >= self.max_size:
+                self.dropped += 1
+                if self.overflow_policy == "drop_newest":
+                    return False
+                self._buffer.popleft()
+
+            self._buffer.append(click)
+            self.enqueued += 1
+
+            if len(self._buffer) == 1 or len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+
+        return True
+
+    def flush(self) -> int:
+        """バッファ内のクリックを1トランザクションで書き込み、書き込んだ件数を返す"""
+        with self._flush_lock:
+            with self._cond:
+                batch = list(self._buffer)
+                self._buffer.clear()
+
+            if not batch:
+                return 0
+
+            started = time.perf_counter()
+            rows = [tuple(click.get(column) for column in self.columns) for click in batch]
+
+            try:
+                with get_pool(self.db_path).writer() as conn:
+                    conn.executemany(self._insert_sql, rows)
+                    self._notify_listeners(conn, batch)
+            except Exception as e:
+                print(f"⚠️ クリック一括書き込みエラー: {e}")
+                self.flush_errors += 1
+                self._requeue(batch)
+                return 0
+
+            self.written += len(batch)
+            self.flushes += 1
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 3)
+            self._notify_commit_listeners(batch)
+            return len(batch)
+
+    def pending(self) -> int:
+        """未書き込みのクリック件数"""
+        return len(self._buffer)
+
+    def stats(self) -> Dict[str, Any]:
+        """キューの統計を取得"""
+        return {
+            "running": self._running,
+            "pending": len(self._buffer),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "listener_errors": self.listener_errors,
+            "last_flush_ms": self.last_flush_ms,
+            "batch_size": self.batch_size,
+            "flush_interval_ms": int(self.flush_interval * 1000),
+            "max_size": self.max_size,
+            "overflow_policy": self.overflow_policy
+        }
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if self._running and not self._buffer:
+                    self._cond.wait()
+                if self._running and len(self._buffer) < self.batch_size:
+                    # 次のクリックをflush_intervalまで待ってまとめる
+                    self._cond.wait(self.flush_interval)
+                running = self._running
+
+            written = self.flush()
+
+            if not running:
+                break
+            if self._buffer and not written:
+                # 書き込み失敗時は少し待ってから再試行
+                time.sleep(self.flush_interval)
+
+    def _notify_listeners(self, conn, batch: list) -> None:
+        """リスナーを呼ぶ（失敗したリスナーの変更だけを取り消し、クリックの書き込みは続行）"""
+        for listener in self._listeners:
+            conn.execute("SAVEPOINT click_listener")
+            try:
+                listener(conn, batch)
+            except Exception as e:
+                print(f"⚠️ クリック書き込みリスナーエラー: {e}")
+                self.listener_errors += 1
+                conn.execute("ROLLBACK TO click_listener")
+            conn.execute("RELEASE click_listener")
+
+    def _notify_commit_listeners(self, batch: list) -> None:
+        """コミット後のリスナーを呼ぶ（失敗しても書き込み済みのクリックには影響しない）"""
+        for listener in self._commit_listeners:
+            try:
+                listener(batch)
+            except Exception as e:
+                print(f"⚠️ クリックコミット後リスナーエラー: {e}")
+                self.listener_errors += 1
+
+    def _requeue(self, batch: list) -> None:
+        """書き込みに失敗したクリックをバッファの先頭に戻す"""
+        with self._cond:
+            space = self.max_size - len(self._buffer)
+            if space < len(batch):
+                self.dropped += len(batch) - max(space, 0)
+                batch = batch[len(batch) - max(space, 0):]
+            self._buffer.extendleft(reversed(batch))
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import secrets
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+# 絶対インポート
+import config
+from cache import LRUCache
+from db_pool import get_pool
+
+
+class _Subscriber:
+    """SSE接続1本分の待ち合わせ（書き込みスレッドからイベントループへ通知する）"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.wakeup = asyncio.Event()
+        self.sent = 0
+        self.missed = 0
+
+    def notify(self) -> None:
+        self.loop.call_soon_threadsafe(self.wakeup.set)
+
+
+class ClickStream:
+    """クリックのライブ配信（Server-Sent Events）用のプロセス内pub/sub
+
+    ClickIngestQueueのコミット後リスナーとしてpublish()を登録すると、書き込まれた
+    クリックが連番付きでリングバッファに入る。各接続はバッファを自分の位置から
+    読むだけなので、接続数が増えてもDBへの問い合わせは増えず、メモリもバッファ分で一定。
+    読むのが遅い接続はバッファの古い側から追い越された分だけgapイベントで通知し、
+    他の接続や書き込みは待たせない。Last-Event-IDで切断前の続きから再開できる。
+
+    イベントIDは「プロセスごとの起動ID-連番」。再起動後や別ワーカーへの再接続では
+    起動IDが変わるため、続きとは見なさずgapイベント（missed=None）で全件の取り直しを促す。
+    """
+
+    def __init__(self, db_path: str, buffer_size: int = None, max_subscribers: int = None,
+                 heartbeat_seconds: float = None):
+        self.db_path = db_path
+        self.buffer_size = max(1, buffer_size or config.CLICK_STREAM_BUFFER_SIZE)
+        self.max_subscribers = max_subscribers or config.CLICK_STREAM_MAX_SUBSCRIBERS
+        self.heartbeat_seconds = heartbeat_seconds or config.CLICK_STREAM_HEARTBEAT_SECONDS
+        self._events: deque = deque(maxlen=self.buffer_size)
+        self._subscribers: List[_Subscriber] = []
+        self._lock = threading.Lock()
+        # url_id -> (short_code, campaign_name)。キャンペーン変更もTTLで反映
+        self._urls = LRUCache(max_size=10000, ttl=60)
+        # 起動ごとに変わるID。連番はプロセス内でのみ比較できる
+        self.epoch = secrets.token_hex(4)
+        self._last_seq = 0
+
+        self.published = 0
+        self.total_subscribers = 0
+        self.rejected = 0
+        self.missed = 0
+
+    def publish(self, batch: list) -> None:
+        """書き込み済みのクリックを配信（ClickIngestQueue.add_commit_listenerに登録）"""
+        urls = self.lookup_urls({click.get("url_id") for click in batch})
+        with self._lock:
+            for click in batch:
+                short_code, campaign_name = urls.get(click.get("url_id"), (None, None))
+                self._last_seq += 1
+                self._events.append((self._last_seq, short_code, campaign_name, {
+                    "id": self._event_id(self._last_seq),
+                    "short_code": short_code,
+                    "campaign_name": campaign_name,
+                    "source": click.get("source"),
+                    "referrer": click.get("referrer"),
+                    "ip_address": click.get("ip_address"),
+                    "device_type": click.get("device_type"),
+                    "clicked_at": click.get("clicked_at") or click.get("created_at")
+                }))
+            self.published += len(batch)
+            subscribers = list(self._subscribers)
+
+        for subscriber in subscribers:
+            try:
+                subscriber.notify()
+            except RuntimeError:
+                # イベントループが終了済み（シャットダウン中）
+                self._remove(subscriber)
+
+    def lookup_urls(self, url_ids: set) -> Dict[int, tuple]:
+        """url_idの集合 -> {url_id: (short_code, campaign_name)}（キャッシュにない分だけ1クエリで取得）"""
+        urls = {}
+        missing = []
+        for url_id in url_ids:
+            entry = self._urls.get(url_id)
+            if entry is None:
+                missing.append(url_id)
+            else:
+                urls[url_id] = entry
+        if missing:
+            conn = get_pool(self.db_path).reader()
+            try:
+                rows = conn.execute(
+                    f"SELECT id, short_code, campaign_name FROM urls WHERE id IN ({', '.join('?' for _ in missing)})",
+                    missing
+                ).fetchall()
+            finally:
+                conn.close()
+            for url_id, short_code, campaign_name in rows:
+                urls[url_id] = (short_code, campaign_name)
+                self._urls.set(url_id, (short_code, campaign_name))
+        return urls
+
+    async def subscribe(self, short_code: Optional[str] = None, campaign: Optional[str] = None,
+                        last_event_id: Optional[str] = None, backlog: int = 0) -> AsyncIterator[str]:
+        """SSE形式の文字列を順に返す（short_code・campaignで絞り込み、last_event_idの次から再開）
+
+        接続数がmax_subscribersに達している場合はOverflowError、last_event_idの形式が不正ならValueError。
+        """
+        resume = parse_event_id(last_event_id) if last_event_id else None
+        subscriber = _Subscriber(asyncio.get_running_loop())
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                self.rejected += 1
+                raise OverflowError("ライブ配信の接続数が上限に達しています")
+            self._subscribers.append(subscriber)
+            self.total_subscribers += 1
+            first_seq = self._events[0][0] if self._events else self._last_seq + 1
+            missed = 0
+            if resume is None:
+                # 新規接続はバッファにある直近backlog件から
+                cursor = max(self._last_seq - max(0, backlog), first_seq - 1)
+            elif resume[0] == self.epoch and resume[1] <= self._last_seq:
+                # 切断前の続きから（バッファから押し出された分は_readがgapとして数える）
+                cursor = resume[1]
+            else:
+                # 再起動前・別ワーカーのID: 続きは失われているため現在から（件数は不明）
+                cursor = self._last_seq
+                missed = None
+
+        try:
+            yield "retry: 3000\n\n"
+            if missed is None:
+                yield f"event: gap\ndata: {json.dumps({'missed': None})}\n\n"
+            while True:
+                subscriber.wakeup.clear()
+                events, missed, cursor = self._read(cursor)
+                if missed:
+                    subscriber.missed += missed
+                    with self._lock:
+                        self.missed += missed
+                    yield f"event: gap\ndata: {json.dumps({'missed': missed})}\n\n"
+
+                matched = [
+                    (seq, data) for seq, event_short_code, event_campaign, data in events
+                    if (short_code is None or event_short_code == short_code)
+                    and (campaign is None or event_campaign == campaign)
+                ]
+                if matched:
+                    subscriber.sent += len(matched)
+                    yield "".join(
+                        f"id: {self._event_id(seq)}\nevent: click\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                        for seq, data in matched
+                    )
+                if len(events) >= 200:
+                    # 追いつくまでは待たずに続きを読む
+                    continue
+
+                try:
+                    await asyncio.wait_for(subscriber.wakeup.wait(), self.heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    # 接続を維持するためのコメント行（プロキシのアイドル切断対策）
+                    yield ": keepalive\n\n"
+        finally:
+            self._remove(subscriber)
+
+    def _read(self, cursor: int, limit: int = 200) -> tuple:
+        """cursorより後のイベントを最大limit件取得し、(イベント, 取りこぼし件数, 新しい位置)を返す"""
+        with self._lock:
+            if not self._events or cursor >= self._last_seq:
+                return [], 0, cursor
+            first_seq = self._events[0][0]
+            missed = max(0, first_seq - cursor - 1)
+            start = max(cursor + 1, first_seq) - first_seq
+            events = [self._events[index] for index in range(start, min(start + limit, len(self._events)))]
+        return events, missed, events[-1][0] if events else cursor
+
+    def _event_id(self, seq: int) -> str:
+        return f"{self.epoch}-{seq}"
+
+    def _remove(self, subscriber: _Subscriber) -> None:
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def stats(self) -> Dict[str, Any]:
+        """配信の統計を取得"""
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "max_subscribers": self.max_subscribers,
+                "total_subscribers": self.total_subscribers,
+                "rejected": self.rejected,
+                "published": self.published,
+                "buffered": len(self._events),
+                "buffer_size": self.buffer_size,
+                "missed": self.missed,
+                "epoch": self.epoch,
+                "last_event_id": self._event_id(self._last_seq)
+            }
+
+
+def parse_event_id(event_id: str) -> tuple:
+    """イベントID（起動ID-連番）を(起動ID, 連番)に分解（形式が不正ならValueError）"""
+    epoch, separator, seq = event_id.strip().rpartition("-")
+    if not separator or not epoch:
+        raise ValueError(f"不正なイベントIDです: {event_id}")
+    return epoch, int(seq)
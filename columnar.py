@@ -0,0 +1,379 @@
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+# 絶対インポート
+from db_pool import get_pool
+
+# 条件付きインポート（NumPyがない環境ではエンジンを無効にしてSQLの集計だけを使う）
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+# 集計キー（group_by）として指定できる列
+GROUP_BY_KEYS = ("url", "campaign", "source", "device", "browser", "day", "hour", "weekday")
+
+NO_CAMPAIGN = ""  # キャンペーン未設定のリンク
+OTHER = "other"   # 辞書が満杯になった後の新しい値をまとめる値
+
+
+class _Dictionary:
+    """文字列 <-> 整数コードの辞書（列ごとに1つ）
+
+    コードは出現順に振り、max_codes個目以降の新しい値はすべてOTHERのコードにまとめる。
+    """
+
+    def __init__(self, max_codes: int):
+        self.max_codes = max_codes
+        self.codes: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def encode(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            if len(self.values) >= self.max_codes - 1 and value != OTHER:
+                return self.encode(OTHER)
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def encode_many(self, values: Tuple[str, ...]) -> List[int]:
+        """まとめてコードに変換（登録済みの値はdict.getだけで引き、新しい値がある時だけ登録する）"""
+        codes = list(map(self.codes.get, values))
+        if None in codes:
+            codes = [self.encode(value) if code is None else code for value, code in zip(values, codes)]
+        return codes
+
+    def lookup(self, values: Iterable[str]) -> List[int]:
+        """フィルタ用に値をコードに変換（未登録の値は無視）"""
+        return [self.codes[value] for value in values if value in self.codes]
+
+
+class ClickColumns:
+    """クリックデータを列ごとのNumPy配列で保持するインメモリ分析エンジン
+
+    - url_id: int32 / epoch: int64（UTC秒）
+    - source / device / browser: uint8（辞書エンコード、各255種類まで）
+    - キャンペーンはクリックごとには持たず、url_id -> キャンペーンコードの配列から引く
+
+    refresh()は前回読み込んだclicks.idより後の行だけを追加する。クエリは
+    フィルタをブールマスク、集計をbincount/uniqueで計算するため、SQLiteに戻って
+    行ごとに辞書を作るよりも桁違いに速く、任意の組み合わせで絞り込める。
+    端末種別・ブラウザの列がないアプリでは、classify_user_agentでUA文字列から
+    (端末種別, ブラウザ)を求める（同じUA文字列は一度だけ解析）。
+    """
+
+    def __init__(self, db_path: str, time_column: str = "clicked_at", device_column: Optional[str] = None,
+                 browser_column: Optional[str] = None,
+                 classify_user_agent: Optional[Callable[[str], Tuple[str, str]]] = None,
+                 batch_size: int = 50000):
+        self.db_path = db_path
+        self.classify_user_agent = classify_user_agent
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._ua_labels: Dict[str, Tuple[int, int]] = {}
+
+        self.refreshes = 0
+        self.last_refresh_ms = 0.0
+        self.resets = 0
+        self.queries = 0
+        self.last_query_ms = 0.0
+
+        ts = f"COALESCE({time_column}, datetime('now'))"
+        if device_column or browser_column or not classify_user_agent:
+            device = f"LOWER(COALESCE({device_column}, 'unknown'))" if device_column else "'unknown'"
+            browser = f"LOWER(COALESCE({browser_column}, 'unknown'))" if browser_column else "'unknown'"
+            labels = f"{device}, {browser}"
+        else:
+            labels = "COALESCE(user_agent, '')"
+        self._clicks_sql = f"""
+            SELECT id, url_id, CAST(strftime('%s', {ts}) AS INTEGER), COALESCE(source, 'direct'), {labels}
+            FROM clicks
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+        """
+        self._reset_state()
+
+    def _reset_state(self) -> None:
+        self.size = 0
+        self.last_click_id = 0
+        self.first_click_id = None
+        self.last_url_id = 0
+        self.sources = _Dictionary(256)
+        self.devices = _Dictionary(256)
+        self.browsers = _Dictionary(256)
+        self.campaigns = _Dictionary(1 << 31)
+        self.campaigns.encode(NO_CAMPAIGN)
+        self.short_codes: Dict[int, str] = {}
+        self.url_ids: Dict[str, int] = {}
+        self._ua_labels.clear()
+        if NUMPY_AVAILABLE:
+            self._url_id = np.zeros(0, dtype=np.int32)
+            self._epoch = np.zeros(0, dtype=np.int64)
+            self._source = np.zeros(0, dtype=np.uint8)
+            self._device = np.zeros(0, dtype=np.uint8)
+            self._browser = np.zeros(0, dtype=np.uint8)
+            self._url_campaign = np.zeros(1, dtype=np.int32)
+
+    @property
+    def enabled(self) -> bool:
+        return NUMPY_AVAILABLE
+
+    def reset(self) -> None:
+        """読み込んだデータを破棄（クリック・URLを削除した後など。次のrefresh()で読み直す）"""
+        with self._lock:
+            self._reset_state()
+            self.resets += 1
+
+    def refresh(self) -> int:
+        """前回の位置より後のクリック・URLを読み込み、追加した件数を返す"""
+        if not NUMPY_AVAILABLE:
+            return 0
+
+        started = time.perf_counter()
+        conn = get_pool(self.db_path).reader()
+        try:
+            with self._lock:
+                # 古いクリックが削除されていたら（保持期間のクリーンアップ）最初から読み直す
+                min_id = conn.execute("SELECT MIN(id) FROM clicks").fetchone()[0]
+                if self.first_click_id is not None and (min_id is None or min_id > self.first_click_id):
+                    self._reset_state()
+                    self.resets += 1
+
+                added = 0
+                while True:
+                    rows = conn.execute(self._clicks_sql, (self.last_click_id, self.batch_size)).fetchall()
+                    if not rows:
+                        break
+                    self._append(rows)
+                    added += len(rows)
+                    if len(rows) < self.batch_size:
+                        break
+                # クリックより後に読み、読み込んだクリックのURLが必ず含まれるようにする
+                self._load_urls(conn)
+
+                self.refreshes += 1
+                self.last_refresh_ms = round((time.perf_counter() - started) * 1000, 3)
+        finally:
+            conn.close()
+
+        if added >= self.batch_size:
+            print(f"✅ 列指向の分析データを読み込み: {added}件 ({self.last_refresh_ms}ms)")
+        return added
+
+    def warm_in_background(self) -> None:
+        """起動時に既存のクリックを別スレッドで読み込む（最初のクエリが全件の読み込みを待たないように）"""
+        if not NUMPY_AVAILABLE:
+            return
+
+        def warm():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"⚠️ 列指向の分析データの読み込みエラー: {e}")
+
+        threading.Thread(target=warm, name="columnar-warm", daemon=True).start()
+
+    def _load_urls(self, conn) -> None:
+        rows = conn.execute(
+            "SELECT id, short_code, COALESCE(campaign_name, '') FROM urls WHERE id > ? ORDER BY id",
+            (self.last_url_id,)
+        ).fetchall()
+        if not rows:
+            return
+        max_id = rows[-1][0]
+        self._reserve_urls(max_id)
+        for url_id, short_code, campaign_name in rows:
+            self._url_campaign[url_id] = self.campaigns.encode(campaign_name)
+            self.short_codes[url_id] = short_code
+            self.url_ids[short_code] = url_id
+        self.last_url_id = max_id
+
+    def _reserve_urls(self, max_id: int) -> None:
+        # url_id -> キャンペーンの配列をurl_idで直接引けるように広げる（未登録は0=キャンペーンなし）
+        if max_id >= len(self._url_campaign):
+            grown = np.zeros(max(max_id + 1, len(self._url_campaign) * 2), dtype=np.int32)
+            grown[:len(self._url_campaign)] = self._url_campaign
+            self._url_campaign = grown
+
+    def _append(self, rows: list) -> None:
+        ids, url_ids, epochs, sources, *labels = zip(*rows)
+        count = len(ids)
+        if self.classify_user_agent and len(labels) == 1:
+            device_codes, browser_codes = zip(*map(self._classify, labels[0]))
+        else:
+            device_codes = self.devices.encode_many(labels[0])
+            browser_codes = self.browsers.encode_many(labels[1])
+
+        end = self.size + count
+        if end > len(self._epoch):
+            self._grow(end)
+        self._url_id[self.size:end] = url_ids
+        self._epoch[self.size:end] = epochs
+        self._source[self.size:end] = self.sources.encode_many(sources)
+        self._device[self.size:end] = device_codes
+        self._browser[self.size:end] = browser_codes
+
+        self._reserve_urls(max(url_ids))
+        if self.first_click_id is None:
+            self.first_click_id = ids[0]
+        self.last_click_id = ids[-1]
+        self.size = end
+
+    def _classify(self, user_agent: str) -> Tuple[int, int]:
+        codes = self._ua_labels.get(user_agent)
+        if codes is None:
+            device, browser = self.classify_user_agent(user_agent)
+            codes = (self.devices.encode(str(device).lower()), self.browsers.encode(str(browser).lower()))
+            self._ua_labels[user_agent] = codes
+        return codes
+
+    def _grow(self, needed: int) -> None:
+        # 容量を倍々で確保し、追加のたびに配列全体をコピーしない
+        capacity = max(needed, len(self._epoch) * 2, 1024)
+        for name in ("_url_id", "_epoch", "_source", "_device", "_browser"):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+    def query(self, group_by: Optional[str] = None, url_id: Optional[int] = None,
+              campaign: Union[str, Iterable[str], None] = None, source: Union[str, Iterable[str], None] = None,
+              device: Union[str, Iterable[str], None] = None, browser: Union[str, Iterable[str], None] = None,
+              start: Optional[str] = None, end: Optional[str] = None, limit: int = 100) -> Dict[str, Any]:
+        """条件に合うクリック数を数え、group_byの値ごとに集計する
+
+        文字列の条件は1つの値または値のリスト。start/endはYYYY-MM-DD（UTC、両端を含む）。
+        不正なgroup_by・日付はValueError。
+        """
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("NumPyがインストールされていないため列指向の分析エンジンは使えません")
+        if group_by is not None and group_by not in GROUP_BY_KEYS:
+            raise ValueError(f"group_byは{', '.join(GROUP_BY_KEYS)}のいずれかを指定してください")
+        low = self._epoch_of(start) if start else None
+        high = self._epoch_of(end) + 86400 if end else None
+
+        self.refresh()
+        started = time.perf_counter()
+        with self._lock:
+            # 追加は末尾にしか書かず、拡張時は新しい配列を作るため、ビューはロック外でも変わらない
+            size = self.size
+            url_ids = self._url_id[:size]
+            epochs = self._epoch[:size]
+            columns = {"source": self._source[:size], "device": self._device[:size], "browser": self._browser[:size]}
+            dictionaries = {"source": self.sources, "device": self.devices, "browser": self.browsers,
+                            "campaign": self.campaigns}
+            url_campaign = self._url_campaign
+            short_codes = self.short_codes
+            last_click_id = self.last_click_id
+
+        mask = np.ones(size, dtype=bool)
+        if url_id is not None:
+            mask &= url_ids == url_id
+        if low is not None:
+            mask &= epochs >= low
+        if high is not None:
+            mask &= epochs < high
+        for name, values in (("source", source), ("device", device), ("browser", browser), ("campaign", campaign)):
+            if values is None:
+                continue
+            if isinstance(values, str):
+                values = [values]
+            if name in ("device", "browser"):
+                values = [value.lower() for value in values]
+            codes = dictionaries[name].lookup(values)
+            column = url_campaign[url_ids] if name == "campaign" else columns[name]
+            mask &= np.isin(column, codes)
+
+        total = int(np.count_nonzero(mask))
+        result = {
+            "total_clicks": total,
+            "group_by": group_by,
+            "groups": [],
+            "rows_scanned": size,
+            "last_click_id": last_click_id
+        }
+        if group_by and total:
+            result["groups"] = self._group(group_by, mask, url_ids, epochs, columns, dictionaries,
+                                           url_campaign, short_codes, limit)
+
+        self.queries += 1
+        self.last_query_ms = round((time.perf_counter() - started) * 1000, 3)
+        result["query_ms"] = self.last_query_ms
+        return result
+
+    @staticmethod
+    def _group(group_by, mask, url_ids, epochs, columns, dictionaries, url_campaign, short_codes,
+               limit) -> List[Dict[str, Any]]:
+        if group_by in ("day", "hour", "weekday"):
+            selected = epochs[mask]
+            if group_by == "day":
+                keys, counts = np.unique(selected // 86400, return_counts=True)
+                return [
+                    {"key": datetime.fromtimestamp(int(key) * 86400, timezone.utc).date().isoformat(),
+                     "clicks": int(count)}
+                    for key, count in zip(keys, counts)
+                ]
+            # 1970-01-01は木曜日（月曜=0として3）
+            keys = (selected // 3600) % 24 if group_by == "hour" else (selected // 86400 + 3) % 7
+            counts = np.bincount(keys, minlength=24 if group_by == "hour" else 7)
+            return [{"key": int(key), "clicks": int(count)} for key, count in enumerate(counts)]
+
+        if group_by == "url":
+            counts = np.bincount(url_ids[mask])
+            labels = short_codes
+        elif group_by == "campaign":
+            counts = np.bincount(url_campaign[url_ids[mask]])
+            labels = dictionaries["campaign"].values
+        else:
+            counts = np.bincount(columns[group_by][mask])
+            labels = dictionaries[group_by].values
+
+        keys = np.flatnonzero(counts)
+        # クリック数の多い順（同数はキーの順）に上位limit件
+        keys = keys[np.argsort(-counts[keys], kind="stable")][:limit]
+        if group_by == "url":
+            return [{"key": labels.get(int(key)), "url_id": int(key), "clicks": int(counts[key])} for key in keys]
+        return [{"key": labels[key], "clicks": int(counts[key])} for key in keys]
+
+    @staticmethod
+    def _epoch_of(day: str) -> int:
+        try:
+            parsed = datetime.strptime(day, "%Y-%m-%d")
+        except ValueError:
+            raise ValueError("日付はYYYY-MM-DD形式で指定してください")
+        return int(parsed.replace(tzinfo=timezone.utc).timestamp())
+
+    def stats(self) -> Dict[str, Any]:
+        """エンジンの統計を取得"""
+        stats = {"enabled": NUMPY_AVAILABLE}
+        if not NUMPY_AVAILABLE:
+            return stats
+        with self._lock:
+            stats.update({
+                "clicks": self.size,
+                "last_click_id": self.last_click_id,
+                "urls": len(self.short_codes),
+                "memory_bytes": sum(
+                    column.nbytes for column in
+                    (self._url_id, self._epoch, self._source, self._device, self._browser, self._url_campaign)
+                ),
+                "distinct": {
+                    "source": len(self.sources.values),
+                    "device": len(self.devices.values),
+                    "browser": len(self.browsers.values),
+                    "campaign": len(self.campaigns.values) - 1
+                },
+                "refreshes": self.refreshes,
+                "last_refresh_ms": self.last_refresh_ms,
+                "resets": self.resets,
+                "queries": self.queries,
+                "last_query_ms": self.last_query_ms
+            })
+        return stats
@@ -8,6 +8,17 @@ ENVIRONMENT = os.getenv("ENVIRONMENT", "production")
 
 # データベース設定
 DB_PATH = os.getenv("DB_PATH", "url_shortener.db")
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_FAST_WORKERS = int(os.getenv("DB_FAST_WORKERS", "8"))  # 短縮コード解決・作成用スレッド数
+DB_HEAVY_WORKERS = int(os.getenv("DB_HEAVY_WORKERS", "2"))  # 分析・エクスポート用スレッド数
+
+# ストレージプロファイル（init_db・接続プールで適用）
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL")
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")  # OFF / NORMAL / FULL / EXTRA
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))  # バイト
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "-20000"))  # 負の値はKiB単位
+DB_TEMP_STORE = os.getenv("DB_TEMP_STORE", "MEMORY")  # DEFAULT / FILE / MEMORY
 
 # セキュリティ設定
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
@@ -15,6 +26,13 @@ ALLOWED_HOSTS = os.getenv("ALLOWED_HOSTS", "*").split(",")
 
 # URL短縮設定
 SHORT_CODE_LENGTH = int(os.getenv("SHORT_CODE_LENGTH", "6"))
+SHORT_CODE_ALLOCATOR = os.getenv("SHORT_CODE_ALLOCATOR", "sequence")  # sequence（連番+置換）/ random / pool（確認済みランダムコードのプール）
+# sequenceのコード長。既定はSHORT_CODE_LENGTH+1（既定の6なら7文字）で、random/poolで発行済みのコードと長さが違うため衝突しない
+SEQUENCE_CODE_LENGTH = int(os.getenv("SEQUENCE_CODE_LENGTH", str(SHORT_CODE_LENGTH + 1)))
+SEQUENCE_BLOCK_SIZE = int(os.getenv("SEQUENCE_BLOCK_SIZE", "100"))  # DBから一度に借りる連番の数
+SHORT_CODE_KEY = os.getenv("SHORT_CODE_KEY", "link-tracker-short-codes")  # 連番の並べ替えの鍵（変更すると以前と違う並びになる）
+SHORT_CODE_POOL_SIZE = int(os.getenv("SHORT_CODE_POOL_SIZE", "1000"))  # poolで溜めておく未使用コード数
+SHORT_CODE_POOL_LOW_WATER = int(os.getenv("SHORT_CODE_POOL_LOW_WATER", "250"))  # これを下回ったら補充
 MAX_URL_LENGTH = int(os.getenv("MAX_URL_LENGTH", "2048"))
 MAX_CUSTOM_NAME_LENGTH = int(os.getenv("MAX_CUSTOM_NAME_LENGTH", "50"))
 
@@ -31,8 +49,50 @@ CLICK_DATA_RETENTION_DAYS = int(os.getenv("CLICK_DATA_RETENTION_DAYS", "365"))
 INACTIVE_URL_RETENTION_DAYS = int(os.getenv("INACTIVE_URL_RETENTION_DAYS", "730"))
 
 # 分析設定
-ANALYTICS_UPDATE_INTERVAL = int(os.getenv("ANALYTICS_UPDATE_INTERVAL", "60"))  # 秒
+ANALYTICS_UPDATE_INTERVAL = int(os.getenv("ANALYTICS_UPDATE_INTERVAL", "60"))  # 管理画面の集計キャッシュの更新間隔（秒）
 MAX_ANALYTICS_RECORDS = int(os.getenv("MAX_ANALYTICS_RECORDS", "10000"))
+COLUMNAR_BATCH_SIZE = int(os.getenv("COLUMNAR_BATCH_SIZE", "50000"))  # 列指向エンジンが一度に読み込むクリック数
+
+# キャッシュ設定
+SHORT_CODE_CACHE_SIZE = int(os.getenv("SHORT_CODE_CACHE_SIZE", "10000"))
+SHORT_CODE_CACHE_TTL = int(os.getenv("SHORT_CODE_CACHE_TTL", "300"))  # 秒
+
+# 短縮コードフィルタ設定（存在しないコードをDBに問い合わせずに弾く）
+SHORT_CODE_FILTER_ENABLED = os.getenv("SHORT_CODE_FILTER_ENABLED", "True").lower() == "true"
+SHORT_CODE_FILTER_CAPACITY = int(os.getenv("SHORT_CODE_FILTER_CAPACITY", "100000"))
+SHORT_CODE_FILTER_ERROR_RATE = float(os.getenv("SHORT_CODE_FILTER_ERROR_RATE", "0.001"))
+SHORT_CODE_FILTER_REFRESH_MS = int(os.getenv("SHORT_CODE_FILTER_REFRESH_MS", "1000"))
+
+# リファラー分類設定
+REFERRER_CACHE_SIZE = int(os.getenv("REFERRER_CACHE_SIZE", "4096"))  # ホスト名の判定結果をメモ化する件数
+
+# User-Agent解析キャッシュ設定
+UA_CACHE_SIZE = int(os.getenv("UA_CACHE_SIZE", "5000"))
+UA_CACHE_WARM_TOP = int(os.getenv("UA_CACHE_WARM_TOP", "500"))  # 起動時に解析しておく上位UA数
+UA_CACHE_WARM_SAMPLE = int(os.getenv("UA_CACHE_WARM_SAMPLE", "100000"))  # 集計対象の直近クリック数
+
+# クリック記録キュー設定
+CLICK_QUEUE_BATCH_SIZE = int(os.getenv("CLICK_QUEUE_BATCH_SIZE", "100"))
+CLICK_QUEUE_FLUSH_INTERVAL_MS = int(os.getenv("CLICK_QUEUE_FLUSH_INTERVAL_MS", "200"))
+CLICK_QUEUE_MAX_SIZE = int(os.getenv("CLICK_QUEUE_MAX_SIZE", "10000"))
+CLICK_QUEUE_OVERFLOW_POLICY = os.getenv("CLICK_QUEUE_OVERFLOW_POLICY", "drop_oldest")  # drop_oldest / drop_newest
+
+# クリックのライブ配信（SSE）設定
+CLICK_STREAM_BUFFER_SIZE = int(os.getenv("CLICK_STREAM_BUFFER_SIZE", "1000"))  # 再接続時に遡れるクリック数
+CLICK_STREAM_MAX_SUBSCRIBERS = int(os.getenv("CLICK_STREAM_MAX_SUBSCRIBERS", "500"))
+CLICK_STREAM_HEARTBEAT_SECONDS = float(os.getenv("CLICK_STREAM_HEARTBEAT_SECONDS", "15"))
+
+# トレンド集計（Space-Saving）設定
+TRENDING_CAPACITY = int(os.getenv("TRENDING_CAPACITY", "200"))  # スロットごとに保持するキー数
+TRENDING_CHECKPOINT_PATH = os.getenv("TRENDING_CHECKPOINT_PATH", "")  # 空ならDBファイルの隣（<DB_PATH>.trending.json）
+TRENDING_CHECKPOINT_SECONDS = float(os.getenv("TRENDING_CHECKPOINT_SECONDS", "60"))
+
+# 一括取り込み（CSV/TSVアップロード）設定
+BULK_IMPORT_CHUNK_SIZE = int(os.getenv("BULK_IMPORT_CHUNK_SIZE", "1000"))  # 1トランザクションで挿入する行数
+BULK_IMPORT_WORKERS = int(os.getenv("BULK_IMPORT_WORKERS", "1"))  # ワーカースレッド数（同時に処理するジョブ数）
+BULK_IMPORT_DIR = os.getenv("BULK_IMPORT_DIR", "")  # アップロードと結果CSVの置き場所（空ならDBファイルの隣の<DB_PATH>.imports。再起動後の再開に使うため永続的な場所にする）
+BULK_JOB_LEASE_SECONDS = float(os.getenv("BULK_JOB_LEASE_SECONDS", "30"))  # 進捗の更新がこれより古い実行中ジョブは中断とみなして再開
+BULK_JOB_POLL_SECONDS = float(os.getenv("BULK_JOB_POLL_SECONDS", "2"))  # 待機中のジョブを確認する間隔
 
 # エクスポート設定
 MAX_EXPORT_RECORDS = int(os.getenv("MAX_EXPORT_RECORDS", "10000"))
@@ -4,6 +4,25 @@ from datetime import datetime
 
 # 絶対インポートに変更
 import config
+from cache import short_code_cache
+from db_pool import get_pool, apply_storage_profile, read_storage_profile, verify_storage_profile
+from rollup import ClickRollup
+import url_listing
+import short_codes
+import bulk_import
+from columnar import ClickColumns
+from utils import parse_user_agent
+
+# クリック集計（clicksテーブルには端末種別の列がないため'unknown'として集計）
+click_rollup = ClickRollup(config.DB_PATH, time_column="clicked_at")
+
+def _classify_user_agent(user_agent):
+    info = parse_user_agent(user_agent)
+    return info["device"], info["browser"]
+
+# 列指向の分析エンジン（NumPyがある場合のみ有効。端末種別・ブラウザはUA文字列から判定）
+click_columns = ClickColumns(config.DB_PATH, time_column="clicked_at", classify_user_agent=_classify_user_agent,
+                             batch_size=config.COLUMNAR_BATCH_SIZE)
 
 def init_db():
     """データベースとテーブルを初期化"""
@@ -14,6 +33,9 @@ def init_db():
         conn = sqlite3.connect(config.DB_PATH)
         cursor = conn.cursor()
         
+        # ストレージプロファイル適用（WAL・synchronous・mmap等）
+        apply_storage_profile(conn)
+        
         # URLsテーブル作成
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS urls (
@@ -24,6 +46,10 @@ def init_db():
                 campaign_name TEXT,
                 created_at TEXT NOT NULL,
                 is_active BOOLEAN DEFAULT 1,
+                total_clicks INTEGER NOT NULL DEFAULT 0,
+                qr_clicks INTEGER NOT NULL DEFAULT 0,
+                mobile_clicks INTEGER NOT NULL DEFAULT 0,
+                last_clicked_at TEXT,
                 created_date DATE GENERATED ALWAYS AS (DATE(created_at)) STORED
             )
         """)
@@ -57,6 +83,19 @@ def init_db():
         for index_sql in indexes:
             cursor.execute(index_sql)
         
+        # クリック集計テーブル作成（urlsのカウンタ列・インデックスを含む）
+        ClickRollup.create_tables(cursor)
+        
+        # URL一覧のキーセットページネーション用インデックス
+        url_listing.create_indexes(cursor)
+        short_codes.create_tables(cursor)
+        bulk_import.create_tables(cursor)
+        
+        # 旧ラベル'qr_code'を'qr'に統一（QRクリックの集計を1つの値で行うため）
+        cursor.execute("UPDATE clicks SET source = 'qr' WHERE source = 'qr_code'")
+        if cursor.rowcount:
+            print(f"🔁 QRクリックのラベルを統一: {cursor.rowcount}件")
+        
         # テーブル情報を確認
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
         tables = cursor.fetchall()
@@ -72,6 +111,20 @@ def init_db():
         print(f"📊 現在のデータ: URLs={url_count}件, Clicks={click_count}件")
         
         conn.commit()
+        
+        # 未集計のクリックを集計テーブルに取り込む（既存DBの初回起動時は全件）
+        applied = click_rollup.apply(conn)
+        conn.commit()
+        if applied:
+            print(f"✅ クリック集計を更新: {applied}件")
+        
+        # ストレージプロファイルの確認
+        mismatches = verify_storage_profile(conn)
+        if mismatches:
+            print(f"⚠️ ストレージ設定が反映されていません: {mismatches}")
+        else:
+            print(f"✅ ストレージ設定: {read_storage_profile(conn)}")
+        
         conn.close()
         
         print("✅ データベース初期化完了")
@@ -161,6 +214,9 @@ def create_sample_data():
         conn.commit()
         conn.close()
         
+        # 直接挿入したクリックを集計に取り込む
+        click_rollup.catch_up()
+        
         print("✅ サンプルデータ作成完了")
         return True
         
@@ -191,7 +247,7 @@ def backup_database():
 def check_database_health():
     """データベースの健全性をチェック"""
     try:
-        conn = sqlite3.connect(config.DB_PATH)
+        conn = get_pool(config.DB_PATH).reader()
         cursor = conn.cursor()
         
         # テーブル存在確認
@@ -227,6 +283,12 @@ def check_database_health():
         print(f"✅ データベース健全性チェック完了")
         print(f"📊 アクティブURL: {active_urls}件, 総クリック数: {total_clicks}件")
         
+        # ストレージ設定
+        storage = get_pool(config.DB_PATH).storage_stats()
+        print(f"🗄️ ストレージ設定: {storage['active']}")
+        if storage["mismatches"]:
+            print(f"⚠️ ストレージ設定の不一致: {storage['mismatches']}")
+        
         conn.close()
         return True
         
@@ -262,6 +324,15 @@ def cleanup_old_data():
         conn.commit()
         conn.close()
         
+        # 削除されたURLがキャッシュに残らないようにする
+        if deleted_urls:
+            short_code_cache.clear()
+        
+        # 削除したクリックを集計から除くため作り直す
+        if deleted_clicks:
+            click_rollup.rebuild()
+            click_columns.reset()
+        
         print(f"✅ データクリーンアップ完了: クリック{deleted_clicks}件, URL{deleted_urls}件を削除")
         return True
         
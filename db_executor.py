@@ -0,0 +1,135 @@
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+# 絶対インポート
+import config
+
+
+class DBExecutor:
+    """DBアクセスをイベントループ外で実行する上限付きスレッドプール
+
+    sqlite3の呼び出しはブロッキングのため、async関数から直接呼ぶと
+    その間は同じワーカーの全リクエストが止まる。クエリをこのプールの
+    スレッドで実行し、イベントループはawaitで待つだけにする。
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self._executor = None
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.active = 0
+        self.max_wait_ms = 0.0
+        self.max_run_ms = 0.0
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """funcをプールのスレッドで実行し、結果を返す"""
+        loop = asyncio.get_running_loop()
+        queued_at = time.perf_counter()
+        with self._lock:
+            self.submitted += 1
+
+        def call():
+            started = time.perf_counter()
+            with self._lock:
+                self.active += 1
+                self.max_wait_ms = max(self.max_wait_ms, (started - queued_at) * 1000)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.max_run_ms = max(self.max_run_ms, (time.perf_counter() - started) * 1000)
+
+        try:
+            result = await loop.run_in_executor(self._get_executor(), call)
+        except BaseException:
+            with self._lock:
+                self.failed += 1
+            raise
+
+        with self._lock:
+            self.completed += 1
+        return result
+
+    def shutdown(self, wait: bool = True) -> None:
+        """スレッドプールを停止"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def stats(self) -> Dict[str, Any]:
+        """プールの統計を取得"""
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "active": self.active,
+                "queued": self.submitted - self.completed - self.failed - self.active,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "max_wait_ms": round(self.max_wait_ms, 3),
+                "max_run_ms": round(self.max_run_ms, 3)
+            }
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=f"db-{self.name}"
+                )
+            return self._executor
+
+
+# 短縮コード解決・作成などの軽いクエリ用と、分析・エクスポートなどの重いクエリ用。
+# 重いクエリがfastのスレッドを使い切ることはないため、長いエクスポート中もリダイレクトは止まらない。
+fast_executor = DBExecutor("fast", config.DB_FAST_WORKERS)
+heavy_executor = DBExecutor("heavy", config.DB_HEAVY_WORKERS)
+
+
+async def run_fast(func: Callable, *args, **kwargs) -> Any:
+    """軽いクエリをfastプールで実行"""
+    return await fast_executor.run(func, *args, **kwargs)
+
+
+async def run_heavy(func: Callable, *args, **kwargs) -> Any:
+    """重いクエリをheavyプールで実行"""
+    return await heavy_executor.run(func, *args, **kwargs)
+
+
+def _offload(executor: DBExecutor) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await executor.run(func, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# 同期関数をプールで実行するasync関数に変換するデコレータ（ルートハンドラにも使用可）
+fast_query = _offload(fast_executor)
+heavy_query = _offload(heavy_executor)
+
+
+def shutdown_executors() -> None:
+    """全プールを停止（シャットダウン時）"""
+    fast_executor.shutdown()
+    heavy_executor.shutdown()
+
+
+def executor_stats() -> Dict[str, Any]:
+    """全プールの統計を取得"""
+    return {
+        "fast": fast_executor.stats(),
+        "heavy": heavy_executor.stats()
+    }
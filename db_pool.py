@@ -0,0 +1,253 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+# 絶対インポート
+import config
+
+# PRAGMAが返す数値と設定名の対応
+SYNCHRONOUS_MODES = {0: "OFF", 1: "NORMAL", 2: "FULL", 3: "EXTRA"}
+TEMP_STORE_MODES = {0: "DEFAULT", 1: "FILE", 2: "MEMORY"}
+
+
+def storage_profile() -> Dict[str, Any]:
+    """設定から読み込んだストレージプロファイル"""
+    return {
+        "journal_mode": config.DB_JOURNAL_MODE.lower(),
+        "synchronous": config.DB_SYNCHRONOUS.upper(),
+        "mmap_size": config.DB_MMAP_SIZE,
+        "cache_size": config.DB_CACHE_SIZE,
+        "temp_store": config.DB_TEMP_STORE.upper(),
+        "busy_timeout": config.DB_BUSY_TIMEOUT_MS
+    }
+
+
+def apply_storage_profile(conn: sqlite3.Connection, journal_mode: bool = True) -> None:
+    """接続にストレージプロファイルを適用
+
+    journal_modeはDBファイルに永続化されるため、読み取り専用接続では
+    journal_mode=Falseとして接続単位の設定のみ適用する。
+    """
+    profile = storage_profile()
+    conn.execute(f"PRAGMA busy_timeout = {int(profile['busy_timeout'])}")
+    if journal_mode:
+        conn.execute(f"PRAGMA journal_mode = {profile['journal_mode']}")
+    conn.execute(f"PRAGMA synchronous = {profile['synchronous']}")
+    conn.execute(f"PRAGMA mmap_size = {int(profile['mmap_size'])}")
+    conn.execute(f"PRAGMA cache_size = {int(profile['cache_size'])}")
+    conn.execute(f"PRAGMA temp_store = {profile['temp_store']}")
+
+
+def read_storage_profile(conn: sqlite3.Connection) -> Dict[str, Any]:
+    """接続で実際に有効になっているストレージ設定を取得"""
+    def pragma(name):
+        return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+    synchronous = pragma("synchronous")
+    temp_store = pragma("temp_store")
+    return {
+        "journal_mode": str(pragma("journal_mode")).lower(),
+        "synchronous": SYNCHRONOUS_MODES.get(synchronous, synchronous),
+        "mmap_size": pragma("mmap_size"),
+        "cache_size": pragma("cache_size"),
+        "temp_store": TEMP_STORE_MODES.get(temp_store, temp_store),
+        "busy_timeout": pragma("busy_timeout")
+    }
+
+
+def verify_storage_profile(conn: sqlite3.Connection) -> List[str]:
+    """設定と実際の値が異なる項目を返す（空リストなら一致）"""
+    expected = storage_profile()
+    actual = read_storage_profile(conn)
+    return [
+        f"{key}: 期待値={expected[key]}, 実際={actual[key]}"
+        for key in expected
+        if expected[key] != actual[key]
+    ]
+
+
+class PooledConnection(sqlite3.Connection):
+    """プールで使い回すsqlite3接続（close()では実際には閉じない）"""
+
+    def close(self) -> None:
+        # 未確定のトランザクションを破棄してプールに戻す
+        if self.in_transaction:
+            self.rollback()
+
+    def dispose(self) -> None:
+        """接続を実際に閉じる"""
+        super().close()
+
+
+class ConnectionPool:
+    """スレッドごとの読み取り用接続と、専用の書き込み用接続を管理するプール
+
+    接続は一度だけ作成・設定（PRAGMA、プリペアドステートメントキャッシュ、
+    row_factory）し、以降は全てのルートで使い回す。終了したスレッドの読み取り用接続は
+    次に読み取り用接続を作るときに閉じる（スレッドを使い捨てる呼び出し元でも接続が溜まらない）。
+    """
+
+    def __init__(self, db_path: str, cached_statements: int = None,
+                 busy_timeout_ms: int = None, row_factory=sqlite3.Row):
+        self.db_path = db_path
+        self.cached_statements = cached_statements or config.DB_STATEMENT_CACHE_SIZE
+        self.busy_timeout_ms = busy_timeout_ms or config.DB_BUSY_TIMEOUT_MS
+        self.row_factory = row_factory
+
+        self._local = threading.local()
+        self._writer = None
+        self._writer_lock = threading.RLock()
+        self._writer_depth = 0
+        # 読み取り用接続と、それを使うスレッドの組
+        self._readers = []
+        self._connections_lock = threading.Lock()
+
+        self.readers_created = 0
+        self.readers_pruned = 0
+        self.reader_checkouts = 0
+        self.writer_checkouts = 0
+
+    def reader(self) -> PooledConnection:
+        """現在のスレッド用の読み取り専用接続を取得"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect(query_only=True)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._prune_readers()
+                self._readers.append((threading.current_thread(), conn))
+            self.readers_created += 1
+        elif conn.in_transaction:
+            # 前回の利用で残ったトランザクションを破棄
+            conn.rollback()
+
+        self.reader_checkouts += 1
+        return conn
+
+    @contextmanager
+    def writer(self) -> Iterator[PooledConnection]:
+        """書き込み用接続を排他的に取得（正常終了でcommit、例外でrollback）
+
+        ブロックの先頭でBEGIN IMMEDIATEを発行するため、ブロック内の書き込み（SAVEPOINTを含む）は
+        すべて1つのトランザクションにまとまる。sqlite3の暗黙のBEGINはSELECTやSAVEPOINTでは始まらず、
+        最外側のSAVEPOINTのRELEASEがそれまでの書き込みごと単独でコミットしてしまうため。
+        同じスレッドで入れ子にしたwriter()は外側のトランザクションに参加し、コミットは外側で行う。
+        """
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._connect(query_only=False)
+
+            self.writer_checkouts += 1
+            conn = self._writer
+            if self._writer_depth:
+                self._writer_depth += 1
+                try:
+                    yield conn
+                finally:
+                    self._writer_depth -= 1
+                return
+
+            if conn.in_transaction:
+                # 前回の利用で残ったトランザクションを破棄
+                conn.rollback()
+            conn.execute("BEGIN IMMEDIATE")
+            self._writer_depth = 1
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._writer_depth = 0
+
+    def close_all(self) -> None:
+        """プール内の全接続を閉じる"""
+        with self._writer_lock, self._connections_lock:
+            connections = [conn for _, conn in self._readers]
+            if self._writer is not None:
+                connections.append(self._writer)
+            for conn in connections:
+                try:
+                    conn.dispose()
+                except Exception:
+                    pass
+            self._readers = []
+            self._writer = None
+            self._local = threading.local()
+
+    def stats(self) -> Dict[str, Any]:
+        """プールの統計を取得"""
+        return {
+            "db_path": self.db_path,
+            "open_connections": len(self._readers) + (self._writer is not None),
+            "readers_created": self.readers_created,
+            "readers_pruned": self.readers_pruned,
+            "reader_checkouts": self.reader_checkouts,
+            "writer_checkouts": self.writer_checkouts,
+            "cached_statements": self.cached_statements
+        }
+
+    def storage_stats(self) -> Dict[str, Any]:
+        """現在有効なストレージ設定と、設定との差分を取得"""
+        conn = self.reader()
+        return {
+            "active": read_storage_profile(conn),
+            "mismatches": verify_storage_profile(conn)
+        }
+
+    def _connect(self, query_only: bool) -> PooledConnection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            factory=PooledConnection,
+            cached_statements=self.cached_statements,
+            check_same_thread=False
+        )
+        conn.row_factory = self.row_factory
+        self._configure(conn, query_only)
+        return conn
+
+    def _prune_readers(self) -> None:
+        # 終了したスレッドの接続はスレッドローカルから外れているので閉じてよい
+        alive = []
+        for thread, conn in self._readers:
+            if thread.is_alive():
+                alive.append((thread, conn))
+                continue
+            try:
+                conn.dispose()
+            except Exception:
+                pass
+            self.readers_pruned += 1
+        self._readers = alive
+
+    def _configure(self, conn: sqlite3.Connection, query_only: bool) -> None:
+        """接続ごとのPRAGMAを設定"""
+        apply_storage_profile(conn, journal_mode=not query_only)
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        if query_only:
+            conn.execute("PRAGMA query_only = ON")
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str = None) -> ConnectionPool:
+    """DBファイルごとのプールを取得（初回のみ作成）"""
+    db_path = db_path or config.DB_PATH
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = ConnectionPool(db_path)
+            _pools[db_path] = pool
+        return pool
+
+
+def close_all_pools() -> None:
+    """全プールの接続を閉じる（シャットダウン時）"""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close_all()
@@ -1,16 +1,32 @@
-from fastapi import FastAPI, Request, HTTPException, Form
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse
+from fastapi import FastAPI, Request, HTTPException, Form, File, UploadFile
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse, FileResponse
 import os
 import sqlite3
 from datetime import datetime, timedelta
-import string
-import random
 import re
 import json
 import csv
 import io
 from urllib.parse import urlparse, parse_qs
 import base64
+from contextlib import asynccontextmanager
+import config
+
+from click_queue import ClickIngestQueue
+from click_stream import ClickStream
+from trending import TrendingTracker
+from rollup import ClickRollup, ALL_URLS
+from columnar import ClickColumns
+import url_listing
+import short_codes
+import bulk_create
+import bulk_import
+from bulk_import import BulkImporter
+from db_pool import get_pool, close_all_pools, apply_storage_profile, read_storage_profile, verify_storage_profile
+from cache import short_code_cache, dashboard_cache, get_cached_url, cache_url, invalidate_url
+from bloom import ShortCodeFilter
+from ua_cache import UserAgentCache
+from db_executor import run_fast, fast_query, heavy_query, shutdown_executors, executor_stats
 
 # 条件付きインポート - エラー回避
 try:
@@ -28,13 +44,23 @@ except ImportError:
 
 # 設定
 BASE_URL = os.getenv("RENDER_EXTERNAL_URL", "http://localhost:8000")
-DB_PATH = "url_shortener.db"
+DB_PATH = os.getenv("DB_PATH", "url_shortener.db")
+
+# クリック集計（分析・管理画面は生のclicksではなく集計テーブルを読む）
+click_rollup = ClickRollup(DB_PATH, time_column="clicked_at", device_column="device_type")
+
+# 列指向の分析エンジン（NumPyがある場合のみ有効、初回のクエリで読み込み以降は差分だけ追加）
+click_columns = ClickColumns(DB_PATH, time_column="clicked_at", device_column="device_type", browser_column="browser",
+                             batch_size=config.COLUMNAR_BATCH_SIZE)
 
 # データベース初期化（拡張版）
 def init_db():
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     
+    # ストレージプロファイル適用（WAL・synchronous・mmap等）
+    apply_storage_profile(conn)
+    
     # URLsテーブル（QRコード対応）
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS urls (
@@ -45,7 +71,11 @@ def init_db():
             campaign_name TEXT,
             qr_code_data TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_active BOOLEAN DEFAULT TRUE
+            is_active BOOLEAN DEFAULT TRUE,
+            total_clicks INTEGER NOT NULL DEFAULT 0,
+            qr_clicks INTEGER NOT NULL DEFAULT 0,
+            mobile_clicks INTEGER NOT NULL DEFAULT 0,
+            last_clicked_at TEXT
         )
     ''')
     
@@ -73,29 +103,37 @@ def init_db():
         )
     ''')
     
+    # クリック集計テーブル（urlsのカウンタ列・インデックスを含む）
+    ClickRollup.create_tables(cursor)
+    
+    # URL一覧のキーセットページネーション用インデックス
+    url_listing.create_indexes(cursor)
+    short_codes.create_tables(cursor)
+    bulk_import.create_tables(cursor)
+    
+    conn.commit()
+    
+    # 未集計のクリックを取り込む（既存DBの初回起動時は全件）
+    applied = click_rollup.apply(conn)
     conn.commit()
+    if applied:
+        print(f"✅ クリック集計を更新: {applied}件")
+    
+    # ストレージプロファイルの確認
+    mismatches = verify_storage_profile(conn)
+    if mismatches:
+        print(f"⚠️ ストレージ設定が反映されていません: {mismatches}")
+    
     conn.close()
 
 # ユーティリティ関数
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # プール済みの読み取り用接続（書き込みはdb_pool.writer()を使用）
+    return db_pool.reader()
 
-def generate_short_code(length=6):
-    chars = string.ascii_letters + string.digits
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    for _ in range(50):
-        code = ''.join(random.choices(chars, k=length))
-        cursor.execute("SELECT 1 FROM urls WHERE short_code = ?", (code,))
-        if not cursor.fetchone():
-            conn.close()
-            return code
-    
-    conn.close()
-    raise HTTPException(status_code=500, detail="短縮コード生成に失敗しました")
+# 短縮コードの割り当て（連番を並べ替えてbase62にする方式。SHORT_CODE_ALLOCATORで切り替え）
+def get_short_code_allocator():
+    return short_codes.get_allocator(DB_PATH)
 
 def validate_url(url):
     pattern = re.compile(
@@ -132,7 +170,11 @@ def generate_qr_code(url):
         return None
 
 def analyze_user_agent(user_agent_string):
-    """User-Agent解析"""
+    """User-Agent解析（同じUA文字列の解析結果はキャッシュから返す）"""
+    return ua_cache.parse(user_agent_string)
+
+def _parse_user_agent(user_agent_string):
+    """User-Agent解析（キャッシュなし）"""
     if not UA_AVAILABLE or not user_agent_string:
         return {
             'device_type': 'Unknown',
@@ -154,6 +196,8 @@ def analyze_user_agent(user_agent_string):
             'os': 'Unknown'
         }
 
+ua_cache = UserAgentCache(_parse_user_agent)
+
 def extract_utm_params(referrer):
     """UTMパラメータ抽出"""
     if not referrer:
@@ -184,11 +228,59 @@ def get_location_from_ip(ip_address):
 # データベース初期化
 init_db()
 
+# 接続プール（読み取りはスレッドごとの接続、書き込みは単一の接続）
+db_pool = get_pool(DB_PATH)
+
+# 既存短縮コードのBloomフィルタ（存在しないコードはDBに問い合わせない）
+short_code_filter = ShortCodeFilter(DB_PATH)
+
+# クリック記録キュー（リダイレクト応答とは切り離してまとめて書き込む）
+click_queue = ClickIngestQueue(DB_PATH, columns=(
+    "url_id", "ip_address", "user_agent", "referrer", "source",
+    "device_type", "browser", "os", "country", "city",
+    "utm_source", "utm_medium", "utm_campaign", "utm_term", "utm_content",
+    "clicked_at"
+))
+
+# クリックの書き込みと同じトランザクションで集計テーブルを更新
+click_queue.add_listener(click_rollup.apply)
+
+# コミット済みのクリックをライブ配信（管理画面のSSE）へ流す
+click_stream = ClickStream(DB_PATH)
+click_queue.add_commit_listener(click_stream.publish)
+
+# トレンド（直近5分・1時間・24時間のクリック上位）をSQLiteを介さずに集計
+trending = TrendingTracker(DB_PATH, resolve_urls=click_stream.lookup_urls)
+click_queue.add_commit_listener(trending.record)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 起動時に構築し、以降の取り込みは更新スレッドに任せる（リダイレクトはメモリ上の判定のみ）
+    short_code_filter.rebuild()
+    short_code_filter.start()
+    ua_cache.warm_from_db(DB_PATH)
+    click_columns.warm_in_background()
+    # SHORT_CODE_ALLOCATOR=poolならここでプールの補充が始まる
+    get_short_code_allocator()
+    click_queue.start()
+    # 再起動前に中断された一括取り込みジョブもここから再開する
+    bulk_importer.start()
+    yield
+    # 実行中の一括取り込みは今のチャンクをコミットしてから待機中に戻す
+    bulk_importer.stop()
+    # シャットダウン時に未書き込みのクリックを書き出す
+    click_queue.stop()
+    trending.checkpoint()
+    dashboard_cache.stop()
+    shutdown_executors()
+    close_all_pools()
+
 # FastAPIアプリ
 app = FastAPI(
     title="LinkTrack Pro Advanced",
     description="QRコード・詳細分析対応URL短縮プラットフォーム",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 # ホームページHTML（QRコード対応）
@@ -452,7 +544,7 @@ def get_index_html(total_links, total_clicks, unique_visitors, qr_clicks):
 """
 
 # 簡易管理画面HTML（エラー回避版）
-def get_admin_html(stats, table_rows):
+def get_admin_html(stats, table_rows, listing_controls=""):
     return f"""
 <!DOCTYPE html>
 <html>
@@ -556,6 +648,7 @@ def get_admin_html(stats, table_rows):
         </div>
 
         <h2>📋 URL一覧・詳細管理</h2>
+        {listing_controls}
         <table>
             <thead>
                 <tr>
@@ -1136,7 +1229,8 @@ def get_bulk_html():
 
 # ルートエンドポイント
 @app.get("/", response_class=HTMLResponse)
-async def root():
+@heavy_query
+def root():
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
@@ -1144,14 +1238,10 @@ async def root():
         cursor.execute("SELECT COUNT(*) FROM urls")
         total_links = cursor.fetchone()[0]
         
-        cursor.execute("SELECT COUNT(*) FROM clicks")
-        total_clicks = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(DISTINCT ip_address) FROM clicks")
-        unique_visitors = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM clicks WHERE source = 'qr'")
-        qr_clicks = cursor.fetchone()[0]
+        # 全URL合計の集計行
+        cursor.execute("SELECT clicks, unique_visitors, qr_clicks FROM click_rollup_totals WHERE url_id = 0 AND source = ''")
+        totals = cursor.fetchone()
+        total_clicks, unique_visitors, qr_clicks = totals if totals else (0, 0, 0)
         
         conn.close()
         
@@ -1160,26 +1250,30 @@ async def root():
         return HTMLResponse(content=get_index_html(0, 0, 0, 0))
 
 @app.post("/api/shorten-form")
-async def shorten_form(url: str = Form(...), custom_name: str = Form(""), campaign_name: str = Form("")):
+@fast_query
+def shorten_form(url: str = Form(...), custom_name: str = Form(""), campaign_name: str = Form("")):
     try:
         if not validate_url(url):
             raise HTTPException(status_code=400, detail="無効なURLです")
         
-        short_code = generate_short_code()
+        with db_pool.writer() as conn:
+            # 割り当てたコードで保存（事前の重複チェックなし）
+            short_code = short_codes.insert_url(conn, get_short_code_allocator(), {
+                "original_url": url.strip(),
+                "custom_name": custom_name or None,
+                "campaign_name": campaign_name or None,
+                "created_at": datetime.now().isoformat()
+            })
         short_url = f"{BASE_URL}/{short_code}"
         
-        # QRコード生成（エラー回避）
-        qr_code_data = generate_qr_code(short_url) if QR_AVAILABLE else None
+        # QRコード生成（エラー回避）。画像の生成中は書き込みロックを持たない
+        qr_code_data = generate_qr_code(f"{short_url}?source=qr") if QR_AVAILABLE else None
+        if qr_code_data:
+            with db_pool.writer() as conn:
+                conn.execute("UPDATE urls SET qr_code_data = ? WHERE short_code = ?", (qr_code_data, short_code))
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO urls (short_code, original_url, custom_name, campaign_name, qr_code_data, created_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (short_code, url.strip(), custom_name or None, campaign_name or None, qr_code_data, datetime.now().isoformat()))
-        
-        conn.commit()
-        conn.close()
+        invalidate_url(short_code)
+        short_code_filter.add(short_code)
         
         result = {
             "success": True,
@@ -1198,23 +1292,26 @@ async def shorten_form(url: str = Form(...), custom_name: str = Form(""), campai
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/admin", response_class=HTMLResponse)
-async def admin_page():
+@heavy_query
+def load_admin_dashboard():
+    """管理画面の統計を集計"""
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
         cursor = conn.cursor()
         
-        # 統計取得
+        # 統計取得（urlsのカウンタ列から、ユニーク訪問者は集計テーブルの全URL合計の行）
         cursor.execute("""
             SELECT 
-                COUNT(DISTINCT u.id) as total_urls,
-                COUNT(c.id) as total_clicks,
-                COUNT(DISTINCT c.ip_address) as unique_visitors,
-                COUNT(CASE WHEN c.source = 'qr' THEN 1 END) as qr_clicks,
-                COUNT(CASE WHEN c.device_type = 'Mobile' THEN 1 END) as mobile_clicks,
-                COUNT(CASE WHEN DATE(c.clicked_at) = DATE('now') THEN 1 END) as today_clicks
+                COUNT(u.id) as total_urls,
+                COALESCE(SUM(u.total_clicks), 0) as total_clicks,
+                COALESCE((SELECT unique_visitors FROM click_rollup_totals
+                          WHERE url_id = 0 AND source = ''), 0) as unique_visitors,
+                COALESCE(SUM(u.qr_clicks), 0) as qr_clicks,
+                COALESCE(SUM(u.mobile_clicks), 0) as mobile_clicks,
+                (SELECT COALESCE(SUM(h.clicks), 0) FROM click_rollup_hourly h
+                 JOIN urls a ON a.id = h.url_id
+                 WHERE h.day = DATE('now') AND a.is_active = 1) as today_clicks
             FROM urls u
-            LEFT JOIN clicks c ON u.id = c.url_id
             WHERE u.is_active = 1
         """)
         
@@ -1227,29 +1324,39 @@ async def admin_page():
             'mobile_clicks': stats_row[4] if stats_row else 0,
             'today_clicks': stats_row[5] if stats_row else 0
         }
-        
-        # URL一覧取得
-        cursor.execute("""
-            SELECT u.short_code, u.original_url, u.created_at, u.custom_name, u.campaign_name,
-                   COUNT(c.id) as total_clicks,
-                   COUNT(DISTINCT c.ip_address) as unique_clicks,
-                   COUNT(CASE WHEN c.source = 'qr' THEN 1 END) as qr_clicks,
-                   COUNT(CASE WHEN c.device_type = 'Mobile' THEN 1 END) as mobile_clicks
-            FROM urls u
-            LEFT JOIN clicks c ON u.id = c.url_id
-            WHERE u.is_active = 1
-            GROUP BY u.id
-            ORDER BY u.created_at DESC
-            LIMIT 100
-        """)
-        
-        results = cursor.fetchall()
+    finally:
         conn.close()
+    
+    return stats
+
+@heavy_query
+def load_url_page(**filters):
+    """URL一覧の1ページを取得（キーセットページネーション）"""
+    conn = get_db_connection()
+    try:
+        return url_listing.list_urls(conn, **filters)
+    finally:
+        conn.close()
+
+@app.get("/admin", response_class=HTMLResponse)
+async def admin_page(sort: str = "created", cursor: str = None, limit: int = 100, campaign: str = None,
+                     start: str = None, end: str = None, status: str = "active"):
+    try:
+        # 集計はキャッシュから取得（ANALYTICS_UPDATE_INTERVALごとに裏で更新）
+        stats = await dashboard_cache.get("admin", load_admin_dashboard)
+        
+        # URL一覧は表示するページだけをSQLのLIMITで取得
+        try:
+            page = await load_url_page(sort=sort, cursor=cursor, limit=limit, campaign=campaign,
+                                       start=start, end=end, status=status)
+        except ValueError as e:
+            return HTMLResponse(content=f"<h1>エラー</h1><p>{e}</p><p><a href='/admin'>管理画面に戻る</a></p>", status_code=400)
         
         # テーブル行生成
         table_rows = ""
-        for row in results:
-            short_code, original_url, created_at, custom_name, campaign_name, total_clicks, unique_clicks, qr_clicks, mobile_clicks = row
+        for url in page["urls"]:
+            short_code, original_url, created_at = url["short_code"], url["original_url"], url["created_at"] or ""
+            custom_name, campaign_name = url["custom_name"], url["campaign_name"]
             
             display_url = original_url[:40] + "..." if len(original_url) > 40 else original_url
             
@@ -1260,10 +1367,10 @@ async def admin_page():
                 <td>{custom_name or '-'}</td>
                 <td>{campaign_name or '-'}</td>
                 <td>{created_at[:10]}</td>
-                <td>{total_clicks}</td>
-                <td>{unique_clicks}</td>
-                <td>{qr_clicks}</td>
-                <td>{mobile_clicks}</td>
+                <td>{url["total_clicks"]}</td>
+                <td>{url["unique_visitors"]}</td>
+                <td>{url["qr_clicks"]}</td>
+                <td>{url["mobile_clicks"]}</td>
                 <td>
                     <a href="/analytics/{short_code}" target="_blank" class="action-btn analytics-btn">📈 分析</a>
                     <a href="/qr/{short_code}" target="_blank" class="action-btn qr-btn">📱 QR</a>
@@ -1271,7 +1378,7 @@ async def admin_page():
             </tr>
             """
         
-        return HTMLResponse(content=get_admin_html(stats, table_rows))
+        return HTMLResponse(content=get_admin_html(stats, table_rows, url_listing.listing_controls_html("/admin", page)))
         
     except Exception as e:
         return HTMLResponse(content=f"<h1>エラー</h1><p>{str(e)}</p>", status_code=500)
@@ -1281,74 +1388,155 @@ async def bulk_page():
     return HTMLResponse(content=get_bulk_html())
 
 @app.post("/api/bulk-process")
-async def bulk_process(urls: str = Form(...)):
+@heavy_query
+def bulk_process(urls: str = Form(...), background: bool = Form(False)):
     try:
         url_list = [url.strip() for url in urls.split('\n') if url.strip()]
-        results = []
+        if background:
+            # ジョブとして受け付けて即座に返す（進捗は/api/bulk/jobs/{job_id}）
+            return JSONResponse(bulk_importer.submit_records({"original_url": url} for url in url_list), status_code=202)
+        valid = [validate_url(url) for url in url_list]
+        created_at = datetime.now().isoformat()
+        
+        # 短縮コードは有効な行の分をまとめて割り当て、1回のexecutemanyで挿入
+        with db_pool.writer() as conn:
+            inserted = bulk_create.insert_urls(
+                conn, [{"original_url": url, "created_at": created_at} for url, is_valid in zip(url_list, valid) if is_valid],
+                get_short_code_allocator()
+            )
+        allocated = iter(short_code for short_code, error in inserted)
+        codes = [next(allocated) if is_valid else None for is_valid in valid]
+        if QR_AVAILABLE:
+            # QRコード生成（エラー回避）。画像は書き込みロックの外で作り、ロック内では更新だけ行う
+            qr_rows = [
+                (generate_qr_code(f"{BASE_URL}/{short_code}?source=qr"), short_code)
+                for short_code in codes if short_code
+            ]
+            with db_pool.writer() as conn:
+                conn.executemany("UPDATE urls SET qr_code_data = ? WHERE short_code = ?", qr_rows)
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        for url in url_list:
-            if validate_url(url):
-                short_code = generate_short_code()
-                short_url = f"{BASE_URL}/{short_code}"
-                
-                # QRコード生成（エラー回避）
-                qr_code_data = generate_qr_code(short_url) if QR_AVAILABLE else None
-                
-                cursor.execute("""
-                    INSERT INTO urls (short_code, original_url, qr_code_data, created_at)
-                    VALUES (?, ?, ?, ?)
-                """, (short_code, url, qr_code_data, datetime.now().isoformat()))
-                
+        results = []
+        for url, short_code in zip(url_list, codes):
+            if short_code:
+                invalidate_url(short_code)
+                short_code_filter.add(short_code)
                 results.append({
                     "url": url,
-                    "short_url": short_url,
+                    "short_url": f"{BASE_URL}/{short_code}",
                     "success": True
                 })
             else:
                 results.append({"url": url, "success": False, "error": "無効なURL"})
         
-        conn.commit()
-        conn.close()
-        
         return JSONResponse({"results": results})
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def build_import_row(record):
+    """取り込みファイルの1行をurlsの行に変換（不正なURLはValueError）"""
+    original_url = record["original_url"]
+    if not original_url or not validate_url(original_url):
+        raise ValueError("無効なURL")
+    return {
+        "original_url": original_url,
+        "custom_name": record["custom_name"],
+        "campaign_name": record["campaign_name"],
+        "created_at": datetime.now().isoformat()
+    }
+
+def on_imported(short_codes):
+    for short_code in short_codes:
+        invalidate_url(short_code)
+        short_code_filter.add(short_code)
+
+# QRコードは取り込み時には作らない（/qr/{short_code}で都度生成される）
+bulk_importer = BulkImporter(DB_PATH, BASE_URL, build_import_row, on_imported)
+
+# CSV/TSVファイルからの一括生成（ジョブを受け付けて即座に返し、取り込みはバックグラウンドで行う）
+@app.post("/api/bulk/upload", status_code=202)
+@heavy_query
+def bulk_upload(file: UploadFile = File(...), delimiter: str = Form(None)):
+    try:
+        job = bulk_importer.submit(file.file, file.filename, delimiter)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(job, status_code=202)
+
+# 一括生成ジョブ（状態はjobsテーブルにあり、再起動後も続きから再開される）
+@app.get("/api/bulk/jobs")
+@fast_query
+def list_bulk_jobs(status: str = None, limit: int = 20):
+    try:
+        return {"jobs": bulk_importer.list_jobs(status, limit)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/bulk/jobs/{job_id}")
+@fast_query
+def get_bulk_job(job_id: str):
+    job = bulk_importer.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    return job
+
+@app.post("/api/bulk/jobs/{job_id}/cancel")
+@fast_query
+def cancel_bulk_job(job_id: str):
+    job = bulk_importer.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    return job
+
+# 失敗・キャンセルしたジョブは続きから再開し、完了したジョブは失敗行だけを新しいジョブにする
+@app.post("/api/bulk/jobs/{job_id}/retry", status_code=202)
+@heavy_query
+def retry_bulk_job(job_id: str):
+    try:
+        job = bulk_importer.retry(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    return JSONResponse(job, status_code=202)
+
+@app.get("/api/bulk/jobs/{job_id}/result")
+@fast_query
+def get_bulk_job_result(job_id: str):
+    if bulk_importer.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    path = bulk_importer.result_path(job_id)
+    if path is None:
+        raise HTTPException(status_code=409, detail="ジョブがまだ終了していません")
+    return FileResponse(path, media_type="text/csv; charset=utf-8", filename=f"bulk_result_{job_id}.csv")
+
 @app.get("/analytics/{short_code}", response_class=HTMLResponse)
-async def analytics_page(short_code: str):
+@heavy_query
+def analytics_page(short_code: str):
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         
         # URL基本情報
-        cursor.execute("SELECT original_url, created_at, custom_name, campaign_name FROM urls WHERE short_code = ?", (short_code,))
+        cursor.execute("SELECT id, original_url, created_at, custom_name, campaign_name FROM urls WHERE short_code = ?", (short_code,))
         url_data = cursor.fetchone()
         
         if not url_data:
             return HTMLResponse(content="<h1>404</h1><p>URLが見つかりません</p>", status_code=404)
         
         url_info = {
-            'original_url': url_data[0],
-            'created_at': url_data[1],
-            'custom_name': url_data[2],
-            'campaign_name': url_data[3]
+            'original_url': url_data[1],
+            'created_at': url_data[2],
+            'custom_name': url_data[3],
+            'campaign_name': url_data[4]
         }
         
-        # 統計取得
+        # 統計取得（集計テーブルから）
         cursor.execute("""
-            SELECT 
-                COUNT(*) as total_clicks,
-                COUNT(DISTINCT ip_address) as unique_visitors,
-                COUNT(CASE WHEN source = 'qr' THEN 1 END) as qr_clicks,
-                COUNT(CASE WHEN device_type = 'Mobile' THEN 1 END) as mobile_clicks
-            FROM clicks c
-            JOIN urls u ON c.url_id = u.id
-            WHERE u.short_code = ?
-        """, (short_code,))
+            SELECT clicks, unique_visitors, qr_clicks, mobile_clicks
+            FROM click_rollup_totals
+            WHERE url_id = ? AND source = ''
+        """, (url_data[0],))
         
         stats = cursor.fetchone()
         total_clicks = stats[0] if stats else 0
@@ -1372,7 +1560,8 @@ async def analytics_page(short_code: str):
         return HTMLResponse(content=f"<h1>エラー</h1><p>{str(e)}</p>", status_code=500)
 
 @app.get("/qr/{short_code}")
-async def qr_code_page(short_code: str):
+@fast_query
+def qr_code_page(short_code: str):
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
@@ -1388,11 +1577,11 @@ async def qr_code_page(short_code: str):
         if not qr_code_data and QR_AVAILABLE:
             # QRコードが存在しない場合は生成
             short_url = f"{BASE_URL}/{short_code}"
-            qr_code_data = generate_qr_code(short_url)
+            qr_code_data = generate_qr_code(f"{short_url}?source=qr")
             
             if qr_code_data:
-                cursor.execute("UPDATE urls SET qr_code_data = ? WHERE short_code = ?", (qr_code_data, short_code))
-                conn.commit()
+                with db_pool.writer() as write_conn:
+                    write_conn.execute("UPDATE urls SET qr_code_data = ? WHERE short_code = ?", (qr_code_data, short_code))
         
         conn.close()
         
@@ -1438,7 +1627,8 @@ async def qr_code_page(short_code: str):
 
 # CSVエクスポート（基本版のみ - エラー回避）
 @app.get("/export")
-async def export_basic_data():
+@heavy_query
+def export_basic_data():
     """基本統計データのCSVエクスポート"""
     try:
         conn = get_db_connection()
@@ -1446,14 +1636,13 @@ async def export_basic_data():
         
         cursor.execute("""
             SELECT u.short_code, u.original_url, u.custom_name, u.campaign_name, u.created_at,
-                   COUNT(c.id) as total_clicks,
-                   COUNT(DISTINCT c.ip_address) as unique_visitors,
-                   COUNT(CASE WHEN c.source = 'qr' THEN 1 END) as qr_clicks,
-                   COUNT(CASE WHEN c.device_type = 'Mobile' THEN 1 END) as mobile_clicks
+                   u.total_clicks as total_clicks,
+                   COALESCE(t.unique_visitors, 0) as unique_visitors,
+                   u.qr_clicks as qr_clicks,
+                   u.mobile_clicks as mobile_clicks
             FROM urls u
-            LEFT JOIN clicks c ON u.id = c.url_id
+            LEFT JOIN click_rollup_totals t ON t.url_id = u.id AND t.source = ''
             WHERE u.is_active = 1
-            GROUP BY u.id
             ORDER BY u.created_at DESC
         """)
         
@@ -1491,7 +1680,8 @@ async def export_basic_data():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/health")
-async def health_check():
+@fast_query
+def health_check():
     features = ["basic_analytics", "bulk_processing"]
     if QR_AVAILABLE:
         features.append("qr_codes")
@@ -1501,24 +1691,227 @@ async def health_check():
     return JSONResponse({
         "status": "healthy", 
         "timestamp": datetime.now().isoformat(), 
-        "features": features
+        "features": features,
+        "cache": short_code_cache.stats(),
+        "click_queue": click_queue.stats(),
+        "db_pool": db_pool.stats(),
+        "storage": db_pool.storage_stats(),
+        "short_code_filter": short_code_filter.stats(),
+        "ua_cache": ua_cache.stats(),
+        "db_executors": executor_stats(),
+        "click_rollup": click_rollup.stats(),
+        "dashboard_cache": dashboard_cache.stats(),
+        "columnar": click_columns.stats(),
+        "click_stream": click_stream.stats(),
+        "trending": trending.stats(),
+        "short_codes": get_short_code_allocator().stats(),
+        "bulk_import": bulk_importer.stats()
     })
 
+# URL一覧（sort=created/clicks、next_cursorを次のリクエストのcursorに指定してページ送り）
+@app.get("/api/admin/urls")
+async def get_admin_urls(sort: str = "created", cursor: str = None, limit: int = 50, campaign: str = None,
+                         start: str = None, end: str = None, status: str = "active"):
+    try:
+        page = await load_url_page(sort=sort, cursor=cursor, limit=limit, campaign=campaign,
+                                   start=start, end=end, status=status)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(page)
+
+# クリックのライブ配信（SSE、再接続時はLast-Event-IDの次から再開）
+@app.get("/api/admin/clicks/stream")
+async def stream_clicks(request: Request, short_code: str = None, campaign: str = None,
+                        backlog: int = 0, last_event_id: str = None):
+    last_event_id = request.headers.get("last-event-id") or last_event_id
+
+    events = click_stream.subscribe(short_code=short_code, campaign=campaign,
+                                    last_event_id=last_event_id, backlog=backlog)
+    try:
+        # 接続数の上限はここで判定する（retry行を先に取り出す）
+        first = await events.__anext__()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Last-Event-IDが不正です")
+    except OverflowError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    async def body():
+        try:
+            yield first
+            async for chunk in events:
+                yield chunk
+        finally:
+            # 切断時に購読を解除
+            await events.aclose()
+
+    return StreamingResponse(body(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+@app.post("/api/admin/short-code-filter/rebuild")
+@heavy_query
+def rebuild_short_code_filter():
+    try:
+        return JSONResponse(short_code_filter.rebuild())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/admin/click-rollup/rebuild")
+@heavy_query
+def rebuild_click_rollup():
+    try:
+        return JSONResponse(click_rollup.rebuild())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/admin/url-counters/reconcile")
+@heavy_query
+def reconcile_url_counters():
+    try:
+        return JSONResponse(click_rollup.reconcile_url_counters())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# キャンペーン分析（キャンペーン集計から作成するためリンク数が多くてもclicksを走査しない）
+@app.get("/api/analytics/campaign/{campaign_name}")
+@heavy_query
+def get_campaign_analytics(campaign_name: str, days: int = 30):
+    conn = get_db_connection()
+    try:
+        report = click_rollup.campaign_report(conn, campaign_name, days=max(1, min(days, 365)))
+    finally:
+        conn.close()
+    
+    if report is None:
+        raise HTTPException(status_code=404, detail="キャンペーンが見つかりません")
+    
+    for url in report["urls"]:
+        url["analytics_url"] = f"{BASE_URL}/analytics/{url['short_code']}"
+    return JSONResponse(report)
+
+def _filter_values(value):
+    # カンマ区切りで複数指定できる条件
+    return [item for item in value.split(",") if item] if value else None
+
+# クリックの絞り込み・集計（列指向エンジン。条件はカンマ区切りで複数指定可、start/endはUTCの日付）
+@app.get("/api/clicks/query")
+@heavy_query
+def query_clicks(group_by: str = None, short_code: str = None, campaign: str = None, source: str = None,
+                 device: str = None, browser: str = None, start: str = None, end: str = None, limit: int = 100):
+    if not click_columns.enabled:
+        raise HTTPException(status_code=503, detail="NumPyがインストールされていないため利用できません")
+    
+    url_id = None
+    if short_code:
+        conn = get_db_connection()
+        try:
+            row = conn.execute("SELECT id FROM urls WHERE short_code = ?", (short_code,)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            raise HTTPException(status_code=404, detail="URLが見つかりません")
+        url_id = row[0]
+    
+    try:
+        result = click_columns.query(
+            group_by=group_by, url_id=url_id, campaign=_filter_values(campaign), source=_filter_values(source),
+            device=_filter_values(device), browser=_filter_values(browser), start=start, end=end,
+            limit=max(1, min(limit, 1000))
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return JSONResponse({"short_code": short_code, **result})
+
+# 曜日×時間帯のヒートマップ（tz=UTC/JST、short_code省略時は全リンク）
+@app.get("/api/heatmap")
+@heavy_query
+def get_heatmap(short_code: str = None, tz: str = "UTC"):
+    conn = get_db_connection()
+    try:
+        url_id = ALL_URLS
+        if short_code:
+            row = conn.execute("SELECT id FROM urls WHERE short_code = ?", (short_code,)).fetchone()
+            if not row:
+                raise HTTPException(status_code=404, detail="URLが見つかりません")
+            url_id = row[0]
+        
+        result = click_rollup.heatmap(conn, url_id=url_id, timezone=tz)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="tzはUTCまたはJSTを指定してください")
+    finally:
+        conn.close()
+    
+    return JSONResponse({"short_code": short_code, **result})
+
+# 直近のクリック数上位（window=5m/1h/24h、by=url/campaign。SQLiteを使わない近似値）
+@app.get("/api/trending")
+async def get_trending(window: str = "1h", by: str = "url", limit: int = 10):
+    try:
+        result = trending.top(window=window, dimension=by, limit=max(1, min(limit, 100)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(result)
+
+# ユニーク訪問者数（期間・キャンペーン指定時はHyperLogLogの近似値、exactで区別）
+@app.get("/api/unique-visitors")
+@heavy_query
+def get_unique_visitors(short_code: str = None, campaign: str = None, start: str = None, end: str = None):
+    if short_code and campaign:
+        raise HTTPException(status_code=400, detail="short_codeとcampaignは同時に指定できません")
+    
+    conn = get_db_connection()
+    try:
+        url_id = ALL_URLS
+        if short_code:
+            row = conn.execute("SELECT id FROM urls WHERE short_code = ?", (short_code,)).fetchone()
+            if not row:
+                raise HTTPException(status_code=404, detail="URLが見つかりません")
+            url_id = row[0]
+        
+        result = click_rollup.unique_visitors(conn, url_id=url_id, campaign_name=campaign, start=start, end=end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="日付はYYYY-MM-DD形式で指定してください")
+    finally:
+        conn.close()
+    
+    return JSONResponse({"short_code": short_code, "campaign": campaign, "start": start, "end": end, **result})
+
+def lookup_short_code(short_code):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, original_url, is_active FROM urls WHERE short_code = ?", (short_code,))
+    result = cursor.fetchone()
+    conn.close()
+    return result
+
 # リダイレクト処理（拡張分析対応）
 @app.get("/{short_code}")
 async def redirect_url(short_code: str, request: Request):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT id, original_url FROM urls WHERE short_code = ? AND is_active = 1", (short_code,))
-        result = cursor.fetchone()
-        
-        if not result:
+        # キャッシュを優先して短縮コードを解決
+        cached = get_cached_url(short_code)
+
+        if cached is None:
+            # 存在しないコードはDBに問い合わせずに404
+            if not short_code_filter.might_exist(short_code):
+                raise HTTPException(status_code=404, detail="無効な短縮コードです")
+
+            # イベントループを止めないようfastプールで検索
+            result = await run_fast(lookup_short_code, short_code)
+
+            if not result:
+                short_code_filter.record_false_positive()
+                raise HTTPException(status_code=404, detail="無効な短縮コードです")
+
+            cached = cache_url(short_code, result[0], result[1], result[2])
+
+        url_id, original_url, is_active = cached
+
+        if not is_active:
             raise HTTPException(status_code=404, detail="無効な短縮コードです")
-        
-        url_id, original_url = result
-        
+
         # 基本分析データ収集
         client_ip = request.client.host
         user_agent = request.headers.get("user-agent", "")
@@ -1538,24 +1931,25 @@ async def redirect_url(short_code: str, request: Request):
         if source == "qr" or "qr" in request.query_params:
             source = "qr"
         
-        cursor.execute("""
-            INSERT INTO clicks (
-                url_id, ip_address, user_agent, referrer, source,
-                device_type, browser, os, country, city,
-                utm_source, utm_medium, utm_campaign, utm_term, utm_content,
-                clicked_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            url_id, client_ip, user_agent, referrer, source,
-            ua_info['device_type'], ua_info['browser'], ua_info['os'],
-            location_info['country'], location_info['city'],
-            utm_params.get('utm_source'), utm_params.get('utm_medium'),
-            utm_params.get('utm_campaign'), utm_params.get('utm_term'),
-            utm_params.get('utm_content'), datetime.now().isoformat()
-        ))
-        
-        conn.commit()
-        conn.close()
+        # クリックはキューに積むだけでリダイレクトを返す
+        click_queue.enqueue({
+            'url_id': url_id,
+            'ip_address': client_ip,
+            'user_agent': user_agent,
+            'referrer': referrer,
+            'source': source,
+            'device_type': ua_info['device_type'],
+            'browser': ua_info['browser'],
+            'os': ua_info['os'],
+            'country': location_info['country'],
+            'city': location_info['city'],
+            'utm_source': utm_params.get('utm_source'),
+            'utm_medium': utm_params.get('utm_medium'),
+            'utm_campaign': utm_params.get('utm_campaign'),
+            'utm_term': utm_params.get('utm_term'),
+            'utm_content': utm_params.get('utm_content'),
+            'clicked_at': datetime.now().isoformat()
+        })
         
         return RedirectResponse(url=original_url, status_code=302)
         
@@ -0,0 +1,199 @@
+from functools import lru_cache
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+# 絶対インポート
+import config
+
+
+def split_referrer(referrer: str) -> Tuple[str, str]:
+    """リファラーURLを(オーソリティ部, パス以降)に分解（urlparseより軽量）
+
+    オーソリティ部はユーザー情報・ポート・大文字を含んだままの生の文字列で、
+    正規化はホスト名ごとにメモ化される_compile_host側で行う。
+    """
+    scheme_end = referrer.find("://")
+    if scheme_end != -1:
+        start = scheme_end + 3
+    elif referrer.startswith("//"):
+        start = 2
+    else:
+        start = 0
+
+    end = referrer.find("/", start)
+    if end == -1:
+        return referrer[start:], ""
+    return referrer[start:end], referrer[end:]
+
+
+def normalize_host(authority: str) -> Tuple[str, bool]:
+    """オーソリティ部からホスト名を取り出す（パスが続くかどうかも返す）"""
+    has_path = True
+    for delimiter in "?#":
+        index = authority.find(delimiter)
+        if index != -1:
+            # "/"より前にクエリ・フラグメントが始まっている（パスなし）
+            authority = authority[:index]
+            has_path = False
+
+    authority = authority.strip().rpartition("@")[2]
+    if authority.startswith("["):
+        host = authority[:authority.find("]") + 1]
+    else:
+        host = authority.partition(":")[0]
+    return host.lower().rstrip("."), has_path
+
+
+class ReferrerClassifier:
+    """ルールテーブルをコンパイルしたリファラー分類器
+
+    ホスト名を末尾のドメインから辿り、ドメインサフィックス表（辞書）で
+    一致を探す。長いサフィックスほど優先するため、"mail.google.com"と
+    "google.com"のように別分類のドメインを共存でき、"t.co"が
+    "reddit.com"に部分一致するような誤判定も起きない。
+
+    - domains: {"t.co": "twitter", ...} ドメイン自身とそのサブドメインに一致
+    - paths: {"icloud.com": [("/mail", "email")], ...} 同じドメイン内でパスの前方一致で分類
+    - labels: {"google": "search_google", ...} ドメインに一致しない場合、
+      ホスト名のいずれかのラベルに一致（google.co.jpなど国別ドメイン用）
+
+    判定結果はリファラーのオーソリティ部（ホスト名）ごとにlru_cacheでメモ化し、
+    クリックごとの処理は文字列の分割と辞書引き1回で済ませる。
+    """
+
+    def __init__(self, domains: Dict[str, str], paths: Dict[str, Sequence[Tuple[str, str]]] = None,
+                 labels: Dict[str, str] = None, default: str = "referrer", direct: str = "direct",
+                 memo_size: int = None):
+        self.domains = {domain.lower(): source for domain, source in domains.items()}
+        self.paths = {
+            domain.lower(): tuple((prefix.lower(), source) for prefix, source in hints)
+            for domain, hints in (paths or {}).items()
+        }
+        self.labels = {label.lower(): source for label, source in (labels or {}).items()}
+        self.default = default
+        self.direct = direct
+        self._default_has_host = "{host}" in default
+        self._compiled_host = lru_cache(maxsize=memo_size or config.REFERRER_CACHE_SIZE)(self._compile_host)
+
+    def classify(self, referrer: Optional[str]) -> str:
+        """リファラーからトラフィック元を判定"""
+        if not referrer:
+            return self.direct
+        host, source = self.lookup(referrer)
+        if source is not None:
+            return source
+        return self.default.format(host=host) if self._default_has_host else self.default
+
+    def lookup(self, referrer: str) -> Tuple[str, Optional[str]]:
+        """(ホスト名, 一致した分類)を返す（一致しない場合は分類がNone）"""
+        authority, path = split_referrer(referrer)
+        host, path_hints, source = self._compiled_host(authority)
+        if path_hints:
+            path = path.lower()
+            for prefix, hinted_source in path_hints:
+                if path.startswith(prefix):
+                    return host, hinted_source
+        return host, source
+
+    def stats(self) -> Dict[str, Any]:
+        """ルール数とメモ化キャッシュの統計"""
+        info = self._compiled_host.cache_info()
+        lookups = info.hits + info.misses
+        return {
+            "domains": len(self.domains),
+            "paths": sum(len(hints) for hints in self.paths.values()),
+            "labels": len(self.labels),
+            "memo": {
+                "size": info.currsize,
+                "max_size": info.maxsize,
+                "hits": info.hits,
+                "misses": info.misses,
+                "hit_rate": round(info.hits / lookups, 4) if lookups else 0.0
+            }
+        }
+
+    def _compile_host(self, authority: str) -> Tuple[str, tuple, Optional[str]]:
+        """オーソリティ部に対する(ホスト名, 適用するパスヒント, 分類)を求める"""
+        host, has_path = normalize_host(authority)
+        path_hints = ()
+        parts = host.split(".")
+        for i in range(len(parts)):
+            suffix = ".".join(parts[i:])
+            if has_path:
+                path_hints += self.paths.get(suffix, ())
+            source = self.domains.get(suffix)
+            if source is not None:
+                return host, path_hints, source
+
+        for part in parts:
+            source = self.labels.get(part)
+            if source is not None:
+                return host, path_hints, source
+        return host, path_hints, None
+
+
+# ソーシャルメディアのドメイン（短縮ドメイン・アプリのリファラーを含む）
+SOCIAL_DOMAINS = {
+    "twitter.com": "twitter",
+    "x.com": "twitter",
+    "t.co": "twitter",
+    "com.twitter.android": "twitter",
+    "facebook.com": "facebook",
+    "fb.com": "facebook",
+    "fb.me": "facebook",
+    "com.facebook.katana": "facebook",
+    "instagram.com": "instagram",
+    "linkedin.com": "linkedin",
+    "lnkd.in": "linkedin",
+    "youtube.com": "youtube",
+    "youtu.be": "youtube",
+    "tiktok.com": "tiktok",
+    "line.me": "line",
+    "jp.naver.line.android": "line"
+}
+
+# 詳細分類（routes/redirect.pyのdetermine_traffic_source）
+DETAILED_RULES = {
+    "domains": {
+        **SOCIAL_DOMAINS,
+        "mail.google.com": "email",
+        "com.google.android.gm": "email",
+        "outlook.live.com": "email",
+        "outlook.office.com": "email",
+        "outlook.office365.com": "email",
+        "mail.yahoo.com": "email",
+        "mail.yahoo.co.jp": "email",
+        "com.google.android.googlequicksearchbox": "search_google"
+    },
+    "paths": {
+        "icloud.com": [("/mail", "email")]
+    },
+    "labels": {
+        "google": "search_google",
+        "yahoo": "search_yahoo",
+        "bing": "search_bing",
+        "duckduckgo": "search_duckduckgo",
+        "mail": "email",
+        "webmail": "email",
+        "outlook": "email",
+        "gmail": "email"
+    }
+}
+
+# 簡易分類（backendのリダイレクト処理）
+SIMPLE_RULES = {
+    "domains": {
+        **{domain: source for domain, source in SOCIAL_DOMAINS.items() if source != "line"},
+        "com.google.android.googlequicksearchbox": "google"
+    },
+    "labels": {
+        "google": "google"
+    }
+}
+
+detailed_classifier = ReferrerClassifier(
+    DETAILED_RULES["domains"], DETAILED_RULES["paths"], DETAILED_RULES["labels"],
+    default="referral_{host}"
+)
+simple_classifier = ReferrerClassifier(
+    SIMPLE_RULES["domains"], labels=SIMPLE_RULES["labels"], default="referrer"
+)
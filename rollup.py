@@ -0,0 +1,612 @@
+import sqlite3
+import struct
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+# 絶対インポート
+from db_pool import get_pool
+from hll import HyperLogLog
+
+# click_rollup_totals / click_rollup_visitors の特別な行
+ALL_URLS = 0      # 全URLの合計（url_idは1から始まるため衝突しない）
+ALL_SOURCES = ""  # 全ソースの合計
+
+ROLLUP_TABLES = (
+    "click_rollup_hourly", "click_rollup_totals", "click_rollup_visitors",
+    "click_rollup_hll", "click_rollup_campaign_hll", "click_rollup_campaign_daily",
+    "click_rollup_heatmap", "click_rollup_state"
+)
+
+# click_rollup_stateで位置を持つ集計（それぞれ独立に追いつく）
+WATERMARKS = ("clicks", "sketches", "url_counters", "campaigns", "heatmap")
+
+# 曜日×時間帯ヒートマップ: タイムゾーン名 -> UTCからの時差（時間）
+# クリック時刻はUTC（サーバーのローカル時刻=UTC）として扱う。日本は夏時間がないため固定の+9で正確
+HEATMAP_TIMEZONES = {"UTC": 0, "JST": 9}
+HEATMAP_SLOTS = 7 * 24                      # 月曜0時=0 ... 日曜23時=167
+HEATMAP_FORMAT = f"<{HEATMAP_SLOTS}I"       # 固定長672バイトのBLOB
+
+# urlsテーブルに持つ非正規化カウンタ（一覧・上位N件をJOINなしで読むため）
+URL_COUNTER_COLUMNS = (
+    ("total_clicks", "INTEGER NOT NULL DEFAULT 0"),
+    ("qr_clicks", "INTEGER NOT NULL DEFAULT 0"),
+    ("mobile_clicks", "INTEGER NOT NULL DEFAULT 0"),
+    ("last_clicked_at", "TEXT")
+)
+
+
+class ClickRollup:
+    """clicksテーブルの集計（ロールアップ）を差分更新で保持する
+
+    - click_rollup_hourly: (url_id, day, hour, source, device_type)ごとのクリック数
+    - click_rollup_totals: (url_id, source)ごとの累計（クリック数・ユニーク訪問者・QR・モバイル・
+      初回/最終クリック）。url_id=0は全URL、source=''は全ソースの合計
+    - click_rollup_visitors: ユニーク訪問者を数えるための(url_id, source, ip_address)の集合
+    - click_rollup_hll / click_rollup_campaign_hll: (url_id, day)・(campaign_name, day)ごとの
+      訪問者のHyperLogLogスケッチ。期間・キャンペーン単位のユニーク数はこれをマージして近似する
+    - click_rollup_campaign_daily: (campaign_name, day, source, device_type)ごとのクリック数。
+      キャンペーンレポートはリンク数に関係なくこのテーブルだけで作れる
+    - click_rollup_heatmap: (url_id, timezone)ごとの曜日×時間帯のクリック数（7x24の固定長BLOB）
+    - click_rollup_state: 集計済みのclicks.idの位置
+    - urls.total_clicks / qr_clicks / mobile_clicks / last_clicked_at: リンクごとの累計の
+      非正規化コピー。total_clicksのインデックスで上位N件を集計なしで取得できる
+
+    apply()は集計済み位置より後のclicks行だけをGROUP BYして加算する。
+    クリックの書き込みと同じトランザクションで呼ぶ（ClickIngestQueueのリスナー）ため
+    集計は常に生データと一致し、分析画面はクリック数に関係なく集計テーブルだけを読めばよい。
+    アプリごとにクリック時刻・端末種別の列名が異なるため、列名を指定して作成する。
+    """
+
+    def __init__(self, db_path: str, time_column: str = "clicked_at", device_column: Optional[str] = None):
+        self.db_path = db_path
+        self.time_column = time_column
+        self.device_column = device_column
+        self._lock = threading.Lock()
+
+        self.applied = 0
+        self.applies = 0
+        self.last_apply_ms = 0.0
+        self.rebuilds = 0
+        self.last_rebuild_ms = 0.0
+
+        ts = f"COALESCE({time_column}, datetime('now'))"
+        device = f"COALESCE({device_column}, 'unknown')" if device_column else "'unknown'"
+        source = "COALESCE(source, 'direct')"
+        window = "FROM clicks WHERE id > ? AND id <= ?"
+
+        self._hourly_sql = f"""
+            INSERT INTO click_rollup_hourly (url_id, day, hour, source, device_type, clicks)
+            SELECT url_id, substr({ts}, 1, 10), CAST(substr({ts}, 12, 2) AS INTEGER), {source}, {device}, COUNT(*)
+            {window}
+            GROUP BY 1, 2, 3, 4, 5
+            ON CONFLICT (url_id, day, hour, source, device_type)
+            DO UPDATE SET clicks = clicks + excluded.clicks
+        """
+
+        visitors = f"ip_address, MIN(id) {window} AND ip_address IS NOT NULL"
+        self._visitors_sql = f"""
+            INSERT OR IGNORE INTO click_rollup_visitors (url_id, source, ip_address, first_click_id)
+            SELECT url_id, {source}, {visitors} GROUP BY 1, 2, 3
+            UNION ALL
+            SELECT url_id, '{ALL_SOURCES}', {visitors} GROUP BY 1, 3
+            UNION ALL
+            SELECT {ALL_URLS}, '{ALL_SOURCES}', {visitors} GROUP BY 3
+        """
+
+        totals = (
+            f"COUNT(*), COUNT(CASE WHEN source = 'qr' THEN 1 END), "
+            f"COUNT(CASE WHEN LOWER({device}) = 'mobile' THEN 1 END), MIN({ts}), MAX({ts}) {window}"
+        )
+        counters = (
+            f"COUNT(*) AS n_clicks, COUNT(CASE WHEN source = 'qr' THEN 1 END) AS n_qr, "
+            f"COUNT(CASE WHEN LOWER({device}) = 'mobile' THEN 1 END) AS n_mobile, MAX({ts}) AS last_at"
+        )
+        self._url_counters_sql = f"""
+            UPDATE urls SET
+                total_clicks = total_clicks + d.n_clicks,
+                qr_clicks = qr_clicks + d.n_qr,
+                mobile_clicks = mobile_clicks + d.n_mobile,
+                last_clicked_at = MAX(COALESCE(last_clicked_at, ''), d.last_at)
+            FROM (SELECT url_id, {counters} {window} GROUP BY url_id) AS d
+            WHERE urls.id = d.url_id
+        """
+        self._reconcile_sql = f"""
+            UPDATE urls SET
+                total_clicks = COALESCE(d.n_clicks, 0),
+                qr_clicks = COALESCE(d.n_qr, 0),
+                mobile_clicks = COALESCE(d.n_mobile, 0),
+                last_clicked_at = d.last_at
+            FROM (
+                SELECT u.id, c.n_clicks, c.n_qr, c.n_mobile, c.last_at
+                FROM urls u
+                LEFT JOIN (SELECT url_id, {counters} FROM clicks WHERE id <= ? GROUP BY url_id) c ON c.url_id = u.id
+            ) AS d
+            WHERE urls.id = d.id
+            AND (urls.total_clicks IS NOT COALESCE(d.n_clicks, 0)
+                 OR urls.qr_clicks IS NOT COALESCE(d.n_qr, 0)
+                 OR urls.mobile_clicks IS NOT COALESCE(d.n_mobile, 0)
+                 OR urls.last_clicked_at IS NOT d.last_at)
+        """
+
+        c_device = f"COALESCE(c.{device_column}, 'unknown')" if device_column else "'unknown'"
+        self._campaign_sql = f"""
+            INSERT INTO click_rollup_campaign_daily (campaign_name, day, source, device_type, clicks)
+            SELECT u.campaign_name, substr(COALESCE(c.{time_column}, datetime('now')), 1, 10),
+                   COALESCE(c.source, 'direct'), {c_device}, COUNT(*)
+            FROM clicks c
+            JOIN urls u ON u.id = c.url_id
+            WHERE c.id > ? AND c.id <= ? AND u.campaign_name IS NOT NULL AND u.campaign_name != ''
+            GROUP BY 1, 2, 3, 4
+            ON CONFLICT (campaign_name, day, source, device_type)
+            DO UPDATE SET clicks = clicks + excluded.clicks
+        """
+
+        self._heatmap_sql = f"""
+            SELECT url_id, CAST(strftime('%w', t) AS INTEGER), CAST(strftime('%H', t) AS INTEGER), COUNT(*)
+            FROM (SELECT url_id, datetime({ts}, ?) AS t {window})
+            WHERE t IS NOT NULL
+            GROUP BY 1, 2, 3
+        """
+
+        self._sketch_sql = f"""
+            SELECT DISTINCT c.url_id, u.campaign_name, substr(COALESCE(c.{time_column}, datetime('now')), 1, 10), c.ip_address
+            FROM clicks c
+            LEFT JOIN urls u ON u.id = c.url_id
+            WHERE c.id > ? AND c.id <= ? AND c.ip_address IS NOT NULL
+        """
+
+        self._totals_sql = f"""
+            INSERT INTO click_rollup_totals
+                (url_id, source, clicks, qr_clicks, mobile_clicks, first_clicked_at, last_clicked_at)
+            SELECT url_id, {source}, {totals} GROUP BY 1, 2
+            UNION ALL
+            SELECT url_id, '{ALL_SOURCES}', {totals} GROUP BY 1
+            UNION ALL
+            SELECT {ALL_URLS}, '{ALL_SOURCES}', {totals}
+            ON CONFLICT (url_id, source) DO UPDATE SET
+                clicks = clicks + excluded.clicks,
+                qr_clicks = qr_clicks + excluded.qr_clicks,
+                mobile_clicks = mobile_clicks + excluded.mobile_clicks,
+                first_clicked_at = MIN(COALESCE(first_clicked_at, excluded.first_clicked_at), excluded.first_clicked_at),
+                last_clicked_at = MAX(COALESCE(last_clicked_at, ''), excluded.last_clicked_at)
+        """
+
+    @classmethod
+    def for_database(cls, db_path: str) -> "ClickRollup":
+        """clicksテーブルの列からクリック時刻・端末種別の列名を判定して作成（保守コマンド用）"""
+        conn = sqlite3.connect(db_path)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(clicks)").fetchall()}
+        conn.close()
+        time_column = "clicked_at" if "clicked_at" in columns else "created_at"
+        device_column = "device_type" if "device_type" in columns else None
+        return cls(db_path, time_column=time_column, device_column=device_column)
+
+    @staticmethod
+    def create_tables(cursor: sqlite3.Cursor) -> None:
+        """集計テーブルを作成（init_dbから呼ぶ）"""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS click_rollup_hourly (
+                url_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                hour INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                device_type TEXT NOT NULL,
+                clicks INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (url_id, day, hour, source, device_type)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS click_rollup_totals (
+                url_id INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                clicks INTEGER NOT NULL DEFAULT 0,
+                unique_visitors INTEGER NOT NULL DEFAULT 0,
+                qr_clicks INTEGER NOT NULL DEFAULT 0,
+                mobile_clicks INTEGER NOT NULL DEFAULT 0,
+                first_clicked_at TEXT,
+                last_clicked_at TEXT,
+                PRIMARY KEY (url_id, source)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS click_rollup_visitors (
+                url_id INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                ip_address TEXT NOT NULL,
+                first_click_id INTEGER NOT NULL,
+                PRIMARY KEY (url_id, source, ip_address)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS click_rollup_hll (
+                url_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                sketch BLOB NOT NULL,
+                PRIMARY KEY (url_id, day)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS click_rollup_campaign_hll (
+                campaign_name TEXT NOT NULL,
+                day TEXT NOT NULL,
+                sketch BLOB NOT NULL,
+                PRIMARY KEY (campaign_name, day)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS click_rollup_campaign_daily (
+                campaign_name TEXT NOT NULL,
+                day TEXT NOT NULL,
+                source TEXT NOT NULL,
+                device_type TEXT NOT NULL,
+                clicks INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (campaign_name, day, source, device_type)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS click_rollup_heatmap (
+                url_id INTEGER NOT NULL,
+                timezone TEXT NOT NULL,
+                matrix BLOB NOT NULL,
+                PRIMARY KEY (url_id, timezone)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS click_rollup_state (
+                name TEXT PRIMARY KEY,
+                last_click_id INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_click_rollup_hourly_day ON click_rollup_hourly(day)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_click_rollup_visitors_first ON click_rollup_visitors(first_click_id)")
+
+        # 既存DBのurlsテーブルにカウンタ列を追加（値は次のapply()で既存のクリックから埋まる）
+        existing = {row[1] for row in cursor.execute("PRAGMA table_info(urls)").fetchall()}
+        for column, definition in URL_COUNTER_COLUMNS:
+            if column not in existing:
+                cursor.execute(f"ALTER TABLE urls ADD COLUMN {column} {definition}")
+                print(f"🔧 urlsテーブルに{column}列を追加しました")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_urls_total_clicks ON urls(total_clicks)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_urls_campaign_clicks ON urls(campaign_name, total_clicks)")
+
+    def apply(self, conn: sqlite3.Connection, batch: list = None) -> int:
+        """未集計のクリックを集計テーブルに加算し、加算した件数を返す
+
+        呼び出し側のトランザクション内で実行する（commitしない）。
+        ClickIngestQueueのリスナーとしても使えるようbatch引数を受け取るが、
+        対象はclicks.idで決めるため中身は使わない。
+        """
+        started = time.perf_counter()
+        high = conn.execute("SELECT COALESCE(MAX(id), 0) FROM clicks").fetchone()[0]
+
+        # スケッチは集計と別の位置を持つ（後から追加したテーブルも既存のクリックから埋まる）
+        sketch_low = self._watermark(conn, "sketches")
+        if high > sketch_low:
+            self._apply_sketches(conn, sketch_low, high)
+            self._set_watermark(conn, "sketches", high)
+
+        counter_low = self._watermark(conn, "url_counters")
+        if high > counter_low:
+            conn.execute(self._url_counters_sql, (counter_low, high))
+            self._set_watermark(conn, "url_counters", high)
+
+        campaign_low = self._watermark(conn, "campaigns")
+        if high > campaign_low:
+            conn.execute(self._campaign_sql, (campaign_low, high))
+            self._set_watermark(conn, "campaigns", high)
+
+        heatmap_low = self._watermark(conn, "heatmap")
+        if high > heatmap_low:
+            self._apply_heatmap(conn, heatmap_low, high)
+            self._set_watermark(conn, "heatmap", high)
+
+        low = self._watermark(conn, "clicks")
+        if high <= low:
+            return 0
+
+        conn.execute(self._hourly_sql, (low, high))
+        conn.execute(self._visitors_sql, (low, high) * 3)
+        conn.execute(self._totals_sql, (low, high) * 3)
+
+        # 今回初めて現れた訪問者の数だけユニーク訪問者数を加算
+        new_visitors = conn.execute("""
+            SELECT url_id, source, COUNT(*) FROM click_rollup_visitors
+            WHERE first_click_id > ?
+            GROUP BY url_id, source
+        """, (low,)).fetchall()
+        conn.executemany(
+            "UPDATE click_rollup_totals SET unique_visitors = unique_visitors + ? WHERE url_id = ? AND source = ?",
+            [(count, url_id, source) for url_id, source, count in new_visitors]
+        )
+
+        self._set_watermark(conn, "clicks", high)
+
+        count = conn.execute("SELECT COUNT(*) FROM clicks WHERE id > ? AND id <= ?", (low, high)).fetchone()[0]
+        with self._lock:
+            self.applied += count
+            self.applies += 1
+            self.last_apply_ms = round((time.perf_counter() - started) * 1000, 3)
+        return count
+
+    def _apply_sketches(self, conn: sqlite3.Connection, low: int, high: int) -> None:
+        """範囲内のクリックの訪問者を日別のHyperLogLogスケッチに加える"""
+        visitors = {}
+        for url_id, campaign_name, day, ip_address in conn.execute(self._sketch_sql, (low, high)):
+            visitors.setdefault(("click_rollup_hll", "url_id", url_id, day), set()).add(ip_address)
+            visitors.setdefault(("click_rollup_hll", "url_id", ALL_URLS, day), set()).add(ip_address)
+            if campaign_name:
+                visitors.setdefault(("click_rollup_campaign_hll", "campaign_name", campaign_name, day), set()).add(ip_address)
+
+        for (table, key_column, key, day), ip_addresses in visitors.items():
+            row = conn.execute(
+                f"SELECT sketch FROM {table} WHERE {key_column} = ? AND day = ?", (key, day)
+            ).fetchone()
+            sketch = HyperLogLog.from_bytes(row[0] if row else None)
+            sketch.update(ip_addresses)
+            conn.execute(
+                f"INSERT INTO {table} ({key_column}, day, sketch) VALUES (?, ?, ?) "
+                f"ON CONFLICT ({key_column}, day) DO UPDATE SET sketch = excluded.sketch",
+                (key, day, sketch.to_bytes())
+            )
+
+    def _apply_heatmap(self, conn: sqlite3.Connection, low: int, high: int) -> None:
+        """範囲内のクリックをタイムゾーンごとの曜日×時間帯ヒートマップに加える"""
+        for timezone, offset in HEATMAP_TIMEZONES.items():
+            deltas = {}
+            for url_id, weekday, hour, clicks in conn.execute(self._heatmap_sql, (f"{offset:+d} hours", low, high)):
+                # strftime('%w')は日曜=0のため月曜=0に変換
+                slot = (weekday + 6) % 7 * 24 + hour
+                for key in (url_id, ALL_URLS):
+                    deltas.setdefault(key, [0] * HEATMAP_SLOTS)[slot] += clicks
+
+            for url_id, delta in deltas.items():
+                row = conn.execute(
+                    "SELECT matrix FROM click_rollup_heatmap WHERE url_id = ? AND timezone = ?", (url_id, timezone)
+                ).fetchone()
+                if row:
+                    delta = [a + b for a, b in zip(struct.unpack(HEATMAP_FORMAT, row[0]), delta)]
+                conn.execute(
+                    "INSERT INTO click_rollup_heatmap (url_id, timezone, matrix) VALUES (?, ?, ?) "
+                    "ON CONFLICT (url_id, timezone) DO UPDATE SET matrix = excluded.matrix",
+                    (url_id, timezone, struct.pack(HEATMAP_FORMAT, *delta))
+                )
+
+    @staticmethod
+    def _watermark(conn: sqlite3.Connection, name: str) -> int:
+        row = conn.execute("SELECT last_click_id FROM click_rollup_state WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _set_watermark(conn: sqlite3.Connection, name: str, last_click_id: int) -> None:
+        conn.execute("""
+            INSERT INTO click_rollup_state (name, last_click_id) VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET last_click_id = excluded.last_click_id
+        """, (name, last_click_id))
+
+    def unique_visitors(self, conn: sqlite3.Connection, url_id: int = ALL_URLS, campaign_name: str = None,
+                        start: str = None, end: str = None) -> Dict[str, Any]:
+        """ユニーク訪問者数を取得
+
+        期間もキャンペーンも指定しなければ累計の正確な値、指定した場合は
+        日別スケッチをマージしたHyperLogLogの近似値を返す（exactで区別）。
+        start/endは'YYYY-MM-DD'（両端を含む）。形式が不正ならValueError。
+        """
+        for day in (start, end):
+            if day is not None:
+                datetime.strptime(day, "%Y-%m-%d")
+
+        if campaign_name is None and start is None and end is None:
+            row = conn.execute(
+                "SELECT unique_visitors FROM click_rollup_totals WHERE url_id = ? AND source = ?",
+                (url_id, ALL_SOURCES)
+            ).fetchone()
+            return {"unique_visitors": row[0] if row else 0, "exact": True, "method": "exact"}
+
+        if campaign_name is not None:
+            query = "SELECT sketch FROM click_rollup_campaign_hll WHERE campaign_name = ? AND day >= ? AND day <= ?"
+            key = campaign_name
+        else:
+            query = "SELECT sketch FROM click_rollup_hll WHERE url_id = ? AND day >= ? AND day <= ?"
+            key = url_id
+
+        sketch = HyperLogLog()
+        days = 0
+        for (data,) in conn.execute(query, (key, start or "", end or "9999-12-31")):
+            sketch.merge_bytes(data)
+            days += 1
+        return {
+            "unique_visitors": sketch.count(),
+            "exact": False,
+            "method": "hyperloglog",
+            "standard_error": round(sketch.standard_error, 4),
+            "days": days
+        }
+
+    def heatmap(self, conn: sqlite3.Connection, url_id: int = ALL_URLS, timezone: str = "UTC") -> Dict[str, Any]:
+        """曜日×時間帯のヒートマップを取得（timezoneはHEATMAP_TIMEZONESのキー、不明ならValueError）"""
+        timezone = timezone.upper()
+        if timezone not in HEATMAP_TIMEZONES:
+            raise ValueError(f"未対応のタイムゾーン: {timezone}")
+
+        row = conn.execute(
+            "SELECT matrix FROM click_rollup_heatmap WHERE url_id = ? AND timezone = ?", (url_id, timezone)
+        ).fetchone()
+        counts = struct.unpack(HEATMAP_FORMAT, row[0]) if row else (0,) * HEATMAP_SLOTS
+        matrix = [list(counts[day * 24:(day + 1) * 24]) for day in range(7)]
+        return {
+            "timezone": timezone,
+            "utc_offset_hours": HEATMAP_TIMEZONES[timezone],
+            "weekdays": ["月", "火", "水", "木", "金", "土", "日"],
+            "matrix": matrix,
+            "by_hour": [sum(day[hour] for day in matrix) for hour in range(24)],
+            "by_weekday": [sum(day) for day in matrix],
+            "total": sum(counts)
+        }
+
+    def campaign_report(self, conn: sqlite3.Connection, campaign_name: str, days: int = 30,
+                        top_urls: int = 100) -> Optional[Dict[str, Any]]:
+        """キャンペーンのレポートを集計テーブルとurlsのカウンタ列だけから作成
+
+        有効なリンクがなければNone。日別の推移は直近days日、リンク一覧は
+        クリック数の多い順にtop_urls件（総数はsummary.total_urls）。
+        """
+        summary = conn.execute("""
+            SELECT COUNT(*), COALESCE(SUM(total_clicks), 0), COALESCE(SUM(qr_clicks), 0),
+                   COALESCE(SUM(mobile_clicks), 0), MAX(last_clicked_at)
+            FROM urls
+            WHERE campaign_name = ? AND is_active = 1
+        """, (campaign_name,)).fetchone()
+        if not summary[0]:
+            return None
+        total_urls, total_clicks, qr_clicks, mobile_clicks, last_clicked_at = summary
+
+        urls = conn.execute("""
+            SELECT u.short_code, u.original_url, u.custom_name, u.total_clicks,
+                   COALESCE(t.unique_visitors, 0), u.qr_clicks, u.mobile_clicks, u.last_clicked_at
+            FROM urls u
+            LEFT JOIN click_rollup_totals t ON t.url_id = u.id AND t.source = ?
+            WHERE u.campaign_name = ? AND u.is_active = 1
+            ORDER BY u.total_clicks DESC
+            LIMIT ?
+        """, (ALL_SOURCES, campaign_name, top_urls)).fetchall()
+
+        daily = conn.execute("""
+            SELECT day, SUM(clicks) FROM click_rollup_campaign_daily
+            WHERE campaign_name = ? AND day >= date('now', ?)
+            GROUP BY day
+            ORDER BY day
+        """, (campaign_name, f"-{int(days)} days")).fetchall()
+
+        breakdowns = {}
+        for column in ("device_type", "source"):
+            breakdowns[column] = conn.execute(f"""
+                SELECT {column}, SUM(clicks) AS count FROM click_rollup_campaign_daily
+                WHERE campaign_name = ?
+                GROUP BY {column}
+                ORDER BY count DESC
+            """, (campaign_name,)).fetchall()
+
+        unique = self.unique_visitors(conn, campaign_name=campaign_name)
+        return {
+            "campaign_name": campaign_name,
+            "summary": {
+                "total_urls": total_urls,
+                "total_clicks": total_clicks,
+                "unique_visitors": unique["unique_visitors"],
+                "unique_visitors_exact": unique["exact"],
+                "qr_clicks": qr_clicks,
+                "mobile_clicks": mobile_clicks,
+                "conversion_rate": f"{(qr_clicks / max(total_clicks, 1) * 100):.1f}%",
+                "last_clicked_at": last_clicked_at
+            },
+            "urls": [{
+                "short_code": row[0],
+                "original_url": row[1],
+                "custom_name": row[2],
+                "clicks": row[3],
+                "unique_visitors": row[4],
+                "qr_clicks": row[5],
+                "mobile_clicks": row[6],
+                "last_clicked_at": row[7]
+            } for row in urls],
+            "daily_performance": [{"date": row[0], "clicks": row[1]} for row in daily],
+            "device_breakdown": [{"device": row[0], "count": row[1]} for row in breakdowns["device_type"]],
+            "source_breakdown": [{"source": row[0], "count": row[1]} for row in breakdowns["source"]]
+        }
+
+    def catch_up(self) -> int:
+        """キューを経由せずに書き込まれたクリックを集計に取り込む"""
+        with get_pool(self.db_path).writer() as conn:
+            count = self.apply(conn)
+        if count:
+            print(f"✅ クリック集計を更新: {count}件")
+        return count
+
+    def rebuild(self) -> Dict[str, Any]:
+        """集計テーブルを空にしてclicksテーブル全体から作り直す（削除・クリーンアップ後など）"""
+        started = time.perf_counter()
+        with get_pool(self.db_path).writer() as conn:
+            for table in ROLLUP_TABLES:
+                conn.execute(f"DELETE FROM {table}")
+            conn.execute(
+                "UPDATE urls SET total_clicks = 0, qr_clicks = 0, mobile_clicks = 0, last_clicked_at = NULL"
+            )
+            count = self.apply(conn)
+
+        with self._lock:
+            self.rebuilds += 1
+            self.last_rebuild_ms = round((time.perf_counter() - started) * 1000, 3)
+
+        print(f"✅ クリック集計を再構築: {count}件 ({self.last_rebuild_ms}ms)")
+        return self.stats()
+
+    def reconcile_url_counters(self) -> Dict[str, Any]:
+        """urlsのカウンタをclicksテーブルから数え直し、ずれていた行だけを修正する
+
+        カウンタは取り込み済みの位置までのクリックで比較する（未取り込みの分は次のapply()で加算）。
+        """
+        started = time.perf_counter()
+        with get_pool(self.db_path).writer() as conn:
+            # 先に取り込み済みにしてから、その位置までで数え直す
+            self.apply(conn)
+            checked_up_to = self._watermark(conn, "url_counters")
+            fixed = conn.execute(self._reconcile_sql, (checked_up_to,)).rowcount
+            checked = conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+
+        result = {
+            "checked_urls": checked,
+            "fixed_urls": fixed,
+            "last_click_id": checked_up_to,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 3)
+        }
+        if fixed:
+            print(f"🔧 URLカウンタを修正: {fixed}件 / {checked}件")
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """集計の統計を取得（未集計のクリック数を含む）"""
+        stats = {
+            "applied": self.applied,
+            "applies": self.applies,
+            "last_apply_ms": self.last_apply_ms,
+            "rebuilds": self.rebuilds,
+            "last_rebuild_ms": self.last_rebuild_ms
+        }
+        try:
+            conn = get_pool(self.db_path).reader()
+            positions = dict(conn.execute("SELECT name, last_click_id FROM click_rollup_state").fetchall())
+            max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM clicks").fetchone()[0]
+            conn.close()
+            # 最も遅れている集計の位置
+            stats["last_click_id"] = min(positions.get(name, 0) for name in WATERMARKS)
+            stats["lag"] = max(max_id - stats["last_click_id"], 0)
+        except Exception as e:
+            stats["error"] = str(e)
+        return stats
+
+
+if __name__ == "__main__":
+    # 保守コマンド: python rollup.py {stats,rebuild,reconcile} [--db PATH]
+    import argparse
+    import json
+    import os
+
+    parser = argparse.ArgumentParser(description="クリック集計・URLカウンタの保守")
+    parser.add_argument("command", choices=["stats", "rebuild", "reconcile"],
+                        help="stats: 集計の状態 / rebuild: 集計を作り直す / reconcile: URLカウンタを数え直して修正")
+    parser.add_argument("--db", default=os.getenv("DB_PATH", "url_shortener.db"))
+    args = parser.parse_args()
+
+    rollup = ClickRollup.for_database(args.db)
+    with get_pool(args.db).writer() as conn:
+        ClickRollup.create_tables(conn.cursor())
+
+    if args.command == "stats":
+        result = rollup.stats()
+    elif args.command == "rebuild":
+        result = rollup.rebuild()
+    else:
+        result = rollup.reconcile_url_counters()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
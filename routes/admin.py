@@ -1,12 +1,18 @@
 from fastapi import APIRouter, HTTPException, Request, Form
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse
 import sqlite3
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
 
 # 絶対インポートに変更
 import config
-from utils import get_db_connection, get_all_urls_stats, format_datetime, truncate_text
+from utils import get_db_connection, get_write_connection, format_datetime, truncate_text
+from db_executor import fast_query, heavy_query
+from cache import short_code_cache, dashboard_cache, invalidate_url
+from bloom import short_code_filter
+from database import click_rollup, click_columns
+from url_listing import list_urls, listing_controls_html
+from routes.redirect import click_stream
 
 router = APIRouter()
 
@@ -19,48 +25,48 @@ ADMIN_HTML = """
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>管理ダッシュボード - LinkTrack Pro</title>
     <style>
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body { font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background: #f5f6fa; color: #333; line-height: 1.6; }
-        .container { max-width: 1400px; margin: 0 auto; padding: 20px; }
-        .header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px; border-radius: 15px; margin-bottom: 30px; text-align: center; }
-        .header h1 { font-size: 2.5em; margin-bottom: 10px; font-weight: 300; }
-        .navigation { display: flex; justify-content: center; gap: 15px; margin-bottom: 30px; }
-        .nav-link { color: #333; text-decoration: none; padding: 10px 20px; background: white; border-radius: 25px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); transition: all 0.3s; }
-        .nav-link:hover { transform: translateY(-2px); box-shadow: 0 4px 15px rgba(0,0,0,0.15); }
-        .stats-grid { display: grid; grid-template-columns: repeat(auto-fit, minmax(250px, 1fr)); gap: 20px; margin-bottom: 30px; }
-        .stat-card { background: white; padding: 25px; border-radius: 15px; box-shadow: 0 5px 15px rgba(0,0,0,0.08); text-align: center; position: relative; overflow: hidden; }
-        .stat-card::before { content: ''; position: absolute; top: 0; left: 0; right: 0; height: 4px; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); }
-        .stat-number { font-size: 2.5em; font-weight: bold; color: #667eea; margin-bottom: 5px; }
-        .stat-label { font-size: 1.1em; color: #666; }
-        .dashboard-grid { display: grid; grid-template-columns: 2fr 1fr; gap: 30px; margin-bottom: 30px; }
-        .card { background: white; padding: 25px; border-radius: 15px; box-shadow: 0 5px 15px rgba(0,0,0,0.08); }
-        .card h2 { color: #333; margin-bottom: 20px; padding-bottom: 10px; border-bottom: 2px solid #f1f2f6; }
-        .url-table { width: 100%; border-collapse: collapse; margin-top: 15px; }
-        .url-table th, .url-table td { padding: 12px; text-align: left; border-bottom: 1px solid #eee; }
-        .url-table th { background: #f8f9fa; font-weight: 600; color: #555; }
-        .url-table tr:hover { background: #f8f9fa; }
-        .status-active { color: #28a745; font-weight: bold; }
-        .status-inactive { color: #dc3545; font-weight: bold; }
-        .btn { padding: 8px 16px; border: none; border-radius: 6px; cursor: pointer; font-size: 14px; text-decoration: none; display: inline-block; transition: all 0.3s; }
-        .btn-primary { background: #667eea; color: white; }
-        .btn-success { background: #28a745; color: white; }
-        .btn-danger { background: #dc3545; color: white; }
-        .btn-info { background: #17a2b8; color: white; }
-        .btn:hover { transform: translateY(-1px); opacity: 0.9; }
-        .recent-activity { max-height: 400px; overflow-y: auto; }
-        .activity-item { padding: 12px; border-bottom: 1px solid #eee; display: flex; justify-content: space-between; align-items: center; }
-        .activity-item:last-child { border-bottom: none; }
-        .activity-content { flex: 1; }
-        .activity-time { color: #666; font-size: 0.9em; }
-        .url-code { font-family: 'Courier New', monospace; background: #f8f9fa; padding: 2px 6px; border-radius: 4px; font-weight: bold; }
-        .truncate { max-width: 200px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }
-        .search-box { width: 100%; padding: 12px 15px; border: 2px solid #e1e5e9; border-radius: 8px; font-size: 16px; margin-bottom: 20px; }
-        .filter-section { display: flex; gap: 15px; margin-bottom: 20px; flex-wrap: wrap; }
-        .filter-section select { padding: 8px 12px; border: 1px solid #ddd; border-radius: 6px; }
-        .loading { text-align: center; padding: 40px; color: #666; }
-        .error { background: #f8d7da; color: #721c24; padding: 15px; border-radius: 8px; margin-bottom: 20px; }
-        @media (max-width: 1024px) { .dashboard-grid { grid-template-columns: 1fr; } }
-        @media (max-width: 768px) { .container { padding: 10px; } .navigation { flex-direction: column; align-items: center; } .filter-section { flex-direction: column; } .url-table { font-size: 14px; } .url-table th, .url-table td { padding: 8px; } }
+        * {{ margin: 0; padding: 0; box-sizing: border-box; }}
+        body {{ font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background: #f5f6fa; color: #333; line-height: 1.6; }}
+        .container {{ max-width: 1400px; margin: 0 auto; padding: 20px; }}
+        .header {{ background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px; border-radius: 15px; margin-bottom: 30px; text-align: center; }}
+        .header h1 {{ font-size: 2.5em; margin-bottom: 10px; font-weight: 300; }}
+        .navigation {{ display: flex; justify-content: center; gap: 15px; margin-bottom: 30px; }}
+        .nav-link {{ color: #333; text-decoration: none; padding: 10px 20px; background: white; border-radius: 25px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); transition: all 0.3s; }}
+        .nav-link:hover {{ transform: translateY(-2px); box-shadow: 0 4px 15px rgba(0,0,0,0.15); }}
+        .stats-grid {{ display: grid; grid-template-columns: repeat(auto-fit, minmax(250px, 1fr)); gap: 20px; margin-bottom: 30px; }}
+        .stat-card {{ background: white; padding: 25px; border-radius: 15px; box-shadow: 0 5px 15px rgba(0,0,0,0.08); text-align: center; position: relative; overflow: hidden; }}
+        .stat-card::before {{ content: ''; position: absolute; top: 0; left: 0; right: 0; height: 4px; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); }}
+        .stat-number {{ font-size: 2.5em; font-weight: bold; color: #667eea; margin-bottom: 5px; }}
+        .stat-label {{ font-size: 1.1em; color: #666; }}
+        .dashboard-grid {{ display: grid; grid-template-columns: 2fr 1fr; gap: 30px; margin-bottom: 30px; }}
+        .card {{ background: white; padding: 25px; border-radius: 15px; box-shadow: 0 5px 15px rgba(0,0,0,0.08); }}
+        .card h2 {{ color: #333; margin-bottom: 20px; padding-bottom: 10px; border-bottom: 2px solid #f1f2f6; }}
+        .url-table {{ width: 100%; border-collapse: collapse; margin-top: 15px; }}
+        .url-table th, .url-table td {{ padding: 12px; text-align: left; border-bottom: 1px solid #eee; }}
+        .url-table th {{ background: #f8f9fa; font-weight: 600; color: #555; }}
+        .url-table tr:hover {{ background: #f8f9fa; }}
+        .status-active {{ color: #28a745; font-weight: bold; }}
+        .status-inactive {{ color: #dc3545; font-weight: bold; }}
+        .btn {{ padding: 8px 16px; border: none; border-radius: 6px; cursor: pointer; font-size: 14px; text-decoration: none; display: inline-block; transition: all 0.3s; }}
+        .btn-primary {{ background: #667eea; color: white; }}
+        .btn-success {{ background: #28a745; color: white; }}
+        .btn-danger {{ background: #dc3545; color: white; }}
+        .btn-info {{ background: #17a2b8; color: white; }}
+        .btn:hover {{ transform: translateY(-1px); opacity: 0.9; }}
+        .recent-activity {{ max-height: 400px; overflow-y: auto; }}
+        .activity-item {{ padding: 12px; border-bottom: 1px solid #eee; display: flex; justify-content: space-between; align-items: center; }}
+        .activity-item:last-child {{ border-bottom: none; }}
+        .activity-content {{ flex: 1; }}
+        .activity-time {{ color: #666; font-size: 0.9em; }}
+        .url-code {{ font-family: 'Courier New', monospace; background: #f8f9fa; padding: 2px 6px; border-radius: 4px; font-weight: bold; }}
+        .truncate {{ max-width: 200px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }}
+        .search-box {{ width: 100%; padding: 12px 15px; border: 2px solid #e1e5e9; border-radius: 8px; font-size: 16px; margin-bottom: 20px; }}
+        .filter-section {{ display: flex; gap: 15px; margin-bottom: 20px; flex-wrap: wrap; }}
+        .filter-section select {{ padding: 8px 12px; border: 1px solid #ddd; border-radius: 6px; }}
+        .loading {{ text-align: center; padding: 40px; color: #666; }}
+        .error {{ background: #f8d7da; color: #721c24; padding: 15px; border-radius: 8px; margin-bottom: 20px; }}
+        @media (max-width: 1024px) {{ .dashboard-grid {{ grid-template-columns: 1fr; }} }}
+        @media (max-width: 768px) {{ .container {{ padding: 10px; }} .navigation {{ flex-direction: column; align-items: center; }} .filter-section {{ flex-direction: column; }} .url-table {{ font-size: 14px; }} .url-table th, .url-table td {{ padding: 8px; }} }}
     </style>
 </head>
 <body>
@@ -104,7 +110,7 @@ ADMIN_HTML = """
                     <input type="text" class="search-box" placeholder="🔍 URLを検索..." id="searchBox">
                     <button class="btn btn-primary" onclick="refreshData()">🔄 更新</button>
                 </div>
-                
+                {listing_controls}
                 <div style="overflow-x: auto;">
                     <table class="url-table">
                         <thead>
@@ -126,8 +132,8 @@ ADMIN_HTML = """
             
             <div>
                 <div class="card">
-                    <h2>🕒 最近のクリック</h2>
-                    <div class="recent-activity">
+                    <h2>🕒 最近のクリック <small id="streamStatus" style="color: #999; font-weight: normal;"></small></h2>
+                    <div class="recent-activity" id="recentClicks">
                         {recent_clicks}
                     </div>
                 </div>
@@ -153,68 +159,118 @@ ADMIN_HTML = """
     </div>
 
     <script>
-        function refreshData() { location.reload(); }
+        function refreshData() {{ location.reload(); }}
         
-        async function toggleStatus(shortCode) {
+        async function toggleStatus(shortCode) {{
             if (!confirm(`URL '${{shortCode}}' のステータスを変更しますか？`)) return;
-            try {
-                const response = await fetch(`/admin/url/${{shortCode}}/toggle`, { method: 'POST' });
+            try {{
+                const response = await fetch(`/admin/url/${{shortCode}}/toggle`, {{ method: 'POST' }});
                 const result = await response.json();
-                if (result.success) { alert(result.message); location.reload(); } else { alert('エラー: ' + result.message); }
-            } catch (error) { alert('ネットワークエラーが発生しました'); }
-        }
+                if (result.success) {{ alert(result.message); location.reload(); }} else {{ alert('エラー: ' + result.message); }}
+            }} catch (error) {{ alert('ネットワークエラーが発生しました'); }}
+        }}
         
-        function exportData() { window.open('/api/export/all?format=csv', '_blank'); }
+        function exportData() {{ window.open('/api/export/all?format=csv', '_blank'); }}
         
-        async function showSystemInfo() {
-            try {
+        async function showSystemInfo() {{
+            try {{
                 const response = await fetch('/api/admin/stats');
                 const stats = await response.json();
                 alert(`システム情報:\n\n総URL数: ${{stats.total_links}}\n総クリック数: ${{stats.total_clicks}}\nユニーク訪問者: ${{stats.unique_visitors}}\nシステム状態: ${{stats.system_status}}\n最終更新: ${{new Date(stats.last_updated).toLocaleString()}}`);
-            } catch (error) { alert('システム情報の取得に失敗しました'); }
-        }
+            }} catch (error) {{ alert('システム情報の取得に失敗しました'); }}
+        }}
         
-        async function cleanupData() {
+        async function cleanupData() {{
             if (!confirm('古いデータをクリーンアップしますか？この操作は元に戻せません。')) return;
-            try {
-                const response = await fetch('/admin/cleanup', { method: 'POST' });
+            try {{
+                const response = await fetch('/admin/cleanup', {{ method: 'POST' }});
                 const result = await response.json();
-                if (result.success) { alert(`クリーンアップ完了:\n\n削除したURL: ${{result.deleted_urls}}件\n削除したクリック: ${{result.deleted_clicks}}件`); location.reload(); } else { alert('クリーンアップに失敗しました'); }
-            } catch (error) { alert('ネットワークエラーが発生しました'); }
-        }
-        
-        document.getElementById('searchBox').addEventListener('input', function(e) {
+                if (result.success) {{ alert(`クリーンアップ完了:\n\n削除したURL: ${{result.deleted_urls}}件\n削除したクリック: ${{result.deleted_clicks}}件`); location.reload(); }} else {{ alert('クリーンアップに失敗しました'); }}
+            }} catch (error) {{ alert('ネットワークエラーが発生しました'); }}
+        }}
+        
+        // 最近のクリックをSSEで受け取って先頭に追加（ポーリングしない）
+        function startClickStream() {{
+            if (!window.EventSource) return;
+            const list = document.getElementById('recentClicks');
+            const status = document.getElementById('streamStatus');
+            const source = new EventSource('/api/admin/clicks/stream');
+            source.onopen = () => {{ status.textContent = '● ライブ'; }};
+            source.onerror = () => {{ status.textContent = '再接続中…'; }};
+            source.addEventListener('click', (e) => {{
+                const click = JSON.parse(e.data);
+                const item = document.createElement('div');
+                item.className = 'activity-item';
+                const content = document.createElement('div');
+                content.className = 'activity-content';
+                const code = document.createElement('strong');
+                code.textContent = click.short_code || '';
+                const detail = document.createElement('small');
+                detail.textContent = `${{click.source || ''}} - ${{click.ip_address || ''}}`;
+                content.append(code, document.createElement('br'), detail);
+                const time = document.createElement('div');
+                time.className = 'activity-time';
+                time.textContent = click.clicked_at || '';
+                item.append(content, time);
+                list.prepend(item);
+                while (list.children.length > 20) list.lastElementChild.remove();
+            }});
+            source.addEventListener('gap', (e) => {{
+                const missed = JSON.parse(e.data).missed;
+                status.textContent = missed ? `● ライブ（${{missed}}件を省略）` : '● ライブ';
+            }});
+        }}
+        startClickStream();
+        
+        document.getElementById('searchBox').addEventListener('input', function(e) {{
             const searchTerm = e.target.value.toLowerCase();
             const rows = document.querySelectorAll('#urlTableBody tr');
-            rows.forEach(row => {
+            rows.forEach(row => {{
                 const text = row.textContent.toLowerCase();
                 row.style.display = text.includes(searchTerm) ? '' : 'none';
-            });
-        });
+            }});
+        }});
     </script>
 </body>
 </html>
 """
 
+@heavy_query
+def get_url_page(**filters):
+    """URL一覧の1ページを取得（キーセットページネーション）"""
+    conn = get_db_connection()
+    try:
+        return list_urls(conn, **filters)
+    finally:
+        conn.close()
+
 @router.get("/admin", response_class=HTMLResponse)
-async def admin_dashboard(request: Request):
+async def admin_dashboard(request: Request, sort: str = "created", cursor: Optional[str] = None, limit: int = 20,
+                          campaign: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+                          status: str = "active"):
     """管理ダッシュボードページの表示（インライン版）"""
     try:
+        # 集計はキャッシュから取得（ANALYTICS_UPDATE_INTERVALごとに裏で更新）
         # システム統計を取得
-        system_stats = await get_system_statistics()
+        system_stats = await dashboard_cache.get("system_stats", get_system_statistics)
         
-        # URL一覧を取得
-        urls_data = get_all_urls_stats()
+        # URL一覧は表示するページだけをSQLのLIMITで取得
+        try:
+            page = await get_url_page(sort=sort, cursor=cursor, limit=limit, campaign=campaign,
+                                      start=start, end=end, status=status)
+        except ValueError as e:
+            return HTMLResponse(content=f'<h1>エラー</h1><p>{e}</p><p><a href="/admin">管理画面に戻る</a></p>', status_code=400)
+        urls_data = page["urls"]
         
         # 最近のクリック履歴を取得
-        recent_clicks = await get_recent_clicks(limit=10)
+        recent_clicks = await dashboard_cache.get(("recent_clicks", 10), lambda: get_recent_clicks(limit=10))
         
         # トップパフォーマンスURLを取得
-        top_urls = await get_top_performing_urls(limit=5)
+        top_urls = await dashboard_cache.get(("top_urls", 5), lambda: get_top_performing_urls(limit=5))
         
         # URL一覧のHTMLを生成
         url_rows = ""
-        for url in urls_data[:20]:  # 最初の20件のみ表示
+        for url in urls_data:
             status_text = '<span class="status-active">🟢 有効</span>' if url.get('is_active', 1) else '<span class="status-inactive">🔴 無効</span>'
             url_rows += f"""
             <tr>
@@ -271,7 +327,8 @@ async def admin_dashboard(request: Request):
             qr_clicks=system_stats.get("qr_clicks", 0),
             url_rows=url_rows,
             recent_clicks=recent_clicks_html,
-            top_urls=top_urls_html
+            top_urls=top_urls_html,
+            listing_controls=listing_controls_html("/admin", page)
         )
         
         return HTMLResponse(content=html_content)
@@ -282,31 +339,32 @@ async def admin_dashboard(request: Request):
         return HTMLResponse(content=error_html, status_code=500)
 
 @router.post("/admin/url/{short_code}/toggle")
-async def toggle_url_status(short_code: str):
+@fast_query
+def toggle_url_status(short_code: str):
     """URLの有効/無効を切り替え"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # 現在の状態を取得
-        cursor.execute("SELECT is_active FROM urls WHERE short_code = ?", (short_code,))
-        result = cursor.fetchone()
-        
-        if not result:
-            raise HTTPException(status_code=404, detail="URLが見つかりません")
-        
-        current_status = result[0]
-        new_status = 0 if current_status else 1
-        
-        # ステータスを更新
-        cursor.execute("""
-            UPDATE urls 
-            SET is_active = ?
-            WHERE short_code = ?
-        """, (new_status, short_code))
+        with get_write_connection() as conn:
+            cursor = conn.cursor()
+            
+            # 現在の状態を取得
+            cursor.execute("SELECT is_active FROM urls WHERE short_code = ?", (short_code,))
+            result = cursor.fetchone()
+            
+            if not result:
+                raise HTTPException(status_code=404, detail="URLが見つかりません")
+            
+            current_status = result[0]
+            new_status = 0 if current_status else 1
+            
+            # ステータスを更新
+            cursor.execute("""
+                UPDATE urls 
+                SET is_active = ?
+                WHERE short_code = ?
+            """, (new_status, short_code))
         
-        conn.commit()
-        conn.close()
+        invalidate_url(short_code)
+        dashboard_cache.invalidate()
         
         status_text = "有効" if new_status else "無効"
         
@@ -319,47 +377,43 @@ async def toggle_url_status(short_code: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"ステータス変更でエラーが発生しました: {str(e)}")
 
-async def get_system_statistics():
+@heavy_query
+def get_system_statistics():
     """システム全体の統計を取得"""
+    # 例外はdashboard_cacheに伝え、前回の値を保ったままrefresh_errorsに数えさせる
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
         cursor = conn.cursor()
         
-        # 基本統計
+        # 基本統計（urlsのカウンタ列から、ユニーク訪問者は集計テーブルの全URL合計の行）
         cursor.execute("""
             SELECT 
-                COUNT(DISTINCT u.id) as total_links,
-                COUNT(c.id) as total_clicks,
-                COUNT(DISTINCT c.ip_address) as unique_visitors,
-                COUNT(CASE WHEN c.source = 'qr_code' THEN 1 END) as qr_clicks
+                COUNT(u.id) as total_links,
+                COALESCE(SUM(u.total_clicks), 0) as total_clicks,
+                COALESCE((SELECT unique_visitors FROM click_rollup_totals
+                          WHERE url_id = 0 AND source = ''), 0) as unique_visitors,
+                COALESCE(SUM(u.qr_clicks), 0) as qr_clicks
             FROM urls u
-            LEFT JOIN clicks c ON u.id = c.url_id
             WHERE u.is_active = 1
         """)
         
         basic_stats = dict(cursor.fetchone())
-        conn.close()
         
         return {
             **basic_stats,
+            "unique_visitors_exact": True,
             "system_status": "正常稼働中",
             "last_updated": datetime.now().isoformat()
         }
-        
-    except Exception as e:
-        print(f"システム統計取得エラー: {e}")
-        return {
-            "total_links": 0,
-            "total_clicks": 0,
-            "unique_visitors": 0,
-            "qr_clicks": 0,
-            "system_status": "エラー"
-        }
+    finally:
+        conn.close()
 
-async def get_recent_clicks(limit: int = 20):
+@heavy_query
+def get_recent_clicks(limit: int = 20):
     """最近のクリック履歴を取得"""
+    # 例外はdashboard_cacheに伝え、前回の値を保ったままrefresh_errorsに数えさせる
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
         cursor = conn.cursor()
         
         cursor.execute("""
@@ -372,85 +426,190 @@ async def get_recent_clicks(limit: int = 20):
                 c.referrer
             FROM clicks c
             JOIN urls u ON c.url_id = u.id
-            ORDER BY c.clicked_at DESC
+            ORDER BY c.id DESC
             LIMIT ?
         """, (limit,))
         
         clicks = [dict(row) for row in cursor.fetchall()]
-        conn.close()
         
         return clicks
-        
-    except Exception as e:
-        print(f"最近のクリック取得エラー: {e}")
-        return []
+    finally:
+        conn.close()
 
-async def get_top_performing_urls(limit: int = 10):
+@heavy_query
+def get_top_performing_urls(limit: int = 10):
     """トップパフォーマンスURLを取得"""
+    # 例外はdashboard_cacheに伝え、前回の値を保ったままrefresh_errorsに数えさせる
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
         cursor = conn.cursor()
         
+        # total_clicksのインデックスを降順に走査するため、集計せずに上位N件だけを読む
         cursor.execute("""
             SELECT 
                 u.short_code,
                 u.original_url,
                 u.custom_name,
                 u.campaign_name,
-                COUNT(c.id) as total_clicks,
-                COUNT(DISTINCT c.ip_address) as unique_visitors,
-                MAX(c.clicked_at) as last_clicked
+                u.total_clicks,
+                COALESCE(t.unique_visitors, 0) as unique_visitors,
+                u.last_clicked_at as last_clicked
             FROM urls u
-            LEFT JOIN clicks c ON u.id = c.url_id
-            WHERE u.is_active = 1
-            GROUP BY u.id
-            HAVING COUNT(c.id) > 0
-            ORDER BY total_clicks DESC
+            LEFT JOIN click_rollup_totals t ON t.url_id = u.id AND t.source = ''
+            WHERE u.total_clicks > 0 AND u.is_active = 1
+            ORDER BY u.total_clicks DESC
             LIMIT ?
         """, (limit,))
         
         top_urls = [dict(row) for row in cursor.fetchall()]
-        conn.close()
         
         return top_urls
-        
-    except Exception as e:
-        print(f"トップURL取得エラー: {e}")
-        return []
+    finally:
+        conn.close()
 
 @router.get("/api/admin/stats")
 async def get_admin_stats():
     """管理用統計データAPI"""
     try:
-        stats = await get_system_statistics()
+        stats = await dashboard_cache.get("system_stats", get_system_statistics)
         return JSONResponse(stats)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"統計データの取得でエラーが発生しました: {str(e)}")
 
+@router.get("/api/admin/urls")
+async def get_admin_urls(sort: str = "created", cursor: Optional[str] = None, limit: int = 50,
+                         campaign: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+                         status: str = "active"):
+    """URL一覧API（sort=created/clicks、next_cursorを次のリクエストのcursorに指定してページ送り）"""
+    try:
+        page = await get_url_page(sort=sort, cursor=cursor, limit=limit, campaign=campaign,
+                                  start=start, end=end, status=status)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(page)
+
+@router.get("/api/admin/clicks/stream")
+async def stream_clicks(request: Request, short_code: Optional[str] = None, campaign: Optional[str] = None,
+                        backlog: int = 0, last_event_id: Optional[str] = None):
+    """クリックのライブ配信（Server-Sent Events）
+
+    short_code・campaignで絞り込み、backlogで直近の件数を最初に送る。再接続時は
+    Last-Event-IDヘッダ（またはlast_event_id）の次から再開する。
+    """
+    last_event_id = request.headers.get("last-event-id") or last_event_id
+
+    events = click_stream.subscribe(short_code=short_code, campaign=campaign,
+                                    last_event_id=last_event_id, backlog=backlog)
+    try:
+        # 接続数の上限はここで判定する（retry行を先に取り出す）
+        first = await events.__anext__()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Last-Event-IDが不正です")
+    except OverflowError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    async def body():
+        try:
+            yield first
+            async for chunk in events:
+                yield chunk
+        finally:
+            # 切断時に購読を解除
+            await events.aclose()
+
+    return StreamingResponse(body(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+@router.get("/api/admin/click-stream")
+async def get_click_stream_stats():
+    """クリックのライブ配信の統計API（接続数・取りこぼし件数など）"""
+    return JSONResponse(click_stream.stats())
+
+@router.get("/api/admin/cache")
+async def get_cache_stats():
+    """短縮コードキャッシュの統計API"""
+    return JSONResponse(short_code_cache.stats())
+
+@router.get("/api/admin/dashboard-cache")
+async def get_dashboard_cache_stats():
+    """管理ダッシュボード集計キャッシュの統計API"""
+    return JSONResponse(dashboard_cache.stats())
+
+@router.get("/api/admin/short-code-filter")
+async def get_short_code_filter_stats():
+    """短縮コードフィルタの統計API（偽陽性率など）"""
+    return JSONResponse(short_code_filter.stats())
+
+@router.post("/api/admin/short-code-filter/rebuild")
+@heavy_query
+def rebuild_short_code_filter():
+    """短縮コードフィルタをurlsテーブルから再構築"""
+    try:
+        return JSONResponse(short_code_filter.rebuild())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"フィルタの再構築でエラーが発生しました: {str(e)}")
+
+@router.get("/api/admin/click-rollup")
+async def get_click_rollup_stats():
+    """クリック集計の統計API（未集計のクリック数など）"""
+    return JSONResponse(click_rollup.stats())
+
+@router.get("/api/admin/columnar")
+async def get_columnar_stats():
+    """列指向の分析エンジンの統計API（読み込み済みクリック数・メモリ使用量など）"""
+    return JSONResponse(click_columns.stats())
+
+@router.post("/api/admin/click-rollup/rebuild")
+@heavy_query
+def rebuild_click_rollup():
+    """クリック集計をclicksテーブルから再構築"""
+    try:
+        return JSONResponse(click_rollup.rebuild())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"集計の再構築でエラーが発生しました: {str(e)}")
+
+@router.post("/api/admin/url-counters/reconcile")
+@heavy_query
+def reconcile_url_counters():
+    """urlsのクリック数カウンタをclicksテーブルから数え直して修正"""
+    try:
+        return JSONResponse(click_rollup.reconcile_url_counters())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"カウンタの修正でエラーが発生しました: {str(e)}")
+
 @router.post("/admin/cleanup")
-async def cleanup_old_data():
+@heavy_query
+def cleanup_old_data():
     """古いデータのクリーンアップ"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # 30日以上前の無効URLを削除
-        cursor.execute("""
-            DELETE FROM urls 
-            WHERE is_active = 0 
-            AND DATE(created_at) < DATE('now', '-30 days')
-        """)
-        deleted_urls = cursor.rowcount
-        
-        # 孤立したクリックデータを削除
-        cursor.execute("""
-            DELETE FROM clicks 
-            WHERE url_id NOT IN (SELECT id FROM urls)
-        """)
-        deleted_clicks = cursor.rowcount
-        
-        conn.commit()
-        conn.close()
+        with get_write_connection() as conn:
+            cursor = conn.cursor()
+            
+            # 30日以上前の無効URLを削除
+            cursor.execute("""
+                DELETE FROM urls 
+                WHERE is_active = 0 
+                AND DATE(created_at) < DATE('now', '-30 days')
+            """)
+            deleted_urls = cursor.rowcount
+            
+            # 孤立したクリックデータを削除
+            cursor.execute("""
+                DELETE FROM clicks 
+                WHERE url_id NOT IN (SELECT id FROM urls)
+            """)
+            deleted_clicks = cursor.rowcount
+        
+        if deleted_urls:
+            short_code_cache.clear()
+        dashboard_cache.invalidate()
+        
+        # 削除したクリックを集計から除くため作り直す
+        if deleted_clicks:
+            click_rollup.rebuild()
+            click_columns.reset()
         
         return JSONResponse({
             "success": True,
@@ -8,6 +8,10 @@ from typing import List, Dict, Any
 # 絶対インポートに変更
 import config
 from utils import get_db_connection, get_url_info, format_datetime
+from database import click_rollup, click_columns
+from rollup import ALL_URLS
+from db_executor import heavy_query
+from routes.redirect import trending
 
 router = APIRouter()
 
@@ -115,7 +119,8 @@ ANALYTICS_HTML = """<!DOCTYPE html>
 </html>"""
 
 @router.get("/analytics/{short_code}")
-async def analytics_page(short_code: str):
+@heavy_query
+def analytics_page(short_code: str):
     """分析画面"""
     try:
         conn = get_db_connection()
@@ -133,14 +138,15 @@ async def analytics_page(short_code: str):
         
         original_url, created_at, custom_name, campaign_name = result
         
-        # 統計情報取得
+        # 統計情報取得（集計テーブルから）
         cursor.execute('''
             SELECT 
-                COUNT(*) as total_clicks,
-                COUNT(DISTINCT ip_address) as unique_clicks,
-                COUNT(CASE WHEN source = 'qr_code' THEN 1 END) as qr_clicks
-            FROM clicks 
-            WHERE url_id = (SELECT id FROM urls WHERE short_code = ?)
+                u.total_clicks as total_clicks,
+                COALESCE(t.unique_visitors, 0) as unique_clicks,
+                u.qr_clicks as qr_clicks
+            FROM urls u
+            LEFT JOIN click_rollup_totals t ON t.url_id = u.id AND t.source = ''
+            WHERE u.short_code = ?
         ''', (short_code,))
         
         stats = cursor.fetchone()
@@ -181,6 +187,7 @@ async def get_analytics_api(short_code: str):
             "short_code": short_code,
             "total_clicks": analytics_data["total_clicks"],
             "unique_visitors": analytics_data["unique_visitors"],
+            "unique_visitors_exact": True,
             "qr_clicks": analytics_data["qr_clicks"],
             "click_data": analytics_data["recent_clicks"]
         })
@@ -190,7 +197,119 @@ async def get_analytics_api(short_code: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"分析データの取得でエラーが発生しました: {str(e)}")
 
-async def get_analytics_data(short_code: str) -> Dict[str, Any]:
+def _filter_values(value):
+    # カンマ区切りで複数指定できる条件
+    return [item for item in value.split(",") if item] if value else None
+
+@router.get("/api/clicks/query")
+@heavy_query
+def query_clicks(group_by: str = None, short_code: str = None, campaign: str = None, source: str = None,
+                 device: str = None, browser: str = None, start: str = None, end: str = None, limit: int = 100):
+    """クリックの絞り込み・集計API（列指向エンジン。条件はカンマ区切りで複数指定可、start/endはUTCの日付）"""
+    if not click_columns.enabled:
+        raise HTTPException(status_code=503, detail="NumPyがインストールされていないため利用できません")
+    
+    url_id = None
+    if short_code:
+        conn = get_db_connection()
+        try:
+            row = conn.execute("SELECT id FROM urls WHERE short_code = ?", (short_code,)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            raise HTTPException(status_code=404, detail="短縮URLが見つかりません")
+        url_id = row[0]
+    
+    try:
+        result = click_columns.query(
+            group_by=group_by, url_id=url_id, campaign=_filter_values(campaign), source=_filter_values(source),
+            device=_filter_values(device), browser=_filter_values(browser), start=start, end=end,
+            limit=max(1, min(limit, 1000))
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return JSONResponse({"short_code": short_code, **result})
+
+@router.get("/api/heatmap")
+@heavy_query
+def get_heatmap(short_code: str = None, tz: str = "UTC"):
+    """曜日×時間帯のヒートマップAPI（tz=UTC/JST、short_code省略時は全リンク）"""
+    conn = get_db_connection()
+    try:
+        url_id = ALL_URLS
+        if short_code:
+            row = conn.execute("SELECT id FROM urls WHERE short_code = ?", (short_code,)).fetchone()
+            if not row:
+                raise HTTPException(status_code=404, detail="短縮URLが見つかりません")
+            url_id = row[0]
+        
+        result = click_rollup.heatmap(conn, url_id=url_id, timezone=tz)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="tzはUTCまたはJSTを指定してください")
+    finally:
+        conn.close()
+    
+    return JSONResponse({"short_code": short_code, **result})
+
+@router.get("/api/trending")
+async def get_trending(window: str = "1h", by: str = "url", limit: int = 10):
+    """直近のクリック数上位API（window=5m/1h/24h、by=url/campaign。SQLiteを使わない近似値）"""
+    try:
+        result = trending.top(window=window, dimension=by, limit=max(1, min(limit, 100)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(result)
+
+@router.get("/api/unique-visitors")
+@heavy_query
+def get_unique_visitors(short_code: str = None, campaign: str = None, start: str = None, end: str = None):
+    """ユニーク訪問者数API（期間・キャンペーン指定時はHyperLogLogの近似値、exactで区別）"""
+    if short_code and campaign:
+        raise HTTPException(status_code=400, detail="short_codeとcampaignは同時に指定できません")
+    
+    conn = get_db_connection()
+    try:
+        url_id = ALL_URLS
+        if short_code:
+            row = conn.execute("SELECT id FROM urls WHERE short_code = ?", (short_code,)).fetchone()
+            if not row:
+                raise HTTPException(status_code=404, detail="短縮URLが見つかりません")
+            url_id = row[0]
+        
+        result = click_rollup.unique_visitors(conn, url_id=url_id, campaign_name=campaign, start=start, end=end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="日付はYYYY-MM-DD形式で指定してください")
+    finally:
+        conn.close()
+    
+    return JSONResponse({
+        "short_code": short_code,
+        "campaign": campaign,
+        "start": start,
+        "end": end,
+        **result
+    })
+
+@router.get("/api/analytics/campaign/{campaign_name}")
+@heavy_query
+def get_campaign_analytics(campaign_name: str, days: int = 30):
+    """キャンペーン分析API（キャンペーン集計から作成するためリンク数が多くてもclicksを走査しない）"""
+    conn = get_db_connection()
+    try:
+        report = click_rollup.campaign_report(conn, campaign_name, days=max(1, min(days, 365)))
+    finally:
+        conn.close()
+    
+    if report is None:
+        raise HTTPException(status_code=404, detail="キャンペーンが見つかりません")
+    
+    for url in report["urls"]:
+        url["analytics_url"] = f"{config.BASE_URL}/analytics/{url['short_code']}"
+    return JSONResponse(report)
+
+@heavy_query
+def get_analytics_data(short_code: str) -> Dict[str, Any]:
     """指定した短縮コードの詳細な分析データを取得"""
     try:
         conn = get_db_connection()
@@ -204,37 +323,40 @@ async def get_analytics_data(short_code: str) -> Dict[str, Any]:
         
         url_id = url_result[0]
         
-        # 基本統計
+        # 基本統計（集計テーブルから）
         cursor.execute("""
             SELECT 
-                COUNT(*) as total_clicks,
-                COUNT(DISTINCT ip_address) as unique_visitors,
-                COUNT(CASE WHEN source = 'qr_code' THEN 1 END) as qr_clicks,
-                MIN(clicked_at) as first_clicked,
-                MAX(clicked_at) as last_clicked
-            FROM clicks 
-            WHERE url_id = ?
+                clicks as total_clicks,
+                unique_visitors,
+                qr_clicks,
+                first_clicked_at as first_clicked,
+                last_clicked_at as last_clicked
+            FROM click_rollup_totals 
+            WHERE url_id = ? AND source = ''
         """, (url_id,))
         
-        basic_stats = dict(cursor.fetchone())
+        row = cursor.fetchone()
+        basic_stats = dict(row) if row else {
+            "total_clicks": 0, "unique_visitors": 0, "qr_clicks": 0,
+            "first_clicked": None, "last_clicked": None
+        }
         
         # ソース別統計
         cursor.execute("""
-            SELECT source, COUNT(*) as count, COUNT(DISTINCT ip_address) as unique_count
-            FROM clicks 
-            WHERE url_id = ?
-            GROUP BY source
+            SELECT source, clicks as count, unique_visitors as unique_count
+            FROM click_rollup_totals 
+            WHERE url_id = ? AND source != ''
             ORDER BY count DESC
         """, (url_id,))
         
         source_stats = [dict(row) for row in cursor.fetchall()]
         
-        # 最近のクリック詳細（最新20件）
+        # 最近のクリック詳細（最新20件、idの降順ならインデックスだけで取得できる）
         cursor.execute("""
             SELECT id, ip_address, user_agent, referrer, source, clicked_at
             FROM clicks 
             WHERE url_id = ?
-            ORDER BY clicked_at DESC
+            ORDER BY id DESC
             LIMIT 20
         """, (url_id,))
         
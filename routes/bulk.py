@@ -1,6 +1,6 @@
 # routes/bulk.py
 from fastapi import APIRouter, HTTPException, File, UploadFile, Form
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
 import sqlite3
 import json
 import csv
@@ -10,7 +10,13 @@ from typing import List, Dict, Any
 
 # 絶対インポートに変更
 import config
-from utils import get_db_connection, generate_short_code, validate_url, clean_url
+from utils import get_db_connection, get_write_connection, generate_short_code, validate_url, clean_url
+from db_executor import fast_query, heavy_query
+from cache import invalidate_url
+from bloom import short_code_filter
+from bulk_create import insert_urls
+from bulk_import import BulkImporter
+from short_codes import get_allocator
 
 router = APIRouter()
 
@@ -361,101 +367,157 @@ async def bulk_generation_page():
     return HTMLResponse(content=BULK_HTML)
 
 @router.post("/api/bulk")
-async def bulk_generate_urls(request: dict):
-    """複数URLを一括生成（response_model完全除去版）"""
-    results = []
-    success_count = 0
-    failed_count = 0
+@heavy_query
+def bulk_generate_urls(request: dict):
+    """複数URLを一括生成（全行を検証してから1トランザクション・1回のexecutemanyで挿入）
+
+    "background": trueならジョブとして受け付けて即座に返す（進捗は/api/bulk/jobs/{job_id}）。
+    """
+    items = request.get("urls", [])
+    if request.get("background"):
+        job = bulk_importer.submit_records(
+            {"original_url": item.get("url"), "custom_name": item.get("custom_name")} for item in items
+        )
+        return JSONResponse(job, status_code=202)
+    results = [None] * len(items)
+    rows = []
+    row_indexes = []
     
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    # 先に全行を検証し、有効な行だけをまとめて挿入する
+    created_at = datetime.now().isoformat()
+    for index, item in enumerate(items):
+        original_url = (item.get("url") or "").strip()
+        custom_name = (item.get("custom_name") or "").strip() or None
         
-        for item in request.get("urls", []):
-            try:
-                original_url = item.get("url", "").strip()
-                custom_name = item.get("custom_name", "").strip() or None
-                
-                if not original_url:
-                    continue
-                
-                if not validate_url(original_url):
-                    results.append({
-                        "original_url": original_url,
-                        "short_code": "",
-                        "short_url": "",
-                        "custom_name": custom_name,
-                        "success": False,
-                        "error_message": "無効なURLです"
-                    })
-                    failed_count += 1
-                    continue
-                
-                # 短縮コード生成
-                short_code = await generate_unique_short_code_bulk(cursor)
-                
-                # データベースに保存
-                cursor.execute("""
-                    INSERT INTO urls (short_code, original_url, custom_name, created_at)
-                    VALUES (?, ?, ?, ?)
-                """, (
-                    short_code,
-                    clean_url(original_url),
-                    custom_name,
-                    datetime.now().isoformat()
-                ))
-                
-                results.append({
-                    "original_url": original_url,
-                    "short_code": short_code,
-                    "short_url": f"{config.BASE_URL}/{short_code}",
-                    "custom_name": custom_name,
-                    "success": True,
-                    "error_message": None
-                })
-                success_count += 1
-                
-            except Exception as item_error:
-                results.append({
-                    "original_url": item.get("url", ""),
-                    "short_code": "",
-                    "short_url": "",
-                    "custom_name": item.get("custom_name"),
-                    "success": False,
-                    "error_message": str(item_error)
-                })
-                failed_count += 1
+        if not original_url:
+            continue
         
-        conn.commit()
-        conn.close()
+        if not validate_url(original_url):
+            results[index] = {
+                "original_url": original_url,
+                "short_code": "",
+                "short_url": "",
+                "custom_name": custom_name,
+                "success": False,
+                "error_message": "無効なURLです"
+            }
+            continue
         
-        return JSONResponse({
-            "success_count": success_count,
-            "failed_count": failed_count,
-            "total_count": len(request.get("urls", [])),
-            "results": results
+        rows.append({
+            "original_url": clean_url(original_url),
+            "custom_name": custom_name,
+            "created_at": created_at
         })
-        
+        row_indexes.append((index, original_url, custom_name))
+    
+    try:
+        with get_write_connection() as conn:
+            inserted = insert_urls(conn, rows, get_allocator(config.DB_PATH))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"一括処理でエラーが発生しました: {str(e)}")
-
-async def generate_unique_short_code_bulk(cursor, length=6):
-    """バルク処理用の重複しない短縮コードを生成"""
-    import string
-    import random
-    
-    chars = string.ascii_letters + string.digits
-    max_attempts = 50
     
-    for _ in range(max_attempts):
-        code = ''.join(random.choices(chars, k=length))
-        
-        # データベースで重複チェック
-        cursor.execute("SELECT 1 FROM urls WHERE short_code = ?", (code,))
-        exists = cursor.fetchone()
-        
-        if not exists:
-            return code
+    for (index, original_url, custom_name), (short_code, error) in zip(row_indexes, inserted):
+        invalidate_url(short_code)
+        short_code_filter.add(short_code)
+        results[index] = {
+            "original_url": original_url,
+            "short_code": short_code,
+            "short_url": f"{config.BASE_URL}/{short_code}",
+            "custom_name": custom_name,
+            "success": True,
+            "error_message": None
+        }
     
-    raise HTTPException(status_code=500, detail="短縮コードの生成に失敗しました")
+    results = [result for result in results if result is not None]
+    success_count = sum(1 for result in results if result["success"])
+    return JSONResponse({
+        "success_count": success_count,
+        "failed_count": len(results) - success_count,
+        "total_count": len(items),
+        "results": results
+    })
+
+def _build_import_row(record: Dict[str, Any]) -> Dict[str, Any]:
+    """取り込みファイルの1行をurlsの行に変換（不正なURLはValueError）"""
+    original_url = record["original_url"]
+    if not original_url or not validate_url(original_url):
+        raise ValueError("無効なURLです")
+    return {
+        "original_url": clean_url(original_url),
+        "custom_name": record["custom_name"],
+        "campaign_name": record["campaign_name"],
+        "created_at": datetime.now().isoformat()
+    }
+
+def _on_imported(short_codes: List[str]) -> None:
+    for short_code in short_codes:
+        invalidate_url(short_code)
+        short_code_filter.add(short_code)
+
+bulk_importer = BulkImporter(config.DB_PATH, config.BASE_URL, _build_import_row, _on_imported)
+
+# ワーカーはinit_dbの後にアプリのlifespanでbulk_importer.start()/stop()する（backend/main.pyと同様）。
+# 読み込んだだけではjobsテーブルを取りに行かない
+@router.post("/api/bulk/upload", status_code=202)
+@heavy_query
+def bulk_upload(file: UploadFile = File(...), delimiter: str = Form(None)):
+    """CSV/TSVファイルから一括生成（ジョブを受け付けて即座に返し、取り込みはバックグラウンドで行う）
+
+    列はurl, custom_name, campaign_nameの順（見出し行があれば列名で判定）。
+    進捗は/api/bulk/jobs/{job_id}、行ごとの結果は/api/bulk/jobs/{job_id}/resultで取得する。
+    """
+    try:
+        job = bulk_importer.submit(file.file, file.filename, delimiter)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(job, status_code=202)
+
+@router.get("/api/bulk/jobs")
+@fast_query
+def list_bulk_jobs(status: str = None, limit: int = 20):
+    """一括生成ジョブの一覧（新しい順）"""
+    try:
+        return {"jobs": bulk_importer.list_jobs(status, limit)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/api/bulk/jobs/{job_id}")
+@fast_query
+def get_bulk_job(job_id: str):
+    """一括生成ジョブの進捗（処理済み・失敗件数、残り時間の見込み）"""
+    job = bulk_importer.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    return job
+
+@router.post("/api/bulk/jobs/{job_id}/cancel")
+@fast_query
+def cancel_bulk_job(job_id: str):
+    """一括生成ジョブをキャンセル（作成済みのリンクは残る）"""
+    job = bulk_importer.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    return job
+
+@router.post("/api/bulk/jobs/{job_id}/retry", status_code=202)
+@heavy_query
+def retry_bulk_job(job_id: str):
+    """失敗・キャンセルしたジョブは続きから再開し、完了したジョブは失敗行だけを新しいジョブにする"""
+    try:
+        job = bulk_importer.retry(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    return JSONResponse(job, status_code=202)
 
+@router.get("/api/bulk/jobs/{job_id}/result")
+@fast_query
+def get_bulk_job_result(job_id: str):
+    """一括生成ジョブの結果CSV（行番号・短縮URL・エラー）"""
+    if bulk_importer.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    path = bulk_importer.result_path(job_id)
+    if path is None:
+        raise HTTPException(status_code=409, detail="ジョブがまだ終了していません")
+    return FileResponse(path, media_type="text/csv; charset=utf-8", filename=f"bulk_result_{job_id}.csv")
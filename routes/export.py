@@ -4,12 +4,14 @@ import sqlite3
 import json
 import csv
 import io
+from collections import Counter
 from datetime import datetime
 from typing import List, Optional
 
 # 絶対インポートに変更（pydantic完全除去）
 import config
 from utils import get_db_connection, export_to_csv_format
+from db_executor import heavy_query
 
 router = APIRouter()
 
@@ -60,7 +62,8 @@ async def export_data(request: dict):
         raise HTTPException(status_code=500, detail=f"エクスポート処理でエラーが発生しました: {str(e)}")
 
 @router.get("/api/export/all")
-async def export_all_data(
+@heavy_query
+def export_all_data(
     format: str = Query("json", description="エクスポート形式 (json, csv)"),
     campaign: Optional[str] = Query(None, description="特定のキャンペーンのみエクスポート"),
     start_date: Optional[str] = Query(None, description="開始日 (YYYY-MM-DD)"),
@@ -80,12 +83,12 @@ async def export_all_data(
                 u.custom_name,
                 u.campaign_name,
                 u.created_at,
-                COUNT(c.id) as total_clicks,
-                COUNT(DISTINCT c.ip_address) as unique_visitors,
-                COUNT(CASE WHEN c.source = 'qr_code' THEN 1 END) as qr_clicks,
-                MAX(c.clicked_at) as last_clicked
+                u.total_clicks as total_clicks,
+                COALESCE(t.unique_visitors, 0) as unique_visitors,
+                u.qr_clicks as qr_clicks,
+                u.last_clicked_at as last_clicked
             FROM urls u
-            LEFT JOIN clicks c ON u.id = c.url_id
+            LEFT JOIN click_rollup_totals t ON t.url_id = u.id AND t.source = ''
             WHERE u.is_active = 1
         """
         
@@ -108,7 +111,7 @@ async def export_all_data(
         if conditions:
             base_query += " AND " + " AND ".join(conditions)
         
-        base_query += " GROUP BY u.id ORDER BY u.created_at DESC"
+        base_query += " ORDER BY u.created_at DESC"
         
         cursor.execute(base_query, params)
         urls_data = [dict(row) for row in cursor.fetchall()]
@@ -174,7 +177,8 @@ async def export_all_data(
         raise HTTPException(status_code=500, detail=f"全データエクスポートでエラーが発生しました: {str(e)}")
 
 @router.get("/api/export/analytics/{short_code}")
-async def export_analytics_data(
+@heavy_query
+def export_analytics_data(
     short_code: str,
     format: str = Query("json", description="エクスポート形式 (json, csv)"),
     period: str = Query("all", description="期間 (7d, 30d, all)")
@@ -217,32 +221,21 @@ async def export_analytics_data(
         
         clicks_data = [dict(row) for row in cursor.fetchall()]
         
-        # 統計データを取得
-        cursor.execute(f"""
-            SELECT 
-                COUNT(*) as total_clicks,
-                COUNT(DISTINCT ip_address) as unique_visitors,
-                COUNT(CASE WHEN source = 'qr_code' THEN 1 END) as qr_clicks,
-                MIN(clicked_at) as first_click,
-                MAX(clicked_at) as last_click
-            FROM clicks 
-            WHERE url_id = ? {date_filter}
-        """, (url_id,))
+        conn.close()
         
-        stats = dict(cursor.fetchone())
+        # 統計データ（取得済みのクリック行から集計し、clicksを再走査しない）
+        click_times = [click["clicked_at"] for click in clicks_data]
+        stats = {
+            "total_clicks": len(clicks_data),
+            "unique_visitors": len({click["ip_address"] for click in clicks_data if click["ip_address"] is not None}),
+            "qr_clicks": sum(1 for click in clicks_data if click["source"] == "qr"),
+            "first_click": min(click_times) if click_times else None,
+            "last_click": max(click_times) if click_times else None
+        }
         
         # ソース別統計
-        cursor.execute(f"""
-            SELECT source, COUNT(*) as count
-            FROM clicks 
-            WHERE url_id = ? {date_filter}
-            GROUP BY source
-            ORDER BY count DESC
-        """, (url_id,))
-        
-        source_stats = [dict(row) for row in cursor.fetchall()]
-        
-        conn.close()
+        source_counts = Counter(click["source"] for click in clicks_data)
+        source_stats = [{"source": source, "count": count} for source, count in source_counts.most_common()]
         
         analytics_data = {
             "url_info": dict(url_info),
@@ -276,7 +269,8 @@ async def export_analytics_data(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"分析データエクスポートでエラーが発生しました: {str(e)}")
 
-async def get_export_data(short_codes: List[str]):
+@heavy_query
+def get_export_data(short_codes: List[str]):
     """指定した短縮コードのデータを取得"""
     try:
         conn = get_db_connection()
@@ -292,14 +286,13 @@ async def get_export_data(short_codes: List[str]):
                 u.custom_name,
                 u.campaign_name,
                 u.created_at,
-                COUNT(c.id) as total_clicks,
-                COUNT(DISTINCT c.ip_address) as unique_visitors,
-                COUNT(CASE WHEN c.source = 'qr_code' THEN 1 END) as qr_clicks,
-                MAX(c.clicked_at) as last_clicked
+                u.total_clicks as total_clicks,
+                COALESCE(t.unique_visitors, 0) as unique_visitors,
+                u.qr_clicks as qr_clicks,
+                u.last_clicked_at as last_clicked
             FROM urls u
-            LEFT JOIN clicks c ON u.id = c.url_id
+            LEFT JOIN click_rollup_totals t ON t.url_id = u.id AND t.source = ''
             WHERE u.short_code IN ({placeholders}) AND u.is_active = 1
-            GROUP BY u.id
             ORDER BY u.created_at DESC
         """, short_codes)
         
@@ -326,7 +319,8 @@ async def get_export_formats():
     })
 
 @router.get("/api/export/campaigns")
-async def get_exportable_campaigns():
+@heavy_query
+def get_exportable_campaigns():
     """エクスポート可能なキャンペーン一覧"""
     try:
         conn = get_db_connection()
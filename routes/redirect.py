@@ -2,50 +2,71 @@ from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import RedirectResponse
 import sqlite3
 from datetime import datetime
-from urllib.parse import urlparse
 import re
+from typing import Optional
 
 # 絶対インポートに変更
 import config
 from utils import get_db_connection
+from db_executor import run_fast
+from cache import get_cached_url, cache_url
+from bloom import short_code_filter
+from click_queue import ClickIngestQueue
+from click_stream import ClickStream
+from trending import TrendingTracker
+from database import click_rollup
+from referrer_classifier import detailed_classifier
 
 router = APIRouter()
 
+# クリック記録キュー（リダイレクト応答とは切り離してまとめて書き込む）
+click_queue = ClickIngestQueue(config.DB_PATH, columns=(
+    "url_id", "ip_address", "user_agent", "referrer", "source", "clicked_at"
+))
+
+# クリックの書き込みと同じトランザクションで集計テーブルを更新
+click_queue.add_listener(click_rollup.apply)
+
+# コミット済みのクリックをライブ配信（管理画面のSSE）へ流す
+click_stream = ClickStream(config.DB_PATH)
+click_queue.add_commit_listener(click_stream.publish)
+
+# トレンド（直近5分・1時間・24時間のクリック上位）をSQLiteを介さずに集計
+trending = TrendingTracker(config.DB_PATH, resolve_urls=click_stream.lookup_urls)
+click_queue.add_commit_listener(trending.record)
+
 @router.get("/{short_code}")
-async def redirect_url(short_code: str, request: Request):
-    """短縮URLのリダイレクト処理"""
+async def redirect_url(short_code: str, request: Request, source: Optional[str] = None):
+    """短縮URLのリダイレクト処理（?source=qrでQRコード経由として記録）"""
     try:
         # 短縮コードのバリデーション
         if not validate_short_code(short_code):
             raise HTTPException(status_code=404, detail="無効な短縮コードです")
         
-        # データベースから元のURLを取得
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT id, original_url, is_active 
-            FROM urls 
-            WHERE short_code = ?
-        """, (short_code,))
-        
-        result = cursor.fetchone()
-        
-        if not result:
-            conn.close()
-            raise HTTPException(status_code=404, detail="短縮URLが見つかりません")
-        
-        url_id, original_url, is_active = result
+        # キャッシュを優先し、未登録の場合のみデータベースから元のURLを取得
+        cached = get_cached_url(short_code)
+        
+        if cached is None:
+            # 存在しないコードはDBに問い合わせずに404
+            if not short_code_filter.might_exist(short_code):
+                raise HTTPException(status_code=404, detail="短縮URLが見つかりません")
+            
+            # イベントループを止めないようfastプールで検索
+            result = await run_fast(lookup_short_code, short_code)
+            
+            if not result:
+                short_code_filter.record_false_positive()
+                raise HTTPException(status_code=404, detail="短縮URLが見つかりません")
+            
+            cached = cache_url(short_code, result[0], result[1], result[2])
+        
+        url_id, original_url, is_active = cached
         
         if not is_active:
-            conn.close()
             raise HTTPException(status_code=410, detail="この短縮URLは無効になっています")
         
         # クリック情報を記録
-        await record_click(cursor, url_id, request)
-        
-        conn.commit()
-        conn.close()
+        await record_click(url_id, request, source)
         
         # リダイレクト実行
         return RedirectResponse(
@@ -58,29 +79,42 @@ async def redirect_url(short_code: str, request: Request):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"リダイレクト処理でエラーが発生しました: {str(e)}")
 
-async def record_click(cursor, url_id: int, request: Request):
-    """クリック情報をデータベースに記録"""
+def lookup_short_code(short_code: str):
+    """短縮コードから(id, original_url, is_active)を取得"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+        SELECT id, original_url, is_active 
+        FROM urls 
+        WHERE short_code = ?
+    """, (short_code,))
+    
+    result = cursor.fetchone()
+    conn.close()
+    return result
+
+async def record_click(url_id: int, request: Request, source: Optional[str] = None):
+    """クリック情報を記録キューに追加（QRコード経由はsource="qr"で1回の書き込みで記録）"""
     try:
         # リクエスト情報を取得
         client_ip = get_client_ip(request)
         user_agent = request.headers.get("user-agent", "")
         referrer = request.headers.get("referer", "")
         
-        # トラフィック元の判定
-        source = determine_traffic_source(referrer, user_agent)
+        # トラフィック元の判定（QRコード経由の指定がなければリファラーから判定）
+        if source != "qr":
+            source = determine_traffic_source(referrer, user_agent)
         
-        # クリック情報を挿入
-        cursor.execute("""
-            INSERT INTO clicks (url_id, ip_address, user_agent, referrer, source, clicked_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            url_id,
-            client_ip,
-            user_agent[:500],  # 長すぎるuser-agentを制限
-            referrer[:500],    # 長すぎるreferrerを制限
-            source,
-            datetime.now().isoformat()
-        ))
+        # クリック情報をキューに追加（書き込みはバックグラウンドでまとめて実行）
+        click_queue.enqueue({
+            "url_id": url_id,
+            "ip_address": client_ip,
+            "user_agent": user_agent[:500],  # 長すぎるuser-agentを制限
+            "referrer": referrer[:500],      # 長すぎるreferrerを制限
+            "source": source,
+            "clicked_at": datetime.now().isoformat()
+        })
         
     except Exception as e:
         print(f"クリック記録エラー: {e}")
@@ -107,44 +141,14 @@ def determine_traffic_source(referrer: str, user_agent: str) -> str:
         return "direct"
     
     try:
-        parsed = urlparse(referrer)
-        domain = parsed.netloc.lower()
-        
-        # 主要なソーシャルメディア
-        social_platforms = {
-            "twitter.com": "twitter",
-            "t.co": "twitter",
-            "facebook.com": "facebook",
-            "instagram.com": "instagram",
-            "linkedin.com": "linkedin",
-            "youtube.com": "youtube",
-            "tiktok.com": "tiktok",
-            "line.me": "line"
-        }
-        
-        for platform_domain, platform_name in social_platforms.items():
-            if platform_domain in domain:
-                return platform_name
-        
-        # 検索エンジン
-        search_engines = {
-            "google": "google",
-            "yahoo": "yahoo",
-            "bing": "bing",
-            "duckduckgo": "duckduckgo"
-        }
-        
-        for engine_name, engine_source in search_engines.items():
-            if engine_name in domain:
-                return f"search_{engine_source}"
-        
-        # メールクライアント
-        if "mail" in domain or "outlook" in domain or "gmail" in domain:
-            return "email"
+        # ソーシャルメディア・検索エンジン・メール（コンパイル済みルールで判定）
+        domain, source = detailed_classifier.lookup(referrer)
+        if source:
+            return source
         
         # QRコードスキャナーの検出
         if "qr" in user_agent.lower() or "scanner" in user_agent.lower():
-            return "qr_code"
+            return "qr"
         
         # その他の参照元
         return f"referral_{domain}"
@@ -162,30 +166,10 @@ def validate_short_code(short_code: str) -> bool:
 async def redirect_from_qr(short_code: str, request: Request):
     """QRコード経由のリダイレクト処理"""
     try:
-        # 通常のリダイレクト処理を実行
-        response = await redirect_url(short_code, request)
-        
-        # QRコード経由であることを記録するため、sourceを更新
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # 最新のクリック記録を更新
-        cursor.execute("""
-            UPDATE clicks 
-            SET source = 'qr_code'
-            WHERE url_id = (
-                SELECT id FROM urls WHERE short_code = ?
-            )
-            AND clicked_at = (
-                SELECT MAX(clicked_at) FROM clicks 
-                WHERE url_id = (SELECT id FROM urls WHERE short_code = ?)
-            )
-        """, (short_code, short_code))
-        
-        conn.commit()
-        conn.close()
-        
-        return response
+        # QRコード経由としてクリックを記録し、通常のリダイレクト処理を実行
+        return await redirect_url(short_code, request, source="qr")
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"QRリダイレクト処理でエラーが発生しました: {str(e)}")
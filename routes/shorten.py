@@ -1,7 +1,5 @@
 from fastapi import APIRouter, HTTPException, Request, Form
 from fastapi.responses import JSONResponse
-import string
-import random
 import sqlite3
 from datetime import datetime
 from urllib.parse import urlparse
@@ -9,7 +7,11 @@ from urllib.parse import urlparse
 # 絶対インポートに変更（qrcode完全除去）
 import config
 from models import ShortenRequest, ShortenResponse
-from utils import generate_short_code, get_db_connection
+from utils import generate_short_code, get_db_connection, get_write_connection
+from db_executor import fast_query
+from cache import invalidate_url
+from bloom import short_code_filter
+from short_codes import get_allocator, insert_url
 
 router = APIRouter()
 
@@ -19,7 +21,8 @@ def generate_qr_code(url):
     return f"QR_CODE_PLACEHOLDER_{url}"
 
 @router.post("/api/shorten")
-async def shorten_url(data: dict):
+@fast_query
+def shorten_url(data: dict):
     """URL短縮APIエンドポイント（軽量版）"""
     try:
         # 入力データの検証
@@ -34,29 +37,20 @@ async def shorten_url(data: dict):
         if not original_url.startswith(('http://', 'https://')):
             raise HTTPException(status_code=400, detail="URLはhttp://またはhttps://で始まる必要があります")
         
-        # 短縮コード生成（重複チェック付き）
-        short_code = await generate_unique_short_code()
+        # 短縮コードを割り当ててデータベースに保存（事前の重複チェックなし）
+        with get_write_connection() as conn:
+            short_code = insert_url(conn, get_allocator(config.DB_PATH), {
+                "original_url": original_url,
+                "custom_name": custom_name,
+                "campaign_name": campaign_name,
+                "created_at": datetime.now().isoformat()
+            })
         
         # QRコード生成（軽量版）
         qr_code_data = generate_qr_code(f"{config.BASE_URL}/{short_code}")
         
-        # データベースに保存
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO urls (short_code, original_url, custom_name, campaign_name, created_at)
-            VALUES (?, ?, ?, ?, ?)
-        """, (
-            short_code,
-            original_url,
-            custom_name,
-            campaign_name,
-            datetime.now().isoformat()
-        ))
-        
-        conn.commit()
-        conn.close()
+        invalidate_url(short_code)
+        short_code_filter.add(short_code)
         
         # レスポンス作成
         response = ShortenResponse(
@@ -76,26 +70,6 @@ async def shorten_url(data: dict):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"URL短縮処理でエラーが発生しました: {str(e)}")
 
-async def generate_unique_short_code(length=6):
-    """重複しない短縮コードを生成"""
-    chars = string.ascii_letters + string.digits
-    max_attempts = 100
-    
-    for _ in range(max_attempts):
-        code = ''.join(random.choices(chars, k=length))
-        
-        # データベースで重複チェック
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM urls WHERE short_code = ?", (code,))
-        exists = cursor.fetchone()
-        conn.close()
-        
-        if not exists:
-            return code
-    
-    raise HTTPException(status_code=500, detail="短縮コードの生成に失敗しました")
-
 @router.post("/api/shorten-form")
 async def shorten_url_form(
     url: str = Form(...),
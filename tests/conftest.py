@@ -0,0 +1,15 @@
+import pytest
+
+import config
+import database
+from db_pool import get_pool
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """テストごとに空のDBを作成（スキーマはinit_dbと同じ）"""
+    path = str(tmp_path / "test.db")
+    monkeypatch.setattr(config, "DB_PATH", path)
+    assert database.init_db() is not False
+    yield path
+    get_pool(path).close_all()
@@ -0,0 +1,19 @@
+import bloom
+from bloom import ShortCodeFilter
+
+
+def test_codes_added_during_rebuild_are_kept(db_path, monkeypatch):
+    short_code_filter = ShortCodeFilter(db_path, enabled=True)
+    short_code_filter.rebuild()
+
+    class AddWhileBuilding(bloom.BloomFilter):
+        def __init__(self, *args):
+            super().__init__(*args)
+            # 全件を読み込んだ後、差し替える前に作成されたコード
+            short_code_filter.add("late01")
+
+    monkeypatch.setattr(bloom, "BloomFilter", AddWhileBuilding)
+    short_code_filter.rebuild()
+
+    assert "late01" in short_code_filter._filter
+    assert short_code_filter._pending is None
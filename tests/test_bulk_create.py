@@ -0,0 +1,49 @@
+import sqlite3
+
+import pytest
+
+from bulk_create import insert_urls
+from db_pool import get_pool
+from short_codes import SequenceCodeAllocator
+
+
+def _rows(*urls):
+    return [{"original_url": url, "created_at": "2024-01-01T00:00:00"} for url in urls]
+
+
+def _count_urls(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+
+
+def test_rolls_back_with_caller_transaction(db_path):
+    allocator = SequenceCodeAllocator(db_path)
+    with pytest.raises(RuntimeError):
+        with get_pool(db_path).writer() as conn:
+            inserted = insert_urls(conn, _rows("https://example.com/1", "https://example.com/2"), allocator)
+            assert [error for _, error in inserted] == [None, None]
+            # 挿入後もトランザクションは呼び出し元のもの（RELEASEで勝手にコミットされない）
+            assert conn.in_transaction
+            raise RuntimeError("caller failed")
+
+    assert _count_urls(db_path) == 0
+
+
+def test_commits_own_transaction_without_caller_transaction(db_path):
+    allocator = SequenceCodeAllocator(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        assert not conn.in_transaction
+        inserted = insert_urls(conn, _rows("https://example.com/1", "https://example.com/2"), allocator)
+        assert not conn.in_transaction
+        assert len({short_code for short_code, _ in inserted}) == 2
+        assert _count_urls(db_path) == 2
+
+        # 途中の行で失敗したバッチは1行も残さない
+        with pytest.raises(sqlite3.IntegrityError):
+            insert_urls(conn, _rows("https://example.com/3", None), allocator)
+        assert not conn.in_transaction
+    finally:
+        conn.close()
+
+    assert _count_urls(db_path) == 2
@@ -0,0 +1,79 @@
+import csv
+import io
+import sqlite3
+
+import pytest
+
+import config
+from bulk_import import BulkImporter, POSITIONAL_COLUMNS
+from db_pool import get_pool
+
+
+def _build_row(record):
+    return {"original_url": record["original_url"], "created_at": "2024-01-01T00:00:00"}
+
+
+def _chunk(*row_numbers):
+    return [
+        (row_number, {**dict.fromkeys(POSITIONAL_COLUMNS), "original_url": f"https://example.com/{row_number}"})
+        for row_number in row_numbers
+    ]
+
+
+def test_chunk_is_rolled_back_when_checkpoint_fails(db_path, tmp_path):
+    importer = BulkImporter(db_path, "http://test", _build_row, work_dir=str(tmp_path))
+    with get_pool(db_path).writer() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, upload_path, result_path, owner, submitted_at) VALUES ('job', 'in', 'out', 'me', 0)"
+        )
+        conn.execute("""
+            CREATE TRIGGER fail_checkpoint BEFORE UPDATE OF checkpoint_row ON jobs
+            BEGIN SELECT RAISE(ABORT, 'checkpoint failed'); END
+        """)
+
+    result_file = io.StringIO()
+    with pytest.raises(sqlite3.DatabaseError, match="checkpoint failed"):
+        importer._import_chunk({"id": "job", "owner": "me"}, _chunk(1, 2, 3), csv.writer(result_file), result_file)
+
+    conn = get_pool(db_path).reader()
+    assert conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0] == 0
+    assert conn.execute("SELECT checkpoint_row FROM jobs WHERE id = 'job'").fetchone()[0] == 0
+
+
+def test_chunk_commits_links_with_checkpoint(db_path, tmp_path):
+    importer = BulkImporter(db_path, "http://test", _build_row, work_dir=str(tmp_path))
+    with get_pool(db_path).writer() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, upload_path, result_path, owner, submitted_at) VALUES ('job', 'in', 'out', 'me', 0)"
+        )
+
+    result_file = io.StringIO()
+    importer._import_chunk({"id": "job", "owner": "me"}, _chunk(1, 2, 3), csv.writer(result_file), result_file)
+
+    conn = get_pool(db_path).reader()
+    assert conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0] == 3
+    assert tuple(conn.execute("SELECT checkpoint_row, created FROM jobs WHERE id = 'job'").fetchone()) == (3, 3)
+
+
+def test_job_fails_clearly_when_upload_is_missing(db_path, tmp_path):
+    importer = BulkImporter(db_path, "http://test", _build_row, work_dir=str(tmp_path))
+    upload_path = tmp_path / "job.upload"
+    result_path = tmp_path / "job.csv"
+    with get_pool(db_path).writer() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, status, upload_path, result_path, owner, checkpoint_row, submitted_at) "
+            "VALUES ('job', 'running', ?, ?, 'me', 10, 0)",
+            (str(upload_path), str(result_path))
+        )
+
+    importer._run(importer._load("job"))
+
+    job = importer.get("job")
+    assert job["status"] == "failed"
+    assert "アップロードされたファイルが見つからない" in job["error"]
+
+
+def test_work_dir_defaults_next_to_database(db_path, monkeypatch):
+    monkeypatch.setattr(config, "BULK_IMPORT_DIR", "")
+    importer = BulkImporter(db_path, "http://test", _build_row)
+    assert importer.work_dir == f"{db_path}.imports"
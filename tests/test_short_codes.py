@@ -0,0 +1,39 @@
+import sqlite3
+
+import pytest
+
+from db_pool import get_pool
+from short_codes import SequenceCodeAllocator
+
+
+def _sequence_value(db_path, allocator):
+    with sqlite3.connect(db_path) as conn:
+        row = conn.execute("SELECT next_value FROM short_code_sequence WHERE name = ?", (allocator._name,)).fetchone()
+    return row[0] if row else None
+
+
+def test_lease_joins_writer_transaction(db_path):
+    allocator = SequenceCodeAllocator(db_path, block_size=100)
+    with pytest.raises(RuntimeError):
+        with get_pool(db_path).writer() as conn:
+            # writer()の最初のallocateでもトランザクション内として扱われる
+            allocator.allocate(2, conn=conn)
+            raise RuntimeError("caller failed")
+
+    # 呼び出し元と一緒にロールバックされ、ブロックも持ち越さない
+    assert _sequence_value(db_path, allocator) is None
+    assert allocator.stats()["block_remaining"] == 0
+
+
+def test_lease_outside_transaction_commits_block(db_path):
+    allocator = SequenceCodeAllocator(db_path, block_size=100)
+    conn = sqlite3.connect(db_path)
+    try:
+        codes = allocator.allocate(2, conn=conn)
+        assert not conn.in_transaction
+    finally:
+        conn.close()
+
+    assert len(set(codes)) == 2
+    assert _sequence_value(db_path, allocator) == 100
+    assert allocator.stats()["block_remaining"] == 98
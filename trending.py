@@ -0,0 +1,293 @@
+import atexit
+import heapq
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict
+
+# 絶対インポート
+import config
+
+# 条件付きインポート（fcntlがない環境ではチェックポイントの書き込みをロックしない）
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ウィンドウ名 -> (ウィンドウの秒数, スロット数)。古いスロットから順に捨てて窓をスライドさせる
+WINDOWS = {
+    "5m": (300, 10),
+    "1h": (3600, 12),
+    "24h": (86400, 24)
+}
+DIMENSIONS = ("url", "campaign")
+
+
+class SpaceSaving:
+    """Space-Savingアルゴリズムによる上位K件（ヘビーヒッター）の近似集計
+
+    capacity個のカウンタだけを持ち、満杯のときに新しいキーが来たら最小のカウンタを
+    そのキーに譲る（譲られた値をerrorとして記録）。件数はcount以下にならず、
+    count - error以上であることが保証される。一度でも譲ったサマリ（evicted）では、
+    追跡していないキーの件数も最小のカウンタ以下であることしか分からない。
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.evicted = False
+        # (件数, キー)の最小ヒープ。更新のたびに追加し、古い値は取り出し時に読み捨てる
+        self._heap: list = []
+
+    def offer(self, key: str, count: int = 1) -> None:
+        """キーの出現をcount回分加算"""
+        counts = self.counts
+        if key in counts:
+            counts[key] += count
+        elif len(counts) < self.capacity:
+            counts[key] = count
+            self.errors[key] = 0
+        else:
+            min_count, min_key = self._pop_min()
+            del counts[min_key]
+            del self.errors[min_key]
+            counts[key] = min_count + count
+            self.errors[key] = min_count
+            self.evicted = True
+        heapq.heappush(self._heap, (counts[key], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild_heap()
+
+    def _pop_min(self) -> tuple:
+        while True:
+            count, key = heapq.heappop(self._heap)
+            if self.counts.get(key) == count:
+                return count, key
+
+    def min_count(self) -> int:
+        """追跡していないキーの件数の上限（一度も譲っていなければ0）"""
+        return min(self.counts.values()) if self.evicted and self.counts else 0
+
+    def _rebuild_heap(self) -> None:
+        self._heap = [(count, key) for key, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """チェックポイント用にシリアライズ（書き出し中の更新と競合しないよう複製する）"""
+        return {"counts": dict(self.counts), "errors": dict(self.errors)}
+
+    @classmethod
+    def from_dict(cls, capacity: int, data: Dict[str, Any]) -> "SpaceSaving":
+        """to_dict()の結果から復元（容量を減らした場合は件数の多い方を残す）"""
+        summary = cls(capacity)
+        counts = data.get("counts", {})
+        for key in sorted(counts, key=counts.get, reverse=True)[:summary.capacity]:
+            summary.counts[key] = counts[key]
+            summary.errors[key] = data.get("errors", {}).get(key, 0)
+        # 譲ったことがあれば誤差付きのキーが必ず残っている
+        summary.evicted = len(counts) > summary.capacity or any(summary.errors.values())
+        summary._rebuild_heap()
+        return summary
+
+
+class TrendingTracker:
+    """クリックの取り込みから直接更新する、スライディングウィンドウ付きのトレンド集計
+
+    ウィンドウごとに時間をスロットに区切り、スロットごとにリンク別・キャンペーン別の
+    Space-Savingサマリを持つ。問い合わせは有効なスロットのサマリを足し合わせるだけで
+    SQLiteには触れない。ウィンドウの範囲はスロット単位のため、最新スロットの途中までを含む
+    （5mなら直近4分30秒〜5分）。
+
+    ClickIngestQueueのコミット後リスナーとしてrecord()を登録する。短縮コードと
+    キャンペーン名はresolve_urls(url_idの集合) -> {url_id: (short_code, campaign_name)}で引く。
+    サマリは一定間隔でJSONファイルにチェックポイントし、再起動時に読み戻す。
+    """
+
+    def __init__(self, db_path: str, resolve_urls: Callable[[set], Dict[int, tuple]],
+                 capacity: int = None, checkpoint_path: str = None, checkpoint_seconds: float = None):
+        self.resolve_urls = resolve_urls
+        self.capacity = capacity or config.TRENDING_CAPACITY
+        self.checkpoint_path = checkpoint_path or config.TRENDING_CHECKPOINT_PATH or f"{db_path}.trending.json"
+        self.checkpoint_seconds = checkpoint_seconds or config.TRENDING_CHECKPOINT_SECONDS
+        # (ウィンドウ名, 次元) -> {スロット番号: SpaceSaving}
+        self._slots: Dict[tuple, Dict[int, SpaceSaving]] = {
+            (window, dimension): {} for window in WINDOWS for dimension in DIMENSIONS
+        }
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_checkpoint = time.monotonic()
+
+        self.recorded = 0
+        self.checkpoints = 0
+        self.checkpoint_errors = 0
+        self.last_checkpoint_ms = 0.0
+        self.restored = 0
+
+        self.load()
+        atexit.register(self.checkpoint)
+
+    def record(self, batch: list, now: float = None) -> None:
+        """書き込み済みのクリックを集計（ClickIngestQueue.add_commit_listenerに登録）"""
+        now = now or time.time()
+        urls = self.resolve_urls({click.get("url_id") for click in batch})
+
+        # バッチ内で先にまとめてからサマリに加算する
+        totals = {dimension: {} for dimension in DIMENSIONS}
+        for click in batch:
+            short_code, campaign_name = urls.get(click.get("url_id"), (None, None))
+            if short_code:
+                totals["url"][short_code] = totals["url"].get(short_code, 0) + 1
+            if campaign_name:
+                totals["campaign"][campaign_name] = totals["campaign"].get(campaign_name, 0) + 1
+
+        with self._lock:
+            for window, (seconds, slot_count) in WINDOWS.items():
+                slot = int(now // (seconds / slot_count))
+                for dimension in DIMENSIONS:
+                    slots = self._slots[(window, dimension)]
+                    summary = slots.get(slot)
+                    if summary is None:
+                        summary = slots[slot] = SpaceSaving(self.capacity)
+                        for old in [index for index in slots if index <= slot - slot_count]:
+                            del slots[old]
+                    for key, count in totals[dimension].items():
+                        summary.offer(key, count)
+            self.recorded += len(batch)
+            self._dirty = True
+
+        if time.monotonic() - self._last_checkpoint >= self.checkpoint_seconds:
+            self.checkpoint()
+
+    def top(self, window: str = "1h", dimension: str = "url", limit: int = 10,
+            now: float = None) -> Dict[str, Any]:
+        """ウィンドウ内のクリック数上位（不正なwindow・dimensionはValueError）"""
+        if window not in WINDOWS:
+            raise ValueError(f"windowは{', '.join(WINDOWS)}のいずれかを指定してください")
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"byは{', '.join(DIMENSIONS)}のいずれかを指定してください")
+        now = now or time.time()
+        seconds, slot_count = WINDOWS[window]
+        current = int(now // (seconds / slot_count))
+
+        counts: Dict[str, int] = {}
+        errors: Dict[str, int] = {}
+        # キーを追跡していないスロットでも、そのスロットの最小カウンタまではクリックがあり得る
+        floor_total = 0
+        covered: Dict[str, int] = {}
+        evicted = False
+        with self._lock:
+            for slot, summary in self._slots[(window, dimension)].items():
+                if slot <= current - slot_count:
+                    continue
+                floor = summary.min_count()
+                floor_total += floor
+                evicted = evicted or summary.evicted
+                for key, count in summary.counts.items():
+                    counts[key] = counts.get(key, 0) + count
+                    errors[key] = errors.get(key, 0) + summary.errors[key]
+                    covered[key] = covered.get(key, 0) + floor
+
+        for key in counts:
+            missing = floor_total - covered[key]
+            counts[key] += missing
+            errors[key] += missing
+
+        top_keys = heapq.nlargest(max(1, limit), counts, key=counts.get)
+        return {
+            "window": window,
+            "by": dimension,
+            "items": [
+                {
+                    "key": key,
+                    "clicks": counts[key],
+                    # Space-Savingの誤差を差し引いた保証値
+                    "min_clicks": counts[key] - errors[key]
+                }
+                for key in top_keys
+            ],
+            "approximate": evicted
+        }
+
+    def checkpoint(self) -> bool:
+        """サマリをファイルに書き出す（一時ファイルに書いてから置き換える）
+
+        複数ワーカーが同じファイルに書くため、一時ファイルはプロセスごとに分け、
+        書き込みと置き換えはロックファイルで直列化する（最後に書いたワーカーの内容が残る）。
+        """
+        with self._lock:
+            if not self._dirty:
+                return False
+            started = time.perf_counter()
+            data = {
+                "version": 1,
+                "saved_at": time.time(),
+                "slots": {
+                    f"{window}:{dimension}": {str(slot): summary.to_dict() for slot, summary in slots.items()}
+                    for (window, dimension), slots in self._slots.items()
+                }
+            }
+            self._dirty = False
+            self._last_checkpoint = time.monotonic()
+
+        temp_path = f"{self.checkpoint_path}.{os.getpid()}.tmp"
+        try:
+            with open(f"{self.checkpoint_path}.lock", "a") as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+                os.replace(temp_path, self.checkpoint_path)
+        except OSError as e:
+            print(f"⚠️ トレンド集計のチェックポイント保存エラー: {e}")
+            self.checkpoint_errors += 1
+            with self._lock:
+                self._dirty = True
+            return False
+
+        self.checkpoints += 1
+        self.last_checkpoint_ms = round((time.perf_counter() - started) * 1000, 3)
+        return True
+
+    def load(self) -> int:
+        """チェックポイントから復元し、復元したスロット数を返す（期限切れのスロットは読まない）"""
+        try:
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            print(f"⚠️ トレンド集計のチェックポイント読み込みエラー: {e}")
+            return 0
+
+        now = time.time()
+        restored = 0
+        with self._lock:
+            for name, slots in data.get("slots", {}).items():
+                window, _, dimension = name.partition(":")
+                if (window, dimension) not in self._slots:
+                    continue
+                seconds, slot_count = WINDOWS[window]
+                current = int(now // (seconds / slot_count))
+                for slot, summary in slots.items():
+                    if int(slot) > current - slot_count:
+                        self._slots[(window, dimension)][int(slot)] = SpaceSaving.from_dict(self.capacity, summary)
+                        restored += 1
+        self.restored = restored
+        print(f"✅ トレンド集計をチェックポイントから復元: {restored}スロット")
+        return restored
+
+    def stats(self) -> Dict[str, Any]:
+        """トレンド集計の統計を取得"""
+        with self._lock:
+            return {
+                "recorded": self.recorded,
+                "capacity": self.capacity,
+                "slots": {f"{window}:{dimension}": len(slots) for (window, dimension), slots in self._slots.items()},
+                "checkpoint_path": self.checkpoint_path,
+                "checkpoints": self.checkpoints,
+                "checkpoint_errors": self.checkpoint_errors,
+                "last_checkpoint_ms": self.last_checkpoint_ms,
+                "restored": self.restored
+            }
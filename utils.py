@@ -8,17 +8,20 @@ from urllib.parse import urlparse
 
 # 絶対インポートに変更
 import config
+from db_pool import get_pool
 
 def get_db_connection():
-    """データベース接続を取得"""
+    """データベース接続を取得（スレッドごとの読み取り用接続を再利用）"""
     try:
-        conn = sqlite3.connect(config.DB_PATH)
-        conn.row_factory = sqlite3.Row  # 辞書形式でアクセス可能
-        return conn
+        return get_pool(config.DB_PATH).reader()  # row_factoryはsqlite3.Row
     except Exception as e:
         print(f"データベース接続エラー: {e}")
         raise
 
+def get_write_connection():
+    """書き込み用接続を取得（withブロックの終了時にcommit）"""
+    return get_pool(config.DB_PATH).writer()
+
 def generate_short_code(length=6):
     """ランダムな短縮コードを生成"""
     chars = string.ascii_letters + string.digits
@@ -77,25 +80,27 @@ def get_click_stats(url_id: int):
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # 基本統計
+        # 基本統計（集計テーブルから）
         cursor.execute("""
             SELECT 
-                COUNT(*) as total_clicks,
-                COUNT(DISTINCT ip_address) as unique_visitors,
-                COUNT(CASE WHEN source = 'qr_code' THEN 1 END) as qr_clicks,
-                MAX(clicked_at) as last_clicked
-            FROM clicks 
-            WHERE url_id = ?
+                clicks as total_clicks,
+                unique_visitors,
+                qr_clicks,
+                last_clicked_at as last_clicked
+            FROM click_rollup_totals 
+            WHERE url_id = ? AND source = ''
         """, (url_id,))
         
-        stats = dict(cursor.fetchone())
+        row = cursor.fetchone()
+        stats = dict(row) if row else {
+            "total_clicks": 0, "unique_visitors": 0, "qr_clicks": 0, "last_clicked": None
+        }
         
         # ソース別統計
         cursor.execute("""
-            SELECT source, COUNT(*) as count
-            FROM clicks 
-            WHERE url_id = ?
-            GROUP BY source
+            SELECT source, clicks as count
+            FROM click_rollup_totals 
+            WHERE url_id = ? AND source != ''
             ORDER BY count DESC
         """, (url_id,))
         
@@ -123,14 +128,13 @@ def get_all_urls_stats():
                 u.custom_name,
                 u.campaign_name,
                 u.created_at,
-                COUNT(c.id) as total_clicks,
-                COUNT(DISTINCT c.ip_address) as unique_visitors,
-                COUNT(CASE WHEN c.source = 'qr_code' THEN 1 END) as qr_clicks,
-                MAX(c.clicked_at) as last_clicked
+                u.total_clicks as total_clicks,
+                COALESCE(t.unique_visitors, 0) as unique_visitors,
+                u.qr_clicks as qr_clicks,
+                u.last_clicked_at as last_clicked
             FROM urls u
-            LEFT JOIN clicks c ON u.id = c.url_id
+            LEFT JOIN click_rollup_totals t ON t.url_id = u.id AND t.source = ''
             WHERE u.is_active = 1
-            GROUP BY u.id
             ORDER BY u.created_at DESC
         """, ())
         